@@ -1,649 +1,118 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+import hmac
 import os
 import re
-import threading
 import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-import subprocess
 import sys
+from html import escape
+from urllib.parse import quote
 
-# Try multiple YouTube libraries for better compatibility
-try:
-    from pytubefix import YouTube, Playlist
-    YOUTUBE_LIB = 'pytubefix'
-    print("Using pytubefix library")
-except ImportError:
-    try:
-        from pytube import YouTube, Playlist
-        YOUTUBE_LIB = 'pytube'
-        print("Using pytube library")
-    except ImportError:
-        YOUTUBE_LIB = 'yt-dlp'
-        print("Using yt-dlp as fallback")
+from config import Config
+from jobs import FINISHED_STATUSES
+from janitor import DiskJanitor
+from file_serving import send_download
+from streaming import tee_to_file
+from utils import RateLimiter, canonical_cache_key, canonical_youtube_url, rate_limit
+from pipeline import (
+    DOWNLOAD_FOLDER, active_downloads, bandwidth, batch_video_links, download_scheduler, enqueue_download,
+    folder_index, get_video_info_safe, history_store, is_playlist_url, job_filename, job_queue, metadata_cache,
+    open_media_stream, playlist_runs, record_history, result_cache, result_key, stream_filename
+)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 
+# Behind a reverse proxy, take the client address from the X-Forwarded-For it
+# sets, so per-client rate and bandwidth limits see users instead of the proxy
+TRUSTED_PROXIES = Config.TRUSTED_PROXIES
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
 # Configuration
-DOWNLOAD_FOLDER = 'downloads'
-HISTORY_FILE = 'download_history.json'
-MAX_CONCURRENT_DOWNLOADS = 3
-
-# Create downloads directory if it doesn't exist
-if not os.path.exists(DOWNLOAD_FOLDER):
-    os.makedirs(DOWNLOAD_FOLDER)
-
-# Global variables for tracking downloads
-active_downloads = {}
-download_queue = []
-download_history = []
-
-def load_history():
-    """Load download history from file"""
-    global download_history
-    try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r') as f:
-                download_history = json.load(f)
-    except:
-        download_history = []
-
-def save_history():
-    """Save download history to file"""
-    try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(download_history, f, indent=2)
-    except:
-        pass
+EVENT_MIN_INTERVAL = Config.EVENT_MIN_INTERVAL
+EVENT_KEEPALIVE = Config.EVENT_KEEPALIVE
+MAX_BATCH_STATUS_IDS = 500
+MAX_BULK_URLS = 1000
+FILE_OFFLOAD = Config.FILE_OFFLOAD if Config.FILE_OFFLOAD in ('x-accel', 'x-sendfile') else None
+X_ACCEL_PREFIX = Config.X_ACCEL_PREFIX
+STREAM_SAVE = Config.STREAM_SAVE
+JOB_TTL = Config.JOB_TTL
+MAX_FINISHED_JOBS = Config.MAX_FINISHED_JOBS
+ADMIN_TOKEN = Config.ADMIN_TOKEN
+DISK_QUOTA_BYTES = Config.DISK_QUOTA_BYTES
+AUTO_CLEANUP_DAYS = Config.AUTO_CLEANUP_DAYS
 
-def sanitize_filename(filename):
-    """Remove invalid characters from filename"""
-    return re.sub(r'[<>:"/\\|?*]', '', filename)
+# Links /get_video_info and /download accept
+YOUTUBE_URL_PATTERNS = [re.compile(pattern) for pattern in (
+    r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=[\w-]+',
+    r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=[\w-]+',
+    r'(?:https?://)?youtu\.be/[\w-]+',
+    r'(?:https?://)?(?:www\.)?youtube\.com/.*'
+)]
 
-def get_video_info_safe(url):
-    """Get video info using multiple methods with fallbacks"""
-    try:
-        if YOUTUBE_LIB == 'pytubefix':
-            from pytubefix import YouTube, Playlist
-            if 'playlist' in url.lower() or 'list=' in url:
-                playlist = Playlist(url)
-                return {
-                    'success': True,
-                    'type': 'playlist',
-                    'title': playlist.title or 'Untitled Playlist',
-                    'thumbnail': '',
-                    'duration': 0,
-                    'description': f"Playlist with {len(list(playlist.video_urls))} videos"
-                }
-            else:
-                yt = YouTube(url)
-                return {
-                    'success': True,
-                    'type': 'video',
-                    'title': yt.title or 'Untitled Video',
-                    'thumbnail': yt.thumbnail_url or '',
-                    'duration': yt.length or 0,
-                    'description': (yt.description[:200] + '...') if yt.description and len(yt.description) > 200 else (yt.description or 'No description available')
-                }
-        
-        elif YOUTUBE_LIB == 'pytube':
-            from pytube import YouTube, Playlist
-            if 'playlist' in url.lower() or 'list=' in url:
-                playlist = Playlist(url)
-                return {
-                    'success': True,
-                    'type': 'playlist',
-                    'title': playlist.title or 'Untitled Playlist',
-                    'thumbnail': '',
-                    'duration': 0,
-                    'description': f"Playlist with {len(list(playlist.video_urls))} videos"
-                }
-            else:
-                yt = YouTube(url)
-                return {
-                    'success': True,
-                    'type': 'video',
-                    'title': yt.title or 'Untitled Video',
-                    'thumbnail': yt.thumbnail_url or '',
-                    'duration': yt.length or 0,
-                    'description': (yt.description[:200] + '...') if yt.description and len(yt.description) > 200 else (yt.description or 'No description available')
-                }
-        
-        else:  # yt-dlp fallback
-            return get_video_info_ytdlp(url)
-            
-    except Exception as e:
-        print(f"Error with {YOUTUBE_LIB}: {str(e)}")
-        # Try yt-dlp as fallback
-        try:
-            return get_video_info_ytdlp(url)
-        except Exception as e2:
-            print(f"Error with yt-dlp fallback: {str(e2)}")
-            return {
-                'success': False,
-                'error': f"Failed to get video info: {str(e)}"
-            }
-
-def get_video_info_ytdlp(url):
-    """Get video info using yt-dlp with enhanced options"""
-    try:
-        import subprocess
-        import json
-        
-        cmd = [
-            'yt-dlp', 
-            '--dump-json', 
-            '--no-download',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            '--extractor-args', 'youtube:player_client=web,android',
-            '--no-warnings',
-            '--no-check-certificate',
-            '--prefer-free-formats',
-            '--add-header', 'Accept-Language:en-US,en;q=0.9',
-            url
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=45)
-        
-        if result.returncode == 0:
-            # Parse the first line of JSON output
-            lines = result.stdout.strip().split('\n')
-            for line in lines:
-                if line.strip():
-                    try:
-                        info = json.loads(line)
-                        return {
-                            'success': True,
-                            'type': 'playlist' if info.get('_type') == 'playlist' else 'video',
-                            'title': info.get('title', 'Untitled Video'),
-                            'thumbnail': info.get('thumbnail', ''),
-                            'duration': info.get('duration', 0),
-                            'description': (info.get('description', '')[:200] + '...') if info.get('description', '') and len(info.get('description', '')) > 200 else (info.get('description', '') or 'No description available')
-                        }
-                    except json.JSONDecodeError:
-                        continue
-            
-            # If we get here, no valid JSON was found
-            return {
-                'success': False,
-                'error': "Could not parse video information"
-            }
-        else:
-            error_msg = result.stderr or "Unknown error"
-            return {
-                'success': False,
-                'error': f"yt-dlp info error: {error_msg}"
-            }
-    except subprocess.TimeoutExpired:
-        return {
-            'success': False,
-            'error': "Timeout while getting video information"
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': f"yt-dlp info failed: {str(e)}"
-        }
+# Per-client request budgets: extracting info and starting downloads is
+# expensive, status polling and file requests are cheap. With a shared job
+# backend the buckets are shared by every worker process too
+limiter_store = getattr(active_downloads, 'store', None)
+expensive_limiter = RateLimiter('expensive', Config.RATE_LIMIT_PER_MINUTE,
+                                max_clients=Config.RATE_LIMIT_MAX_CLIENTS, store=limiter_store)
+cheap_limiter = RateLimiter('cheap', Config.STATUS_RATE_LIMIT_PER_MINUTE,
+                            max_clients=Config.RATE_LIMIT_MAX_CLIENTS, store=limiter_store)
 
-def download_video_safe(url, quality='highest', download_type='video', download_id=None):
-    """Download video using multiple methods with fallbacks"""
-    try:
-        if YOUTUBE_LIB == 'pytubefix':
-            return download_with_pytubefix(url, quality, download_type, download_id)
-        elif YOUTUBE_LIB == 'pytube':
-            return download_with_pytube(url, quality, download_type, download_id)
-        else:
-            return download_with_ytdlp(url, quality, download_type, download_id)
-    except Exception as e:
-        print(f"Error with {YOUTUBE_LIB}: {str(e)}")
-        # Try yt-dlp as fallback
-        try:
-            return download_with_ytdlp(url, quality, download_type, download_id)
-        except Exception as e2:
-            print(f"Error with yt-dlp fallback: {str(e2)}")
-            if download_id and download_id in active_downloads:
-                active_downloads[download_id]['status'] = 'error'
-                active_downloads[download_id]['error'] = str(e)
-            return False
-
-def download_with_pytubefix(url, quality, download_type, download_id):
-    """Download using pytubefix with enhanced settings"""
-    try:
-        from pytubefix import YouTube
-        
-        def progress_callback(stream, chunk, bytes_remaining):
-            if download_id and download_id in active_downloads:
-                total_size = stream.filesize
-                downloaded = total_size - bytes_remaining
-                progress = (downloaded / total_size) * 100
-                active_downloads[download_id]['progress'] = progress
-        
-        # Initialize with enhanced settings
-        yt = YouTube(
-            url, 
-            on_progress_callback=progress_callback,
-            use_oauth=False,
-            allow_oauth_cache=False
-        )
-        
-        if download_type == 'audio':
-            # Try different audio stream options
-            stream = (yt.streams.filter(only_audio=True, file_extension='mp4').first() or
-                     yt.streams.filter(only_audio=True).first())
-            filename = f"{sanitize_filename(yt.title)}.mp3"
-        else:
-            # Priority: Get video WITH audio - progressive streams are guaranteed to have both
-            if quality == 'highest':
-                # First try progressive (video+audio), then fallback with explicit audio check
-                stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
-                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').desc().first() or
-                         yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first())
-            elif quality == 'lowest':
-                # Try progressive first for lowest quality with audio
-                stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').asc().first() or
-                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').asc().first() or
-                         yt.streams.filter(file_extension='mp4').order_by('resolution').asc().first())
-            else:
-                # Try exact quality with progressive streams first (guaranteed video+audio)
-                stream = (yt.streams.filter(progressive=True, file_extension='mp4', res=quality).first() or
-                         yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
-                         yt.streams.filter(file_extension='mp4', res=quality, adaptive=False).first() or
-                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').desc().first())
-            
-            # Final fallback - ensure we get SOMETHING with audio
-            if not stream:
-                print("Warning: No progressive stream found, trying any available stream")
-                stream = yt.streams.filter(file_extension='mp4').first() or yt.streams.first()
-            
-            filename = f"{sanitize_filename(yt.title)}.mp4"
-        
-        if stream:
-            filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-            
-            # Download with retry mechanism
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    stream.download(filename=filepath)
-                    break
-                except Exception as e:
-                    print(f"Download attempt {attempt + 1} failed: {str(e)}")
-                    if attempt == max_retries - 1:
-                        raise e
-                    time.sleep(2)  # Wait before retry
-            
-            if download_id and download_id in active_downloads:
-                active_downloads[download_id]['status'] = 'completed'
-                active_downloads[download_id]['progress'] = 100
-                active_downloads[download_id]['filepath'] = filepath
-            
-            return filename
-        else:
-            raise Exception("No suitable stream found")
-            
-    except Exception as e:
-        print(f"Pytubefix download error: {str(e)}")
-        if download_id and download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'error'
-            active_downloads[download_id]['error'] = f"Pytubefix error: {str(e)}"
-        return False
-
-def download_with_pytube(url, quality, download_type, download_id):
-    """Download using original pytube"""
-    from pytube import YouTube
-    
-    def progress_callback(stream, chunk, bytes_remaining):
-        if download_id and download_id in active_downloads:
-            total_size = stream.filesize
-            downloaded = total_size - bytes_remaining
-            progress = (downloaded / total_size) * 100
-            active_downloads[download_id]['progress'] = progress
-    
-    yt = YouTube(url, on_progress_callback=progress_callback)
-    
-    if download_type == 'audio':
-        stream = yt.streams.filter(only_audio=True).first()
-        filename = f"{sanitize_filename(yt.title)}.mp3"
-    else:
-        # Prioritize progressive streams (video + audio) for complete downloads
-        if quality == 'highest':
-            stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
-                     yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first() or
-                     yt.streams.get_highest_resolution())
-        elif quality == 'lowest':
-            stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').asc().first() or
-                     yt.streams.filter(file_extension='mp4').order_by('resolution').asc().first() or
-                     yt.streams.get_lowest_resolution())
-        else:
-            # Try exact quality with progressive (video+audio) first
-            stream = (yt.streams.filter(progressive=True, file_extension='mp4', res=quality).first() or
-                     yt.streams.filter(file_extension='mp4', res=quality).first() or
-                     yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
-                     yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first() or
-                     yt.streams.get_highest_resolution())
-        
-        filename = f"{sanitize_filename(yt.title)}.mp4"
-    
-    if stream:
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-        stream.download(filename=filepath)
-        
-        if download_id and download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'completed'
-            active_downloads[download_id]['progress'] = 100
-            active_downloads[download_id]['filepath'] = filepath
-        
-        return filename
-    return False
+# Keeps the folder index current as files change outside the pipeline
+folder_index.start()
 
-def download_with_ytdlp(url, quality, download_type, download_id):
-    """Download using yt-dlp with enhanced options to bypass restrictions"""
-    try:
-        import subprocess
-        
-        # Get video title first for filename
-        info_cmd = [
-            'yt-dlp', 
-            '--dump-json', 
-            '--no-download',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            '--extractor-args', 'youtube:player_client=web',
-            url
-        ]
-        
-        try:
-            info_result = subprocess.run(info_cmd, capture_output=True, text=True, timeout=30)
-            if info_result.returncode == 0:
-                import json
-                info = json.loads(info_result.stdout.split('\n')[0])
-                video_title = sanitize_filename(info.get('title', 'Unknown'))
-            else:
-                video_title = 'Unknown'
-        except:
-            video_title = 'Unknown'
-        
-        if download_type == 'audio':
-            filename = f"{video_title}.%(ext)s"
-            cmd = [
-                'yt-dlp', 
-                '-x', 
-                '--audio-format', 'mp3',
-                '--audio-quality', '0',  # best audio quality
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                '--extractor-args', 'youtube:player_client=web,android',
-                '--no-warnings',
-                '--no-check-certificate',
-                '--prefer-free-formats',
-                '--add-header', 'Accept-Language:en-US,en;q=0.9',
-                '--sleep-interval', '1',
-                '--max-sleep-interval', '5',
-                '-o', os.path.join(DOWNLOAD_FOLDER, filename),
-                url
-            ]
-        else:
-            filename = f"{video_title}.%(ext)s"
-            
-            # Set quality format - FORCE video+audio combination
-            if quality == 'highest':
-                format_selector = 'best[ext=mp4][acodec!=none][vcodec!=none]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-            elif quality == 'lowest':
-                format_selector = 'worst[ext=mp4][acodec!=none][vcodec!=none]/worstvideo[ext=mp4]+worstaudio[ext=m4a]/worst[ext=mp4]/worst'
-            else:
-                # Extract resolution number (e.g., "720p" -> "720")
-                res = quality.replace('p', '') if 'p' in quality else '720'
-                format_selector = f'best[height<={res}][ext=mp4][acodec!=none][vcodec!=none]/bestvideo[height<={res}][ext=mp4]+bestaudio[ext=m4a]/best[height<={res}][ext=mp4]/best[height<={res}]/best'
-            
-            cmd = [
-                'yt-dlp',
-                '-f', format_selector,
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                '--extractor-args', 'youtube:player_client=web,android',
-                '--no-warnings',
-                '--no-check-certificate',
-                '--prefer-free-formats',
-                '--add-header', 'Accept-Language:en-US,en;q=0.9',
-                '--sleep-interval', '1',
-                '--max-sleep-interval', '5',
-                '--embed-thumbnail',
-                '--add-metadata',
-                '-o', os.path.join(DOWNLOAD_FOLDER, filename),
-                url
-            ]
-        
-        # Update progress simulation (since yt-dlp progress is hard to parse in real-time)
-        def update_progress():
-            progress_steps = [10, 25, 40, 55, 70, 85, 95]
-            for step in progress_steps:
-                if download_id and download_id in active_downloads:
-                    if active_downloads[download_id]['status'] == 'downloading':
-                        active_downloads[download_id]['progress'] = step
-                        time.sleep(2)
-                    else:
-                        break
-        
-        # Start progress simulation
-        if download_id and download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'downloading'
-            progress_thread = threading.Thread(target=update_progress)
-            progress_thread.daemon = True
-            progress_thread.start()
-        
-        # Execute download
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)  # 10 minute timeout
-        
-        if result.returncode == 0:
-            # Find the downloaded file
-            import glob
-            pattern = os.path.join(DOWNLOAD_FOLDER, f"{video_title}.*")
-            files = glob.glob(pattern)
-            
-            if not files:
-                # Fallback: look for any recent files
-                pattern = os.path.join(DOWNLOAD_FOLDER, "*")
-                files = glob.glob(pattern)
-                if files:
-                    # Get the most recently created file
-                    latest_file = max(files, key=os.path.getctime)
-                    filename = os.path.basename(latest_file)
-                else:
-                    filename = f"{video_title}.{'mp3' if download_type == 'audio' else 'mp4'}"
-            else:
-                latest_file = max(files, key=os.path.getctime)
-                filename = os.path.basename(latest_file)
-            
-            if download_id and download_id in active_downloads:
-                active_downloads[download_id]['status'] = 'completed'
-                active_downloads[download_id]['progress'] = 100
-                active_downloads[download_id]['filepath'] = latest_file if 'latest_file' in locals() else os.path.join(DOWNLOAD_FOLDER, filename)
-            
-            return filename
-        else:
-            error_msg = result.stderr or "Download failed"
-            print(f"yt-dlp error: {error_msg}")
-            if download_id and download_id in active_downloads:
-                active_downloads[download_id]['status'] = 'error'
-                active_downloads[download_id]['error'] = f"yt-dlp error: {error_msg}"
-            return False
-            
-    except subprocess.TimeoutExpired:
-        error_msg = "Download timeout - video may be too large or connection too slow"
-        print(error_msg)
-        if download_id and download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'error'
-            active_downloads[download_id]['error'] = error_msg
-        return False
-    except Exception as e:
-        error_msg = f"Download exception: {str(e)}"
-        print(error_msg)
-        if download_id and download_id in active_downloads:
-            active_downloads[download_id]['status'] = 'error'
-            active_downloads[download_id]['error'] = error_msg
-        return False
-
-def format_bytes(bytes):
-    """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if bytes < 1024.0:
-            return f"{bytes:.1f} {unit}"
-        bytes /= 1024.0
-    return f"{bytes:.1f} TB"
-
-def progress_callback(stream, chunk, bytes_remaining):
-    """Progress callback for downloads"""
-    download_id = getattr(stream, 'download_id', None)
-    if download_id and download_id in active_downloads:
-        total_size = stream.filesize
-        downloaded = total_size - bytes_remaining
-        progress = (downloaded / total_size) * 100 if total_size > 0 else 0
-        
-        active_downloads[download_id].update({
-            'progress': round(progress, 1),
-            'downloaded': format_bytes(downloaded),
-            'total_size': format_bytes(total_size),
-            'status': 'downloading'
-        })
+# Keeps DOWNLOAD_FOLDER within DISK_QUOTA_BYTES and AUTO_CLEANUP_DAYS,
+# removing the least recently served files first
+janitor = DiskJanitor(folder_index, quota_bytes=DISK_QUOTA_BYTES, max_age=AUTO_CLEANUP_DAYS * 86400,
+                      interval=Config.CLEANUP_INTERVAL, on_evict=result_cache.forget_path,
+                      lock_path=Config.HISTORY_DB + '.cleanup.lock')
+janitor.start()
 
-def download_video(url, quality, download_type, download_id):
-    """Download a single video"""
-    try:
-        active_downloads[download_id]['status'] = 'processing'
-        
-        yt = YouTube(url)
-        yt.register_on_progress_callback(progress_callback)
-        
-        # Set download_id on the stream for progress tracking
-        if download_type == 'audio':
-            stream = yt.streams.filter(only_audio=True).first()
-        elif quality == 'highest':
-            stream = yt.streams.get_highest_resolution()
-        elif quality == 'lowest':
-            stream = yt.streams.get_lowest_resolution()
-        else:
-            stream = yt.streams.filter(res=quality).first()
-            if not stream:
-                stream = yt.streams.get_highest_resolution()
-        
-        if not stream:
-            raise Exception("No suitable stream found")
-            
-        stream.download_id = download_id
-        
-        # Create filename
-        safe_title = sanitize_filename(yt.title)
-        if download_type == 'audio':
-            filename = f"{safe_title}.mp4"  # pytube downloads audio as mp4
-        else:
-            filename = f"{safe_title}_{quality}.{stream.subtype}"
-            
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-        
-        # Update download info
-        active_downloads[download_id].update({
-            'title': yt.title,
-            'thumbnail': yt.thumbnail_url,
-            'duration': yt.length,
-            'filename': filename,
-            'filepath': filepath
-        })
-        
-        # Download the file
-        stream.download(output_path=DOWNLOAD_FOLDER, filename=filename)
-        
-        # Mark as completed
-        active_downloads[download_id]['status'] = 'completed'
-        active_downloads[download_id]['progress'] = 100
-        active_downloads[download_id]['completed_at'] = datetime.now().isoformat()
-        
-        # Add to history
-        history_entry = {
+def archive_job(download_id, state):
+    """Called when a finished job is evicted from active_downloads"""
+    playlist_runs.pop(download_id, None)
+    # Completed downloads are already in the history; keep a record of failures too
+    if state.get('status') == 'error':
+        record_history({
             'id': download_id,
-            'title': yt.title,
-            'url': url,
-            'quality': quality,
-            'type': download_type,
-            'filename': filename,
+            'url': state.get('url'),
+            'filename': state.get('filename'),
+            'quality': state.get('quality'),
+            'type': state.get('type'),
             'downloaded_at': datetime.now().isoformat(),
-            'file_size': format_bytes(os.path.getsize(filepath)) if os.path.exists(filepath) else 'Unknown'
-        }
-        download_history.append(history_entry)
-        save_history()
-        
-    except Exception as e:
-        active_downloads[download_id]['status'] = 'error'
-        active_downloads[download_id]['error'] = str(e)
-
-def download_playlist(url, quality, download_type, download_id):
-    """Download all videos from a playlist"""
-    try:
-        active_downloads[download_id]['status'] = 'processing'
-        
-        # Import the appropriate library
-        if YOUTUBE_LIB == 'pytubefix':
-            from pytubefix import Playlist
-        else:
-            from pytube import Playlist
-            
-        playlist = Playlist(url)
-        video_urls = list(playlist.video_urls)
-        
-        active_downloads[download_id].update({
-            'total_videos': len(video_urls),
-            'completed_videos': 0,
-            'playlist_title': playlist.title,
-            'downloaded_files': []
+            'status': 'error',
+            'error': state.get('error'),
+            'is_playlist': bool(state.get('is_playlist'))
         })
-        
-        successful_downloads = 0
-        
-        for i, video_url in enumerate(video_urls):
-            try:
-                print(f"Downloading video {i+1}/{len(video_urls)}: {video_url}")
-                
-                # Create individual download for each video
-                video_download_id = f"{download_id}_video_{i}"
-                active_downloads[video_download_id] = {
-                    'url': video_url,
-                    'quality': quality,
-                    'type': download_type,
-                    'status': 'queued',
-                    'progress': 0,
-                    'parent_playlist': download_id
-                }
-                
-                result = download_video_safe(video_url, quality, download_type, video_download_id)
-                
-                if result:
-                    successful_downloads += 1
-                    active_downloads[download_id]['downloaded_files'].append(result)
-                    print(f"Successfully downloaded: {result}")
-                
-                active_downloads[download_id]['completed_videos'] += 1
-                active_downloads[download_id]['progress'] = (active_downloads[download_id]['completed_videos'] / len(video_urls)) * 100
-                
-            except Exception as e:
-                print(f"Error downloading video {i+1}: {e}")
-                continue
-        
-        active_downloads[download_id]['status'] = 'completed'
-        active_downloads[download_id]['progress'] = 100
-        
-        # Return summary of downloads
-        return f"Playlist: {successful_downloads}/{len(video_urls)} videos downloaded"
-        
-    except Exception as e:
-        print(f"Playlist download error: {str(e)}")
-        active_downloads[download_id]['status'] = 'error'
-        active_downloads[download_id]['error'] = str(e)
-        return False
+
+active_downloads.start_eviction(JOB_TTL, MAX_FINISHED_JOBS, on_evict=archive_job)
+
+def finished_jobs(download_ids):
+    """Those of download_ids that have finished or no longer exist"""
+    jobs = active_downloads.get_many(download_ids)
+    return {download_id for download_id in download_ids
+            if download_id not in jobs or jobs[download_id].get('status') in FINISHED_STATUSES}
+
+# /download claims result keys here for jobs the daemon runs and releases in
+# its own process; drop those claims once the jobs have finished
+if job_queue is not None:
+    result_cache.start_expiry(finished_jobs)
+
+def is_youtube_url(url):
+    return any(pattern.match(url) for pattern in YOUTUBE_URL_PATTERNS)
 
 @app.route('/')
 def index():
     return render_template('home.html')
 
 @app.route('/get_video_info', methods=['POST'])
+@rate_limit(expensive_limiter)
 def get_video_info():
     """Get video information without downloading"""
     try:
@@ -652,14 +121,7 @@ def get_video_info():
             return jsonify({'error': 'URL is required'}), 400
         
         # Validate YouTube URL
-        youtube_patterns = [
-            r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=[\w-]+',
-            r'(?:https?://)?youtu\.be/[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/.*'
-        ]
-        
-        if not any(re.match(pattern, url) for pattern in youtube_patterns):
+        if not is_youtube_url(url):
             return jsonify({'error': 'Please provide a valid YouTube URL'}), 400
         
         info = get_video_info_safe(url)
@@ -674,8 +136,10 @@ def get_video_info():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/download', methods=['POST'])
+@rate_limit(expensive_limiter)
 def download():
-    """Start download process"""
+    """Start download process. Returns as soon as the job exists; looking the
+    video or playlist up is the job's first stage (status 'analyzing')"""
     try:
         data = request.json
         url = data.get('url')
@@ -686,127 +150,391 @@ def download():
             return jsonify({'error': 'URL is required'}), 400
         
         # Validate YouTube URL
-        youtube_patterns = [
-            r'(?:https?://)?(?:www\.)?youtube\.com/watch\?v=[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=[\w-]+',
-            r'(?:https?://)?youtu\.be/[\w-]+',
-            r'(?:https?://)?(?:www\.)?youtube\.com/.*'
-        ]
-        
-        if not any(re.match(pattern, url) for pattern in youtube_patterns):
+        if not is_youtube_url(url):
             return jsonify({'error': 'Please provide a valid YouTube URL'}), 400
         
         # Generate unique download ID
         download_id = str(uuid.uuid4())
         
-        # Get video info first to check if it's a playlist
-        info = get_video_info_safe(url)
-        if not info['success']:
-            return jsonify({'error': 'Failed to analyze video/playlist'}), 400
-
-        filename = f"{sanitize_filename(info['title'])}.{'mp3' if download_type == 'audio' else 'mp4'}"
-        
-        # Initialize download tracking
+        # Info an earlier /get_video_info already fetched names the job right away
+        is_playlist = is_playlist_url(url)
+        info = metadata_cache.get(canonical_cache_key(url))
+        title = info['title'] if info and info.get('success') else None
+        filename = job_filename(title, url, quality, download_type) if title else None
+        
+        # The same video, quality and type was downloaded before
+        key = None if is_playlist else result_key(url, quality, download_type)
+        if key:
+            cached = result_cache.lookup(key)
+            if cached:
+                return jsonify(serve_cached_result(download_id, url, quality, download_type, cached))
+        
+        # Initialize download tracking. The record exists before the key is
+        # claimed, so a concurrent identical request never sees a live owner as gone
         active_downloads[download_id] = {
             'url': url,
             'filename': filename,
+            'title': title,
             'quality': quality,
             'type': download_type,
-            'status': 'starting',
+            'status': 'queued',
             'progress': 0,
             'started_at': datetime.now(),
             'error': None,
             'filepath': None,
-            'is_playlist': info.get('type') == 'playlist'
+            'is_playlist': is_playlist,
+            'result_key': key,
+            'client': request.remote_addr
         }
         
-        # Start download in background thread
-        def download_worker():
-            try:
-                active_downloads[download_id]['status'] = 'downloading'
-                
-                # Check if it's a playlist
-                if info.get('type') == 'playlist':
-                    result = download_playlist(url, quality, download_type, download_id)
-                else:
-                    result = download_video_safe(url, quality, download_type, download_id)
-                
-                if result:
-                    # Add to history
-                    history_item = {
-                        'id': download_id,
-                        'url': url,
-                        'filename': result if not info.get('type') == 'playlist' else f"Playlist: {info['title']}",
-                        'quality': quality,
-                        'type': download_type,
-                        'downloaded_at': datetime.now().isoformat(),
-                        'status': 'completed',
-                        'is_playlist': info.get('type') == 'playlist'
-                    }
-                    download_history.append(history_item)
-                    save_history()
-                    print(f"Download completed: {result}")
-                else:
-                    if download_id in active_downloads:
-                        active_downloads[download_id]['status'] = 'error'
-                        if 'error' not in active_downloads[download_id]:
-                            active_downloads[download_id]['error'] = 'Download failed'
-                    print(f"Download failed for: {url}")
-                    
-            except Exception as e:
-                print(f"Download error: {str(e)}")
-                if download_id in active_downloads:
-                    active_downloads[download_id]['status'] = 'error'
-                    active_downloads[download_id]['error'] = str(e)
-        
-        download_thread = threading.Thread(target=download_worker)
-        download_thread.daemon = True
-        download_thread.start()
+        # ... or is being downloaded now: attach to that job
+        if key:
+            owner = result_cache.claim(key, download_id)
+            owner_state = active_downloads.get(owner) if owner != download_id else None
+            if owner != download_id and (owner_state is None or owner_state.get('status') in FINISHED_STATUSES):
+                # The owner finished without a usable result, or was deleted or
+                # evicted, and its claim was never released here
+                result_cache.release(key, owner)
+                owner = result_cache.claim(key, download_id)
+                owner_state = active_downloads.get(owner) if owner != download_id else None
+            if owner != download_id:
+                active_downloads.pop(download_id, None)
+                owner_state = owner_state or {}
+                return jsonify({
+                    'download_id': owner,
+                    'filename': owner_state.get('filename'),
+                    'status': owner_state.get('status'),
+                    'queue_position': queue_position(owner),
+                    'attached': True
+                })
+        
+        position = enqueue_download(download_id, {
+            'url': url,
+            'quality': quality,
+            'download_type': download_type,
+            'is_playlist': is_playlist,
+            'title': title,
+            'key': key
+        })
         
         return jsonify({
             'download_id': download_id,
             'filename': filename,
-            'status': 'started'
+            'status': 'queued',
+            'queue_position': position
         })
         
     except Exception as e:
         print(f"Error in download route: {str(e)}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+def read_bulk_urls():
+    """Links submitted to /download_batch: a JSON ``urls`` list or ``text``, or an uploaded text file"""
+    upload = request.files.get('file')
+    if upload is not None:
+        upload.seek(0)
+        return upload.read().decode('utf-8', errors='replace').split(), request.form
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if urls is None:
+        urls = (data.get('text') or '').split()
+    if not isinstance(urls, list):
+        urls = []
+    return [url for url in urls if isinstance(url, str)], data
+
+@app.route('/download_batch', methods=['POST'])
+@rate_limit(expensive_limiter, cost=lambda: max(1, len(read_bulk_urls()[0])))
+def download_batch_route():
+    """Queue many links as one job: each is reduced to its video or playlist ID,
+    duplicates are dropped and the rest download with aggregate progress"""
+    urls, options = read_bulk_urls()
+    quality = options.get('quality', 'highest')
+    download_type = options.get('type', 'video')
+    
+    canonical = {}
+    rejected = []
+    duplicates = 0
+    for url in urls:
+        url = url.strip().strip(',;')
+        if not url:
+            continue
+        normalized = canonical_youtube_url(url)
+        if normalized is None:
+            rejected.append(url)
+        elif normalized in canonical:
+            duplicates += 1
+        else:
+            canonical[normalized] = url
+    
+    if not canonical:
+        return jsonify({'error': 'No valid YouTube URLs provided', 'rejected': rejected[:100]}), 400
+    if len(canonical) > MAX_BULK_URLS:
+        return jsonify({'error': f'At most {MAX_BULK_URLS} links per batch'}), 400
+    
+    batch = list(canonical)
+    download_id = str(uuid.uuid4())
+    title = f"{len(batch)} links"
+    active_downloads[download_id] = {
+        'url': batch[0],
+        'filename': f"Batch: {title}",
+        'quality': quality,
+        'type': download_type,
+        'status': 'queued',
+        'progress': 0,
+        'started_at': datetime.now(),
+        'error': None,
+        'filepath': None,
+        'is_playlist': True,
+        'is_batch': True,
+        'result_key': None,
+        'client': request.remote_addr,
+        'playlist_title': f"Batch of {title}",
+        'total_videos': None,
+        'expected_videos': batch_video_links(batch),
+        'discovered_videos': 0,
+        'completed_videos': 0,
+        'failed_videos': 0,
+        'downloaded_files': []
+    }
+    queue_position = enqueue_download(download_id, {
+        'url': batch[0],
+        'quality': quality,
+        'download_type': download_type,
+        'is_playlist': True,
+        'title': title,
+        'key': None,
+        'urls': batch
+    })
+    
+    return jsonify({
+        'download_id': download_id,
+        'status': 'queued',
+        'queue_position': queue_position,
+        'accepted': len(batch),
+        'duplicates': duplicates,
+        'rejected': rejected[:100]
+    })
+
+def serve_cached_result(download_id, url, quality, download_type, filepath):
+    """Register an already-completed job for a file an identical download produced"""
+    filename = os.path.basename(filepath)
+    active_downloads[download_id] = {
+        'url': url,
+        'filename': filename,
+        'quality': quality,
+        'type': download_type,
+        'status': 'completed',
+        'progress': 100,
+        'started_at': datetime.now(),
+        'error': None,
+        'filepath': filepath,
+        'is_playlist': False,
+        'cached': True
+    }
+    record_history({
+        'id': download_id,
+        'url': url,
+        'filename': filename,
+        'quality': quality,
+        'type': download_type,
+        'downloaded_at': datetime.now().isoformat(),
+        'status': 'completed',
+        'is_playlist': False
+    })
+    return {'download_id': download_id, 'filename': filename, 'status': 'completed', 'cached': True}
+
+def job_status(download_id):
+    """Snapshot of a job's state for the API, or None if it is unknown"""
+    state = active_downloads.get(download_id)
+    if state is None:
+        return None
+    status = dict(state)
+    run = playlist_runs.get(download_id)
+    if run is not None:
+        status['progress'] = run.progress()
+    position = download_scheduler.queue_position(download_id)
+    if position is not None:
+        wait = download_scheduler.estimated_wait(download_id) or 0
+        status['queue_position'] = position
+        status['estimated_start'] = (datetime.now() + timedelta(seconds=wait)).isoformat()
+        status['estimated_wait_seconds'] = round(wait)
+    elif job_queue is not None and status.get('status') == 'queued':
+        status['queue_position'] = job_queue.position(download_id)
+    return status
+
+def queue_position(download_id):
+    """1-based position of a waiting job, or None"""
+    position = download_scheduler.queue_position(download_id)
+    if position is None and job_queue is not None:
+        position = job_queue.position(download_id)
+    return position
+
 @app.route('/download_status/<download_id>')
+@rate_limit(cheap_limiter)
 def download_status(download_id):
     """Get download status"""
-    if download_id in active_downloads:
-        return jsonify(active_downloads[download_id])
+    status = job_status(download_id)
+    if status is not None:
+        return jsonify(status)
     else:
         return jsonify({'error': 'Download not found'}), 404
 
+def playlist_children(download_id):
+    """IDs of the per-video jobs of a playlist job"""
+    run = playlist_runs.get(download_id)
+    if run is not None:
+        count = len(run.results)
+    else:
+        state = active_downloads.get(download_id) or {}
+        count = state.get('total_videos') or state.get('discovered_videos') or 0
+    return [f"{download_id}_video_{index}" for index in range(count)]
+
+@app.route('/download_status', methods=['GET', 'POST'])
+@rate_limit(cheap_limiter)
+def batch_download_status():
+    """Status of many jobs in one response.
+
+    Takes ``ids`` (list, or comma-separated in the query string), an optional
+    ``since`` version cursor, and ``include_children`` to expand playlists
+    into their per-video jobs. With ``since``, only jobs that changed after
+    that version are returned; pass back the returned ``version`` next time.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    ids = data.get('ids')
+    if ids is None:
+        ids = [i for i in request.args.get('ids', '').split(',') if i]
+    since = data.get('since', request.args.get('since'))
+    include_children = data.get('include_children', request.args.get('include_children') in ('1', 'true'))
+    
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'ids is required'}), 400
+    if len(ids) > MAX_BATCH_STATUS_IDS:
+        return jsonify({'error': f'At most {MAX_BATCH_STATUS_IDS} ids per request'}), 400
+    try:
+        since = int(since) if since is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'since must be an integer version'}), 400
+    
+    # Read the version first so nothing that changes during this request is missed next time
+    version = active_downloads.version
+    
+    job_ids = list(dict.fromkeys(ids))
+    if include_children:
+        for download_id in list(job_ids):
+            job_ids.extend(playlist_children(download_id))
+    if since is not None:
+        job_ids = active_downloads.changed_since(job_ids, since)
+    
+    jobs = {}
+    missing = []
+    for download_id in job_ids:
+        status = job_status(download_id)
+        if status is None:
+            missing.append(download_id)
+        else:
+            jobs[download_id] = status
+    
+    return jsonify({
+        'version': version,
+        'jobs': jobs,
+        'missing': missing
+    })
+
+@app.route('/download_events/<download_id>')
+@rate_limit(cheap_limiter)
+def download_events(download_id):
+    """Server-Sent Events stream of a job's status, pushed only when it changes"""
+    if download_id not in active_downloads:
+        return jsonify({'error': 'Download not found'}), 404
+    
+    def generate():
+        version = -1
+        last_sent = 0.0
+        while True:
+            new_version = active_downloads.wait_for_change(download_id, version, timeout=EVENT_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            
+            # Coalesce bursts of progress ticks into one event per interval
+            delay = last_sent + EVENT_MIN_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            version = active_downloads.job_version(download_id)
+            last_sent = time.monotonic()
+            
+            status = job_status(download_id)
+            if status is None:
+                yield "event: gone\ndata: {}\n\n"
+                return
+            yield f"id: {version}\ndata: {json.dumps(status, default=str)}\n\n"
+            if status.get('status') in ('completed', 'error'):
+                return
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # let nginx pass events through unbuffered
+    })
+
+def listing_params():
+    """Sorting and paging options shared by the downloads listings"""
+    sort = request.args.get('sort', 'modified')
+    descending = request.args.get('order', 'desc') != 'asc'
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 100)), 1), 1000)
+    except ValueError:
+        page, per_page = 1, 100
+    return sort, descending, page, per_page
+
 @app.route('/downloads')
+@rate_limit(cheap_limiter)
 def list_downloads():
-    """List all downloaded files"""
+    """List downloaded files, a page at a time, from the folder index"""
     try:
-        files = []
-        if os.path.exists(DOWNLOAD_FOLDER):
-            for filename in os.listdir(DOWNLOAD_FOLDER):
-                filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    stat = os.stat(filepath)
-                    files.append({
-                        'filename': filename,
-                        'size': stat.st_size,
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        'download_url': f'/download_file/{filename}'
-                    })
+        sort, descending, page, per_page = listing_params()
+        entries, total = folder_index.page(sort, descending, (page - 1) * per_page, per_page)
+        files = [{
+            'filename': filename,
+            'size': size,
+            'modified': datetime.fromtimestamp(mtime).isoformat(),
+            'download_url': f'/download_file/{filename}'
+        } for filename, (size, mtime) in entries]
         
-        return jsonify({
+        listing = {
             'files': files,
-            'download_folder': os.path.abspath(DOWNLOAD_FOLDER),
-            'total_files': len(files)
-        })
+            'total_files': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': (total + per_page - 1) // per_page
+        }
+        # Where the files live on the server is for the admin only
+        if is_admin():
+            listing['download_folder'] = os.path.abspath(DOWNLOAD_FOLDER)
+        return jsonify(listing)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def is_admin():
+    """Whether the request carries ADMIN_TOKEN in X-Admin-Token; never true without a token set"""
+    token = request.headers.get('X-Admin-Token')
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def serve_download(filepath):
+    """Send a downloaded file with Range/ETag support, or hand it to the front proxy.
+    The cleanup janitor counts it as used and leaves it alone until the response is done"""
+    janitor.touch(filepath)
+    janitor.hold(filepath)
+    try:
+        return send_download(filepath, os.path.basename(filepath), offload=FILE_OFFLOAD,
+                             accel_prefix=X_ACCEL_PREFIX, download_root=DOWNLOAD_FOLDER,
+                             on_close=lambda: janitor.release(filepath))
+    except Exception:
+        janitor.release(filepath)
+        raise
+
 @app.route('/download_file/<identifier>')
+@rate_limit(cheap_limiter)
 def download_file(identifier):
     """Download a specific file by filename or download_id"""
     try:
@@ -814,45 +542,95 @@ def download_file(identifier):
         if identifier in active_downloads and active_downloads[identifier]['status'] == 'completed':
             filepath = active_downloads[identifier].get('filepath')
             if filepath and os.path.exists(filepath):
-                return send_file(filepath, as_attachment=True)
+                return serve_download(filepath)
         
         # Then try as direct filename
         filepath = os.path.join(DOWNLOAD_FOLDER, identifier)
-        if os.path.exists(filepath):
-            return send_file(
-                filepath,
-                as_attachment=True,
-                download_name=identifier
-            )
+        if os.path.isfile(filepath):
+            return serve_download(filepath)
         
         return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         return jsonify({'error': 'File not found'}), 404
 
+@app.route('/stream')
+@rate_limit(expensive_limiter)
+def stream_download():
+    """Send a video to the client as it downloads instead of after it is saved"""
+    url = request.args.get('url', '').strip()
+    quality = request.args.get('quality', 'highest')
+    download_type = request.args.get('type', 'video')
+    save = request.args.get('save', '1' if STREAM_SAVE else '0') not in ('0', 'false')
+    
+    if not url or not re.match(r'(?:https?://)?(?:www\.)?(?:youtube\.com/|youtu\.be/)', url):
+        return jsonify({'error': 'Please provide a valid YouTube URL'}), 400
+    if is_playlist_url(url):
+        return jsonify({'error': 'Playlists cannot be streamed, use /download instead'}), 400
+    
+    try:
+        filename = stream_filename(url, quality, download_type)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Already saved by an earlier stream: serve the file with Range support
+    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    if os.path.isfile(filepath):
+        return serve_download(filepath)
+    
+    def saved(path):
+        folder_index.add(path)
+        record_history({
+            'id': str(uuid.uuid4()),
+            'url': url,
+            'filename': filename,
+            'quality': quality,
+            'type': download_type,
+            'downloaded_at': datetime.now().isoformat(),
+            'status': 'completed',
+            'is_playlist': False,
+            'streamed': True
+        })
+    
+    try:
+        total_bytes, chunks = open_media_stream(url, quality, download_type, client=request.remote_addr)
+        if save:
+            chunks = tee_to_file(chunks, filepath, on_complete=saved)
+        # Fail with a proper error response if the source breaks before the first byte
+        first_chunk = next(chunks)
+    except StopIteration:
+        return jsonify({'error': 'Source sent no data'}), 502
+    except Exception as e:
+        print(f"Streaming error: {str(e)}")
+        return jsonify({'error': f'Streaming failed: {str(e)}'}), 502
+    
+    def generate():
+        try:
+            yield first_chunk
+            yield from chunks
+        except Exception as e:
+            print(f"Streaming interrupted for {url}: {str(e)}")
+            raise
+        finally:
+            chunks.close()
+    
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+        'X-Accel-Buffering': 'no'  # let nginx pass bytes on as they arrive
+    }
+    if total_bytes:
+        headers['Content-Length'] = str(total_bytes)
+    mimetype = 'audio/mp4' if download_type == 'audio' else 'video/mp4'
+    return Response(generate(), headers=headers, mimetype=mimetype)
+
 @app.route('/downloads/')
+@rate_limit(cheap_limiter)
 def downloads_folder():
-    """Show downloads folder contents in browser"""
-    try:
-        files = []
-        download_path = os.path.abspath(DOWNLOAD_FOLDER)
-        
-        if os.path.exists(DOWNLOAD_FOLDER):
-            for filename in os.listdir(DOWNLOAD_FOLDER):
-                filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    stat = os.stat(filepath)
-                    size_mb = round(stat.st_size / (1024 * 1024), 2)
-                    files.append({
-                        'filename': filename,
-                        'size_mb': size_mb,
-                        'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-                        'download_url': f'/download_file/{filename}'
-                    })
-        
-        # Sort by modification time (newest first)
-        files.sort(key=lambda x: x['modified'], reverse=True)
-        
-        html = f"""
+    """Show downloads folder contents in browser, streamed row by row"""
+    location = f"<strong>Download Location:</strong> {escape(os.path.abspath(DOWNLOAD_FOLDER))}<br>" if is_admin() else ''
+    entries, total = folder_index.page('modified', True)
+    
+    def generate():
+        yield f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -874,11 +652,15 @@ def downloads_folder():
             <div class="container">
                 <h1>📁 Downloaded Files</h1>
                 <div class="info">
-                    <strong>Download Location:</strong> {download_path}<br>
-                    <strong>Total Files:</strong> {len(files)}
+                    {location}
+                    <strong>Total Files:</strong> {total}
                 </div>
-                
-                {'<div class="empty">No files downloaded yet. Start downloading videos to see them here!</div>' if not files else f'''
+        """
+        
+        if not entries:
+            yield '<div class="empty">No files downloaded yet. Start downloading videos to see them here!</div>'
+        else:
+            yield """
                 <table>
                     <thead>
                         <tr>
@@ -889,41 +671,73 @@ def downloads_folder():
                         </tr>
                     </thead>
                     <tbody>
-                        {"".join([f'''
+            """
+            # Send rows in batches so a huge folder never sits in memory as one string
+            batch = []
+            for filename, (size, mtime) in entries:
+                batch.append(f"""
                         <tr>
-                            <td>{file["filename"]}</td>
-                            <td>{file["size_mb"]}</td>
-                            <td>{file["modified"]}</td>
-                            <td><a href="{file["download_url"]}" class="download-btn">📥 Download</a></td>
+                            <td>{escape(filename)}</td>
+                            <td>{round(size / (1024 * 1024), 2)}</td>
+                            <td>{datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')}</td>
+                            <td><a href="/download_file/{quote(filename)}" class="download-btn">📥 Download</a></td>
                         </tr>
-                        ''' for file in files])}
+                """)
+                if len(batch) >= 500:
+                    yield ''.join(batch)
+                    batch = []
+            if batch:
+                yield ''.join(batch)
+            yield """
                     </tbody>
                 </table>
-                '''}
+            """
+        
+        yield """
             </div>
         </body>
         </html>
         """
-        
-        return html
-        
-    except Exception as e:
-        return f"Error: {str(e)}", 500
+    
+    return Response(stream_with_context(generate()), mimetype='text/html')
 
 @app.route('/history')
+@rate_limit(cheap_limiter)
 def history():
-    """Get download history"""
-    return jsonify(download_history)
+    """Get a page of download history, newest first, with optional filters"""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    
+    items, total = history_store.query(
+        page=page,
+        per_page=per_page,
+        download_type=request.args.get('type'),
+        url=request.args.get('url'),
+        video_id=request.args.get('video_id'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        search=request.args.get('q')
+    )
+    return jsonify({
+        'items': items,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page
+    })
 
 @app.route('/clear_history', methods=['POST'])
+@rate_limit(cheap_limiter)
 def clear_history():
     """Clear download history"""
-    global download_history
-    download_history = []
-    save_history()
+    history_store.clear()
     return jsonify({'message': 'History cleared'})
 
 @app.route('/open_downloads_folder')
+@rate_limit(cheap_limiter)
 def open_downloads_folder():
     """Open downloads folder in file explorer"""
     try:
@@ -951,13 +765,23 @@ def open_downloads_folder():
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/delete_download/<download_id>', methods=['DELETE'])
+@rate_limit(cheap_limiter)
 def delete_download(download_id):
     """Delete a download and its file"""
     if download_id in active_downloads:
+        download_scheduler.cancel(download_id)
+        if job_queue is not None:
+            job_queue.cancel(download_id)
+        if download_id in playlist_runs:
+            playlist_runs[download_id].cancel()
+        if active_downloads[download_id].get('result_key'):
+            result_cache.release(active_downloads[download_id]['result_key'], download_id)
         filepath = active_downloads[download_id].get('filepath')
         if filepath and os.path.exists(filepath):
             try:
                 os.remove(filepath)
+                folder_index.remove(filepath)
+                result_cache.forget_path(filepath)
             except:
                 pass
         
@@ -966,6 +790,36 @@ def delete_download(download_id):
     
     return jsonify({'error': 'Download not found'}), 404
 
+def process_rss():
+    """Resident memory of this process in bytes, or None where it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@app.route('/admin/stats')
+@rate_limit(cheap_limiter)
+def admin_stats():
+    """Job-store size and memory use, plus the state of the worker pools and caches"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({
+        'jobs': active_downloads.stats(),
+        'playlist_runs': len(playlist_runs),
+        'scheduler': download_scheduler.stats(),
+        'daemon_queue': job_queue.stats() if job_queue is not None else None,
+        'bandwidth': bandwidth.stats(),
+        'metadata_cache': metadata_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'indexed_files': len(folder_index),
+        'disk': janitor.stats(),
+        'job_ttl': JOB_TTL,
+        'max_finished_jobs': MAX_FINISHED_JOBS,
+        'process_rss_bytes': process_rss()
+    })
+
 if __name__ == '__main__':
-    load_history()
     app.run(debug=True, use_reloader=False)
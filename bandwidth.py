@@ -0,0 +1,253 @@
+# bandwidth.py
+import threading
+import time
+from contextlib import contextmanager
+
+MIN_RATE = 32 * 1024      # bytes/s a running download is never squeezed below by the global budget
+BURST = 0.5               # seconds of transfer a download may run ahead of its rate
+REBALANCE_INTERVAL = 1.0  # seconds between re-divisions of the budget while downloads run
+SMALL_JOB_WEIGHT = 4      # budget share of a download close to done, relative to a large one
+HEADROOM = 1.25           # a download its source holds back is offered this much more than it used
+
+
+class Flow:
+    """One job's slice of the bandwidth budget; every connection of the job draws on it"""
+
+    def __init__(self, job_id, client):
+        self.job_id = job_id
+        self.client = client
+        self.rate = None          # bytes per second, None for unlimited
+        self.expected_bytes = 0
+        self.received = 0
+        self.pinned = False
+        self.refs = 0
+        self.reported = None
+        self._lock = threading.Lock()
+        self._paid_until = time.monotonic()   # when the bytes received so far are paid for at rate
+        self._window_start = self._paid_until
+        self._window_bytes = 0
+        self._waited = False
+
+    @property
+    def remaining(self):
+        return max(self.expected_bytes - self.received, 0)
+
+    def throttle(self, nbytes):
+        """Account for nbytes just received, sleeping as long as the job's rate requires"""
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            self.received += nbytes
+            self._window_bytes += nbytes
+            if self.rate:
+                self._paid_until = max(self._paid_until, now - BURST) + nbytes / self.rate
+                wait = self._paid_until - now
+                if wait > 0:
+                    self._waited = True
+        if wait > 0:
+            time.sleep(wait)
+
+    def demand(self, now):
+        """What this job could use: its recent throughput plus headroom when the
+        source alone held it back, None (anything) when its rate did"""
+        with self._lock:
+            elapsed = now - self._window_start
+            throughput = self._window_bytes / elapsed if elapsed > 0 else 0
+            limited = self._waited or elapsed < REBALANCE_INTERVAL / 2
+            self._window_start = now
+            self._window_bytes = 0
+            self._waited = False
+        return None if limited else max(throughput * HEADROOM, MIN_RATE)
+
+
+class BandwidthShaper:
+    """Divides download bandwidth between running jobs.
+
+    total caps everything this process downloads; per_job and per_client
+    cap a single job and all of one client's jobs. The total is shared by
+    weighted max-min fairness: jobs with at most small_job_bytes left get
+    SMALL_JOB_WEIGHT times the share of larger ones so they finish quickly,
+    and whatever a job's source leaves unused goes to the others, so large
+    downloads soak up the leftover capacity. The division is recomputed
+    when jobs start or finish and every REBALANCE_INTERVAL while they run.
+
+    Downloads that are fetched chunk by chunk call throttle(); those
+    that run elsewhere (the yt-dlp engine or command) take a fixed rate from
+    pin() when they start: total (and per_client) divided by slots, the most
+    downloads that run at once, within the job's own caps. Pinning a fair share rather
+    than whatever is free means later jobs are not left with the minimum;
+    the others are divided around the pinned rates. on_rate(job_id, rate)
+    is called when a job's allocation changes noticeably and with None
+    once it finishes.
+    """
+
+    def __init__(self, total=0, per_job=0, per_client=0, small_job_bytes=64 * 1024 * 1024, on_rate=None, slots=1):
+        self.total = total
+        self.per_job = per_job
+        self.per_client = per_client
+        self.small_job_bytes = small_job_bytes
+        self.slots = max(slots, 1)
+        self.on_rate = on_rate
+        self.enabled = bool(total or per_job or per_client)
+        self._flows = {}           # job_id -> Flow
+        self._lock = threading.Lock()
+        self._last_rebalance = 0
+
+    @contextmanager
+    def flow(self, job_id, client=None):
+        """The job's Flow for the duration of the block, or None when no limit is set"""
+        if not self.enabled:
+            yield None
+            return
+        with self._lock:
+            flow = self._flows.get(job_id)
+            if flow is None:
+                flow = self._flows[job_id] = Flow(job_id, client)
+            flow.refs += 1
+            changes = self._rebalance()
+        self._report(changes)
+        try:
+            yield flow
+        finally:
+            with self._lock:
+                flow.refs -= 1
+                finished = flow.refs == 0
+                if finished:
+                    del self._flows[job_id]
+                changes = self._rebalance()
+            self._report(changes)
+            if finished and self.on_rate and flow.reported is not None:
+                self.on_rate(job_id, None)
+
+    def get(self, job_id):
+        return self._flows.get(job_id)
+
+    def expect(self, job_id, nbytes):
+        """Add nbytes to what the job is going to download"""
+        flow = self._flows.get(job_id)
+        if flow is None or not nbytes:
+            return
+        with self._lock:
+            flow.expected_bytes += nbytes
+            changes = self._rebalance()
+        self._report(changes)
+
+    def throttle(self, job_id, nbytes):
+        """Flow.throttle for job_id, rebalancing when the division is due"""
+        flow = self._flows.get(job_id)
+        if flow is None:
+            return
+        flow.throttle(nbytes)
+        if time.monotonic() - self._last_rebalance >= REBALANCE_INTERVAL:
+            with self._lock:
+                changes = self._rebalance() if time.monotonic() - self._last_rebalance >= REBALANCE_INTERVAL else []
+            self._report(changes)
+
+    def pin(self, job_id):
+        """Fix a rate for a download that cannot be throttled as it goes; returns it"""
+        flow = self._flows.get(job_id)
+        if flow is None:
+            return None
+        with self._lock:
+            if not flow.pinned:
+                limits = [self._caps(list(self._flows.values()))[flow]]
+                if self.total:
+                    limits.append(self.total / self.slots)
+                if self.per_client and flow.client is not None:
+                    limits.append(self.per_client / self.slots)
+                limits = [limit for limit in limits if limit]
+                flow.rate = int(min(limits)) if limits else None
+                flow.pinned = True
+            changes = self._rebalance()
+            if flow.rate != flow.reported:
+                flow.reported = flow.rate
+                changes.append((job_id, flow.rate))
+        self._report(changes)
+        return flow.rate
+
+    def _caps(self, flows):
+        """Each unpinned job's ceiling from per_job and what its client's per_client
+        budget leaves after the client's pinned jobs"""
+        client_jobs = {}
+        client_pinned = {}
+        for flow in flows:
+            if flow.pinned:
+                client_pinned[flow.client] = client_pinned.get(flow.client, 0) + (flow.rate or 0)
+            else:
+                client_jobs[flow.client] = client_jobs.get(flow.client, 0) + 1
+        caps = {}
+        for flow in flows:
+            cap = self.per_job or None
+            if self.per_client and flow.client is not None and not flow.pinned:
+                left = self.per_client - client_pinned.get(flow.client, 0)
+                share = max(left / client_jobs[flow.client], MIN_RATE)
+                cap = min(cap, share) if cap else share
+            caps[flow] = cap
+        return caps
+
+    def _rebalance(self):
+        """Recompute every job's rate; returns the (flow, rate) pairs worth reporting"""
+        now = time.monotonic()
+        self._last_rebalance = now
+        flows = list(self._flows.values())
+        caps = self._caps(flows)
+        rates = {}
+        if self.total:
+            available = self.total
+            sharing = []
+            for flow in flows:
+                if flow.pinned:
+                    available -= flow.rate or 0
+                    continue
+                limit = caps[flow]
+                demand = flow.demand(now)
+                if demand is not None:
+                    limit = min(limit, demand) if limit else demand
+                weight = SMALL_JOB_WEIGHT if 0 < flow.remaining <= self.small_job_bytes else 1
+                sharing.append((flow, limit, weight))
+            available = max(available, MIN_RATE * len(sharing))
+            # Water-filling: jobs needing less than their share get what they
+            # need and the rest is divided again among the others
+            while sharing:
+                total_weight = sum(weight for _, _, weight in sharing)
+                capped = [entry for entry in sharing
+                          if entry[1] is not None and entry[1] <= available * entry[2] / total_weight]
+                if not capped:
+                    for flow, _, weight in sharing:
+                        rates[flow] = available * weight / total_weight
+                    break
+                for flow, limit, _ in capped:
+                    rates[flow] = limit
+                    available -= limit
+                sharing = [entry for entry in sharing if entry not in capped]
+        else:
+            for flow in flows:
+                if not flow.pinned:
+                    rates[flow] = caps[flow]
+
+        changes = []
+        for flow, rate in rates.items():
+            flow.rate = int(rate) if rate else None
+            if flow.rate != flow.reported and (
+                    flow.rate is None or flow.reported is None or abs(flow.rate - flow.reported) > flow.reported / 20):
+                flow.reported = flow.rate
+                changes.append((flow.job_id, flow.rate))
+        return changes
+
+    def _report(self, changes):
+        if self.on_rate:
+            for job_id, rate in changes:
+                self.on_rate(job_id, rate)
+
+    def stats(self):
+        with self._lock:
+            flows = list(self._flows.values())
+        return {
+            'enabled': self.enabled,
+            'limit': self.total or None,
+            'job_limit': self.per_job or None,
+            'client_limit': self.per_client or None,
+            'jobs': len(flows),
+            'allocated': sum(flow.rate or 0 for flow in flows),
+            'pinned': sum(1 for flow in flows if flow.pinned)
+        }
@@ -9,14 +9,62 @@ class Config:
     DOWNLOAD_FOLDER = os.environ.get('DOWNLOAD_FOLDER') or 'downloads'
     MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS') or 3)
     MAX_DOWNLOAD_SIZE = int(os.environ.get('MAX_DOWNLOAD_SIZE') or 2147483648)  # 2GB default
+    PLAYLIST_PARALLELISM = int(os.environ.get('PLAYLIST_PARALLELISM') or 2)  # videos per playlist at once
+    PLAYLIST_ITEM_RETRIES = int(os.environ.get('PLAYLIST_ITEM_RETRIES') or 2)
+    DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES') or 5)  # resume attempts without progress before giving up
+    STALL_TIMEOUT = int(os.environ.get('STALL_TIMEOUT') or 60)  # seconds without data before a transfer counts as stalled
+    SEGMENT_CONNECTIONS = int(os.environ.get('SEGMENT_CONNECTIONS') or 4)  # parallel range requests per download
+    AUDIO_FORMAT = os.environ.get('AUDIO_FORMAT') or 'mp3'  # mp3, m4a or opus
+    POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS') or 0)  # audio conversions at once, 0 = one per CPU core
+    
+    # Bandwidth (bytes per second, 0 = unlimited)
+    BANDWIDTH_LIMIT = int(os.environ.get('BANDWIDTH_LIMIT') or 0)  # everything one downloading process fetches
+    JOB_BANDWIDTH_LIMIT = int(os.environ.get('JOB_BANDWIDTH_LIMIT') or 0)  # a single download
+    CLIENT_BANDWIDTH_LIMIT = int(os.environ.get('CLIENT_BANDWIDTH_LIMIT') or 0)  # all of one client's downloads
+    SMALL_DOWNLOAD_BYTES = int(os.environ.get('SMALL_DOWNLOAD_BYTES') or 64 * 1024 * 1024)  # downloads with this much left get a bigger share
+
+    # Download Backends
+    YOUTUBE_LIB = os.environ.get('YOUTUBE_LIB') or 'auto'  # auto, pytubefix, pytube or yt-dlp
+    YTDLP_ENGINE = os.environ.get('YTDLP_ENGINE') or 'embedded'  # embedded or subprocess
+    YTDLP_ENGINE_WORKERS = int(os.environ.get('YTDLP_ENGINE_WORKERS') or 4)
+    
+    # File Serving
+    FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD') or 'none'  # none, x-accel (nginx) or x-sendfile (Apache/lighttpd)
+    X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX') or '/protected-downloads'  # internal nginx location for DOWNLOAD_FOLDER
+    
+    STREAM_SAVE = (os.environ.get('STREAM_SAVE') or 'true').lower() == 'true'  # keep a copy of /stream downloads
+    
+    # Progress Events
+    EVENT_MIN_INTERVAL = float(os.environ.get('EVENT_MIN_INTERVAL') or 0.5)  # seconds between pushed updates
+    EVENT_KEEPALIVE = float(os.environ.get('EVENT_KEEPALIVE') or 15)  # seconds between keepalive comments
+    
+    # Job State
+    JOB_BACKEND = os.environ.get('JOB_BACKEND') or 'memory'  # memory (one process), sqlite or redis (shared by worker processes)
+    JOB_DB = os.environ.get('JOB_DB') or 'jobs.db'  # job state for JOB_BACKEND=sqlite, and the downloader daemon's queue
+    DOWNLOAD_EXECUTOR = os.environ.get('DOWNLOAD_EXECUTOR') or 'inline'  # inline (web process downloads) or daemon (downloader.py does)
+    DAEMON_STALE_AFTER = int(os.environ.get('DAEMON_STALE_AFTER') or 60)  # seconds without a heartbeat before a daemon's jobs are requeued
+    REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'  # used by JOB_BACKEND=redis
+    JOB_TTL = int(os.environ.get('JOB_TTL') or 3600)  # seconds a finished job stays queryable after its last access
+    MAX_FINISHED_JOBS = int(os.environ.get('MAX_FINISHED_JOBS') or 1000)  # least recently used finished jobs beyond this are evicted
+    
+    # Metadata Cache
+    METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL') or 3600)  # seconds
+    METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE') or 512)  # entries
     
     # File Management
     HISTORY_FILE = 'download_history.json'
-    AUTO_CLEANUP_DAYS = int(os.environ.get('AUTO_CLEANUP_DAYS') or 7)  # Auto-delete files after 7 days
+    HISTORY_DB = os.environ.get('HISTORY_DB') or 'download_history.db'
+    AUTO_CLEANUP_DAYS = int(os.environ.get('AUTO_CLEANUP_DAYS') or 7)  # delete files not served for this many days, 0 = keep
+    DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES') or 0)  # least recently served files go beyond this, 0 = no quota
+    CLEANUP_INTERVAL = int(os.environ.get('CLEANUP_INTERVAL') or 60)  # seconds between cleanup sweeps
     
     # Security
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or ''  # required in X-Admin-Token for /admin/stats, which is off without it
     ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
-    RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE') or 10)
+    RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE') or 10)  # info/download/stream requests per client
+    STATUS_RATE_LIMIT_PER_MINUTE = int(os.environ.get('STATUS_RATE_LIMIT_PER_MINUTE') or 600)  # status, listing and file requests per client
+    RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS') or 10000)  # clients tracked per process (memory backend)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)  # reverse proxies in front of the app whose X-Forwarded-For/-Proto are trusted
     
     # YouTube-dl Configuration
     YTDL_OPTS = {
@@ -0,0 +1,86 @@
+# downloader.py
+"""Downloader daemon: runs the download jobs the web app queues with DOWNLOAD_EXECUTOR=daemon.
+
+    JOB_BACKEND=sqlite python downloader.py
+
+Any number of daemons can consume the same queue. Restarting the web app
+leaves their downloads running; a restarted daemon picks its unfinished
+jobs back up and resumes them from their partial files.
+"""
+import signal
+import sys
+import threading
+import time
+
+import pipeline
+from config import Config
+from job_queue import JobQueue
+
+POLL_INTERVAL = 0.5      # seconds between looks at an empty queue
+HEARTBEAT_INTERVAL = 10  # seconds between heartbeats for the jobs this daemon holds
+
+
+def has_free_worker():
+    """Claim a job only when a worker can start it now, leaving the rest to other daemons"""
+    stats = pipeline.download_scheduler.stats()
+    return stats['queued'] == 0 and stats['running'] < stats['workers']
+
+
+def heartbeat_loop(queue, worker):
+    while True:
+        try:
+            queue.heartbeat(worker)
+            for job_id in queue.requeue_stale(Config.DAEMON_STALE_AFTER):
+                print(f"Requeued {job_id}: its downloader stopped responding")
+                if job_id in pipeline.active_downloads:
+                    pipeline.active_downloads[job_id]['status'] = 'queued'
+        except Exception as e:
+            print(f"Heartbeat error: {str(e)}")
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def run(queue, worker):
+    while True:
+        if not has_free_worker():
+            time.sleep(POLL_INTERVAL)
+            continue
+        claimed = queue.claim(worker)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        job_id, job = claimed
+        if job_id not in pipeline.active_downloads:
+            queue.done(job_id)  # deleted while it waited
+            continue
+        print(f"Starting {job_id}: {job['url']}")
+        pipeline.download_scheduler.submit(job_id, pipeline.run_download_job, job_id,
+                                           on_done=lambda job_id=job_id: queue.done(job_id), **job)
+
+
+def main():
+    if pipeline.JOB_BACKEND == 'memory':
+        sys.exit("The downloader daemon needs JOB_BACKEND=sqlite or redis, shared with the web app")
+
+    queue = JobQueue(Config.JOB_DB)
+    worker = JobQueue.worker_name()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    heartbeat = threading.Thread(target=heartbeat_loop, args=(queue, worker), name='daemon-heartbeat')
+    heartbeat.daemon = True
+    heartbeat.start()
+
+    print(f"Downloader {worker} running {pipeline.MAX_CONCURRENT_DOWNLOADS} workers on {Config.JOB_DB}")
+    try:
+        run(queue, worker)
+    except (KeyboardInterrupt, SystemExit):
+        # Hand unfinished jobs straight back; the next daemon resumes their partial files
+        released = queue.release(worker)
+        for job_id in released:
+            if job_id in pipeline.active_downloads:
+                pipeline.active_downloads[job_id]['status'] = 'queued'
+        print(f"Downloader {worker} stopped, {len(released)} job(s) returned to the queue")
+
+
+if __name__ == '__main__':
+    main()
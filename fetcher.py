@@ -0,0 +1,425 @@
+# fetcher.py
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+CHUNK_SIZE = 256 * 1024
+CHECKPOINT_BYTES = 4 * 1024 * 1024   # fsync and record the offset this often
+PROGRESS_INTERVAL = 0.25             # seconds between progress callbacks
+MIN_SEGMENT_SIZE = 1024 * 1024       # never split a range smaller than twice this
+
+
+class FetchError(Exception):
+    """The server ended a transfer early or answered in a way we cannot resume from"""
+    pass
+
+
+class FetchCancelled(Exception):
+    """The caller's cancel event was set; the .part file and sidecar are kept for a resume"""
+    pass
+
+
+def sidecar_path(filepath):
+    return filepath + '.part.json'
+
+
+def _read_sidecar(filepath, identity, total_bytes):
+    """The sidecar's state if it belongs to this download, else None"""
+    try:
+        with open(sidecar_path(filepath), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('identity') != identity:
+        return None
+    if total_bytes and state.get('total_bytes') and state['total_bytes'] != total_bytes:
+        return None
+    return state
+
+
+def _load_checkpoint(filepath, identity, total_bytes):
+    """Offset to resume filepath's .part file from, or 0 to start over"""
+    state = _read_sidecar(filepath, identity, total_bytes)
+    if state is None or 'offset' not in state:
+        return 0
+    try:
+        size = os.path.getsize(filepath + '.part')
+    except OSError:
+        return 0
+    # Bytes past the last checkpoint were never fsynced and are not trusted
+    return min(int(state['offset']), size)
+
+
+def _save_checkpoint(filepath, identity, offset, total_bytes):
+    temp_path = sidecar_path(filepath) + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'identity': identity, 'offset': offset, 'total_bytes': total_bytes}, f)
+    os.replace(temp_path, sidecar_path(filepath))
+
+
+def _is_permanent(error):
+    """A 4xx answer (other than timeout and rate limiting) will not change on retry,
+    e.g. an expired signed URL"""
+    response = getattr(error, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise FetchCancelled()
+
+
+def _backoff(failures, cancel):
+    """Sleep before retry number `failures`, waking early to raise FetchCancelled"""
+    delay = min(2 ** failures, 30)
+    if cancel is None:
+        time.sleep(delay)
+    elif cancel.wait(delay):
+        raise FetchCancelled()
+
+
+def _content_range(response):
+    """(start, total) from a 206 response's Content-Range header"""
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if not match:
+        return None, None
+    total = int(match.group(2)) if match.group(2) != '*' else None
+    return int(match.group(1)), total
+
+
+def fetch_resumable(url, filepath, total_bytes=None, identity=None, on_progress=None,
+                    retries=5, stall_timeout=60, headers=None, session=None, throttle=None, cancel=None):
+    """Download url to filepath, resuming interrupted transfers with HTTP Range.
+
+    Data is written to filepath + '.part'; a sidecar JSON file records the
+    offset that has been flushed to disk, so a retry (or a later run with
+    the same identity, e.g. after a restart) continues from there. A
+    connection that sends nothing for stall_timeout seconds counts as
+    failed. retries is the number of consecutive attempts allowed to fail
+    without making progress. on_progress(downloaded, total) is called at
+    most every PROGRESS_INTERVAL seconds. throttle(nbytes), if given, is
+    called after every chunk and may sleep to hold the transfer to a rate.
+    Setting the threading.Event cancel stops the transfer with FetchCancelled.
+    """
+    part_path = filepath + '.part'
+    identity = identity or url
+    session = session or requests.Session()
+    offset = _load_checkpoint(filepath, identity, total_bytes)
+    failures = 0
+    last_report = 0
+
+    while True:
+        _check_cancel(cancel)
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers['Range'] = f"bytes={offset}-"
+        start_offset = offset
+        try:
+            with session.get(url, headers=request_headers, stream=True, timeout=(10, stall_timeout)) as response:
+                if offset and response.status_code == 416 and total_bytes and offset >= total_bytes:
+                    break
+                if offset and response.status_code == 206:
+                    range_start, range_total = _content_range(response)
+                    if range_start != offset:
+                        raise FetchError(f"Server resumed at byte {range_start}, expected {offset}")
+                    total_bytes = total_bytes or range_total
+                elif response.status_code == 200:
+                    # No range support (or a fresh start): take the whole body
+                    offset = start_offset = 0
+                    length = response.headers.get('Content-Length')
+                    total_bytes = total_bytes or (int(length) if length else None)
+                else:
+                    response.raise_for_status()
+                    raise FetchError(f"Unexpected HTTP status {response.status_code}")
+
+                fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+                with os.fdopen(fd, 'wb') as f:
+                    f.truncate(offset)
+                    f.seek(offset)
+                    checkpoint = offset
+                    try:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            offset += len(chunk)
+                            if offset - checkpoint >= CHECKPOINT_BYTES:
+                                f.flush()
+                                os.fsync(f.fileno())
+                                _save_checkpoint(filepath, identity, offset, total_bytes)
+                                checkpoint = offset
+                            now = time.monotonic()
+                            if on_progress and now - last_report >= PROGRESS_INTERVAL:
+                                last_report = now
+                                on_progress(offset, total_bytes)
+                            if throttle:
+                                throttle(len(chunk))
+                            _check_cancel(cancel)
+                    finally:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        _save_checkpoint(filepath, identity, offset, total_bytes)
+
+            if total_bytes is None or offset >= total_bytes:
+                break
+            raise FetchError(f"Connection closed after {offset} of {total_bytes} bytes")
+        except (requests.RequestException, FetchError) as e:
+            if _is_permanent(e):
+                raise FetchError(f"Download failed: {str(e)}")
+            failures = 0 if offset > start_offset else failures + 1
+            if failures > retries:
+                raise FetchError(f"Download failed after {retries} retries: {str(e)}")
+            print(f"Transfer interrupted at {offset} bytes, resuming: {str(e)}")
+            _backoff(failures, cancel)
+
+    if on_progress:
+        on_progress(offset, total_bytes or offset)
+    os.replace(part_path, filepath)
+    try:
+        os.remove(sidecar_path(filepath))
+    except OSError:
+        pass
+    return offset
+
+
+class _RangesUnsupported(Exception):
+    pass
+
+
+class _Segment:
+    """A byte range still to be fetched: position is the next byte, end is exclusive"""
+    __slots__ = ('position', 'end', 'active')
+
+    def __init__(self, position, end):
+        self.position = position
+        self.end = end
+        self.active = False
+
+    @property
+    def remaining(self):
+        return max(self.end - self.position, 0)
+
+
+class SegmentedFetch:
+    """One file fetched over several connections, each downloading a byte range.
+
+    The .part file is preallocated and every connection writes its bytes in
+    place with positional writes. When a connection finishes its range it
+    takes over the back half of the largest range still in progress, so all
+    connections stay busy until the end instead of waiting on one slow
+    straggler. The remaining ranges are checkpointed to the sidecar file,
+    so an interrupted fetch resumes where each range left off.
+    """
+
+    def __init__(self, url, filepath, total_bytes, identity, connections, on_progress=None,
+                 retries=5, stall_timeout=60, headers=None, throttle=None, cancel=None):
+        self.url = url
+        self.filepath = filepath
+        self.part_path = filepath + '.part'
+        self.total_bytes = total_bytes
+        self.identity = identity
+        self.connections = connections
+        self.on_progress = on_progress
+        self.retries = retries
+        self.stall_timeout = stall_timeout
+        self.headers = headers or {}
+        self.throttle = throttle
+        self.cancel = cancel
+        self.segments = []
+        self.lock = threading.Lock()
+        self.error = None
+        self.fd = None
+        self._seek_lock = threading.Lock()
+        self._unsynced = 0
+        self._last_report = 0
+
+    def run(self):
+        self.segments = self._initial_segments()
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(self.part_path, flags, 0o644)
+        try:
+            if os.fstat(self.fd).st_size != self.total_bytes:
+                if hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(self.fd, 0, self.total_bytes)
+                    except OSError:
+                        os.ftruncate(self.fd, self.total_bytes)
+                else:
+                    os.ftruncate(self.fd, self.total_bytes)
+            self._checkpoint()
+
+            workers = [threading.Thread(target=self._worker, name=f'segment-{i}') for i in range(self.connections)]
+            for worker in workers:
+                worker.daemon = True
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self._checkpoint()
+        finally:
+            os.close(self.fd)
+
+        if self.error is not None:
+            raise self.error
+        if self.on_progress:
+            self.on_progress(self.total_bytes, self.total_bytes)
+        os.replace(self.part_path, self.filepath)
+        try:
+            os.remove(sidecar_path(self.filepath))
+        except OSError:
+            pass
+
+    def _initial_segments(self):
+        state = _read_sidecar(self.filepath, self.identity, self.total_bytes)
+        if state and state.get('segments') and os.path.exists(self.part_path):
+            return [_Segment(start, end) for start, end in state['segments'] if end > start]
+        # A single-connection checkpoint keeps its prefix; the rest is split up
+        start = _load_checkpoint(self.filepath, self.identity, self.total_bytes) if state else 0
+        count = max(1, min(self.connections, (self.total_bytes - start) // MIN_SEGMENT_SIZE))
+        size = (self.total_bytes - start) // count
+        bounds = [start + i * size for i in range(count)] + [self.total_bytes]
+        return [_Segment(bounds[i], bounds[i + 1]) for i in range(count)]
+
+    def _next_segment(self):
+        """An idle range, or the back half of the largest one being fetched"""
+        with self.lock:
+            if self.error is not None:
+                return None
+            for segment in self.segments:
+                if not segment.active and segment.remaining:
+                    segment.active = True
+                    return segment
+            busiest = max(self.segments, key=lambda seg: seg.remaining, default=None)
+            if busiest is None or busiest.remaining < 2 * MIN_SEGMENT_SIZE:
+                return None
+            middle = busiest.position + busiest.remaining // 2
+            segment = _Segment(middle, busiest.end)
+            segment.active = True
+            busiest.end = middle
+            self.segments.append(segment)
+            return segment
+
+    def _worker(self):
+        session = requests.Session()
+        while True:
+            segment = self._next_segment()
+            if segment is None:
+                return
+            try:
+                self._fetch_segment(session, segment)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                return
+            finally:
+                with self.lock:
+                    segment.active = False
+
+    def _fetch_segment(self, session, segment):
+        failures = 0
+        while segment.remaining and self.error is None:
+            _check_cancel(self.cancel)
+            start = segment.position
+            headers = dict(self.headers)
+            headers['Range'] = f"bytes={start}-{segment.end - 1}"
+            try:
+                with session.get(self.url, headers=headers, stream=True, timeout=(10, self.stall_timeout)) as response:
+                    if response.status_code == 200:
+                        raise _RangesUnsupported()
+                    if response.status_code != 206:
+                        response.raise_for_status()
+                        raise FetchError(f"Unexpected HTTP status {response.status_code}")
+                    range_start, _ = _content_range(response)
+                    if range_start != start:
+                        raise FetchError(f"Server sent byte {range_start}, expected {start}")
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        # Another connection may have taken over the tail of this range
+                        with self.lock:
+                            chunk = chunk[:segment.end - segment.position]
+                        if not chunk:
+                            break
+                        self._write(chunk, segment.position)
+                        with self.lock:
+                            segment.position += len(chunk)
+                        self._wrote(len(chunk))
+                        if self.throttle:
+                            self.throttle(len(chunk))
+                        _check_cancel(self.cancel)
+                        if not segment.remaining or self.error is not None:
+                            break
+                if segment.remaining and self.error is None and segment.position == start:
+                    raise FetchError(f"Connection closed at byte {start}")
+            except (requests.RequestException, FetchError) as e:
+                if _is_permanent(e):
+                    raise FetchError(f"Download failed: {str(e)}")
+                failures = 0 if segment.position > start else failures + 1
+                if failures > self.retries:
+                    raise FetchError(f"Download failed after {self.retries} retries: {str(e)}")
+                print(f"Segment interrupted at byte {segment.position}, resuming: {str(e)}")
+                _backoff(failures, self.cancel)
+
+    def _write(self, data, offset):
+        if hasattr(os, 'pwrite'):
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                data = data[written:]
+                offset += written
+        else:
+            with self._seek_lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while data:
+                    data = data[os.write(self.fd, data):]
+
+    def _wrote(self, count):
+        checkpoint = report = False
+        now = time.monotonic()
+        with self.lock:
+            self._unsynced += count
+            if self._unsynced >= CHECKPOINT_BYTES:
+                self._unsynced = 0
+                checkpoint = True
+            if self.on_progress and now - self._last_report >= PROGRESS_INTERVAL:
+                self._last_report = now
+                report = True
+            downloaded = self.total_bytes - sum(seg.remaining for seg in self.segments)
+        if checkpoint:
+            self._checkpoint()
+        if report:
+            self.on_progress(downloaded, self.total_bytes)
+
+    def _checkpoint(self):
+        """fsync the data, then record the ranges that are still missing"""
+        with self.lock:
+            remaining = [[seg.position, seg.end] for seg in self.segments if seg.remaining]
+        os.fsync(self.fd)
+        temp_path = sidecar_path(self.filepath) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'identity': self.identity, 'total_bytes': self.total_bytes, 'segments': remaining}, f)
+        os.replace(temp_path, sidecar_path(self.filepath))
+
+
+def fetch_segmented(url, filepath, total_bytes=None, identity=None, on_progress=None, connections=4,
+                    retries=5, stall_timeout=60, headers=None, throttle=None, cancel=None):
+    """Download url over up to `connections` parallel range requests.
+
+    Small or unknown-size files, single-connection jobs and servers without
+    range support go through fetch_resumable instead.
+    """
+    identity = identity or url
+    if connections > 1 and total_bytes and total_bytes >= 2 * MIN_SEGMENT_SIZE:
+        fetch = SegmentedFetch(url, filepath, total_bytes, identity, connections, on_progress,
+                               retries, stall_timeout, headers, throttle, cancel)
+        try:
+            fetch.run()
+            return total_bytes
+        except _RangesUnsupported:
+            print("Server does not support ranges, downloading over one connection")
+            for path in (filepath + '.part', sidecar_path(filepath)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return fetch_resumable(url, filepath, total_bytes, identity, on_progress, retries, stall_timeout, headers,
+                           throttle=throttle, cancel=cancel)
@@ -0,0 +1,153 @@
+# file_index.py
+import os
+import re
+import threading
+import time
+
+# Files that are still being written by a downloader
+TEMP_SUFFIXES = ('.part', '.part.json', '.ytdl', '.tmp')
+# yt-dlp's intermediates: single-format streams waiting to be merged (Title.f137.mp4),
+# ffmpeg post-processing output (Title.temp.mp4) and thumbnails waiting to be embedded
+INTERMEDIATE_PATTERN = re.compile(r'\.(?:f\d+(?:-\w+)?|temp)\.\w+$|\.(?:webp|jpe?g|png)$', re.IGNORECASE)
+
+
+def is_temporary(name):
+    """Whether name is a download in progress rather than a finished file"""
+    return name.endswith(TEMP_SUFFIXES) or INTERMEDIATE_PATTERN.search(name) is not None
+
+
+class FolderIndex:
+    """In-memory index of the files in the downloads folder.
+
+    The download pipeline reports files as it finishes them; a background
+    watcher lists the folder only when its own mtime changes (a file was
+    created, removed or renamed), so requests never walk the directory.
+    Sorted views are cached until the index next changes.
+    """
+
+    SORT_KEYS = {
+        'modified': lambda item: item[1][1],
+        'name': lambda item: item[0].lower(),
+        'size': lambda item: item[1][0],
+    }
+
+    def __init__(self, folder, rescan_interval=5.0):
+        self.folder = folder
+        self.rescan_interval = rescan_interval
+        self._entries = {}           # filename -> (size, mtime)
+        self._generation = 0
+        self._sorted = {}            # (sort, descending) -> (generation, items)
+        self._folder_mtime = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def start(self):
+        """Build the index and start the change watcher (idempotent)"""
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, name='folder-index')
+            self._watcher.daemon = True
+        self.rescan()
+        self._watcher.start()
+
+    def add(self, filepath):
+        """Record a file the pipeline has just written"""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return
+        name = os.path.basename(filepath)
+        if is_temporary(name):
+            return
+        with self._lock:
+            self._entries[name] = (stat.st_size, stat.st_mtime)
+            self._generation += 1
+
+    def remove(self, filename):
+        with self._lock:
+            if self._entries.pop(os.path.basename(filename), None) is not None:
+                self._generation += 1
+
+    def get(self, filename):
+        """(size, mtime) for a file, or None"""
+        with self._lock:
+            return self._entries.get(filename)
+
+    @property
+    def generation(self):
+        """Changes whenever the set of files (or their sizes) changes"""
+        with self._lock:
+            return self._generation
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def page(self, sort='modified', descending=True, offset=0, limit=None):
+        """Slice of (filename, (size, mtime)) in the requested order, plus the total count"""
+        if sort not in self.SORT_KEYS:
+            sort = 'modified'
+        with self._lock:
+            cached = self._sorted.get((sort, descending))
+            if cached is None or cached[0] != self._generation:
+                items = sorted(self._entries.items(), key=self.SORT_KEYS[sort], reverse=descending)
+                cached = (self._generation, items)
+                self._sorted[(sort, descending)] = cached
+            items = cached[1]
+        end = None if limit is None else offset + limit
+        return items[offset:end], len(items)
+
+    def total_size(self):
+        with self._lock:
+            return sum(size for size, _ in self._entries.values())
+
+    def rescan(self):
+        """Bring the index up to date if the folder changed since the last scan.
+
+        Most folder changes are partial files and checkpoints coming and
+        going, so the listing is compared by name first: only files that
+        appeared are stat-ed, and the generation moves only when the set of
+        finished files did."""
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            return
+        if folder_mtime == self._folder_mtime:
+            return
+
+        names = set()
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if is_temporary(entry.name):
+                    continue
+                try:
+                    if entry.is_file():
+                        names.add(entry.name)
+                except OSError:
+                    continue
+        with self._lock:
+            known = set(self._entries)
+        added = {}
+        for name in names - known:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            added[name] = (stat.st_size, stat.st_mtime)
+        with self._lock:
+            removed = known - names
+            if added or removed:
+                for name in removed:
+                    self._entries.pop(name, None)
+                self._entries.update(added)
+                self._generation += 1
+            self._folder_mtime = folder_mtime
+
+    def _watch(self):
+        while True:
+            time.sleep(self.rescan_interval)
+            try:
+                self.rescan()
+            except Exception as e:
+                print(f"Folder index rescan error: {str(e)}")
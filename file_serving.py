@@ -0,0 +1,151 @@
+# file_serving.py
+"""Serving downloaded files to clients.
+
+Handles ETag / Last-Modified validators, single byte ranges (with If-Range)
+and 304/416 responses itself, and passes the open file to the WSGI server's
+``wsgi.file_wrapper`` so servers that implement it with sendfile(2) (such as
+gunicorn) copy the bytes in the kernel. Alternatively the transfer can be
+offloaded to a front proxy with X-Accel-Redirect (nginx) or X-Sendfile
+(Apache, lighttpd), in which case Python never touches the payload.
+"""
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import parse_range_header
+from werkzeug.wsgi import wrap_file
+
+BUFFER_SIZE = 256 * 1024
+
+
+class _RangeFile:
+    """File object limited to ``length`` bytes from its current offset.
+
+    read() stops at the end of the range; fileno() lets sendfile-based
+    wrappers use the descriptor, which send exactly Content-Length bytes
+    starting at the current offset. on_close runs once the server is done
+    with the file.
+    """
+
+    def __init__(self, f, length, on_close=None):
+        self._file = f
+        self._remaining = length
+        self._on_close = on_close
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+        if self._on_close:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _not_modified_since(header, mtime):
+    if not header:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def send_download(filepath, download_name, offload=None, accel_prefix='/protected-downloads', download_root=None,
+                  on_close=None):
+    """Response that sends filepath as an attachment named download_name.
+
+    on_close() is called when the response no longer needs the file: once
+    the body has been sent, or straight away for responses without one.
+    """
+    response = _send_download(filepath, download_name, offload, accel_prefix, download_root, on_close)
+    if on_close and not response.direct_passthrough:
+        on_close()
+    return response
+
+
+def _send_download(filepath, download_name, offload, accel_prefix, download_root, on_close):
+    disposition = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    if offload == 'x-accel':
+        relative = os.path.relpath(filepath, download_root) if download_root else os.path.basename(filepath)
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(relative.replace(os.sep, '/'))}"
+        response.headers['Content-Disposition'] = disposition
+        return response
+    if offload == 'x-sendfile':
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Sendfile'] = os.path.abspath(filepath)
+        response.headers['Content-Disposition'] = disposition
+        return response
+
+    stat = os.stat(filepath)
+    size = stat.st_size
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': disposition,
+    }
+
+    # Conditional GET: If-None-Match wins over If-Modified-Since
+    if request.headers.get('If-None-Match'):
+        if _etag_matches(request.headers['If-None-Match'], etag):
+            return Response(status=304, headers=headers)
+    elif _not_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    start, length, status = 0, size, 200
+    byte_range = parse_range_header(request.headers.get('Range'))
+    if_range = request.headers.get('If-Range')
+    if if_range:
+        # A stale validator means "send the whole new file" rather than a piece of it
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            fresh = if_range == etag
+        else:
+            fresh = _not_modified_since(if_range, stat.st_mtime)
+        if not fresh:
+            byte_range = None
+
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        length = stop - start
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+
+    headers['Content-Length'] = str(length)
+    f = open(filepath, 'rb')
+    if start:
+        f.seek(start)
+    body = wrap_file(request.environ, _RangeFile(f, length, on_close), BUFFER_SIZE)
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
@@ -0,0 +1,112 @@
+# history.py
+import json
+import os
+import sqlite3
+import threading
+
+from utils import extract_youtube_id
+
+
+class HistoryStore:
+    """Download history in SQLite, indexed by time, URL/video ID and type.
+
+    Each completed download is a single INSERT instead of rewriting the
+    whole history; entries from the old JSON history file are imported
+    once on first use.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS history (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT,
+                    url TEXT,
+                    video_id TEXT,
+                    type TEXT,
+                    downloaded_at TEXT,
+                    entry TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_downloaded_at ON history (downloaded_at);
+                CREATE INDEX IF NOT EXISTS idx_history_video_id ON history (video_id);
+                CREATE INDEX IF NOT EXISTS idx_history_url ON history (url);
+                CREATE INDEX IF NOT EXISTS idx_history_type ON history (type, downloaded_at);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            ''')
+        if legacy_json_path:
+            self._import_legacy(legacy_json_path)
+
+    def add(self, entry):
+        """Append one history entry"""
+        media_id = extract_youtube_id(entry.get('url'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO history (id, url, video_id, type, downloaded_at, entry) VALUES (?, ?, ?, ?, ?, ?)',
+                (entry.get('id'), entry.get('url'), media_id[1] if media_id else None,
+                 entry.get('type'), entry.get('downloaded_at'), json.dumps(entry))
+            )
+
+    def query(self, page=1, per_page=50, download_type=None, url=None, video_id=None,
+              since=None, until=None, search=None):
+        """Newest-first page of entries matching the filters; returns (entries, total)"""
+        clauses = []
+        params = []
+        if download_type:
+            clauses.append('type = ?')
+            params.append(download_type)
+        if url:
+            clauses.append('url = ?')
+            params.append(url)
+        if video_id:
+            clauses.append('video_id = ?')
+            params.append(video_id)
+        if since:
+            clauses.append('downloaded_at >= ?')
+            params.append(since)
+        if until:
+            clauses.append('downloaded_at < ?')
+            params.append(until)
+        if search:
+            clauses.append('entry LIKE ?')
+            params.append(f"%{search}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM history {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT entry FROM history {where} ORDER BY downloaded_at DESC, seq DESC LIMIT ? OFFSET ?',
+                params + [per_page, (page - 1) * per_page]
+            ).fetchall()
+        return [json.loads(row['entry']) for row in rows], total
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM history')
+
+    def _import_legacy(self, json_path):
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'legacy_imported'").fetchone()
+        if done or not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            entries = []
+
+        rows = []
+        for entry in entries if isinstance(entries, list) else []:
+            media_id = extract_youtube_id(entry.get('url'))
+            rows.append((entry.get('id'), entry.get('url'), media_id[1] if media_id else None,
+                         entry.get('type'), entry.get('downloaded_at'), json.dumps(entry)))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO history (id, url, video_id, type, downloaded_at, entry) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)", (json_path,))
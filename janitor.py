@@ -0,0 +1,215 @@
+# janitor.py
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process sweeps
+    fcntl = None
+
+
+def mark_used(filepath):
+    """Set filepath's access time to now, which the janitor reads as its last use"""
+    try:
+        # Only the access time: the modification time is part of the file's ETag
+        os.utime(filepath, ns=(time.time_ns(), os.stat(filepath).st_mtime_ns))
+    except OSError:
+        pass
+
+
+class DiskJanitor:
+    """Keeps the downloads folder under a byte quota and an age limit.
+
+    Works from the FolderIndex rather than walking the folder: each sweep
+    only stats files the index gained since the last one, to learn when
+    they were last served. Serving a file (touch()) also bumps its access
+    time on disk, so the order survives restarts. Files unused for longer than max_age are removed, and
+    while the folder is over quota the least recently served go first.
+
+    Partial downloads and yt-dlp's intermediate files never appear in the
+    index (see file_index.is_temporary). Files being sent to a client (hold()
+    until release()) and files written in the last `grace` seconds are
+    never removed. on_evict(filepath) is called for every removed file.
+
+    Several processes may serve the same folder. Only the one holding an
+    flock on lock_path sweeps, and it re-reads a file's access time just
+    before removing it, so a file the others served (or a download just
+    finished, see mark_used) since the last sweep is kept.
+    """
+
+    TOUCH_INTERVAL = 60  # seconds between access-time updates for the same file
+
+    def __init__(self, index, quota_bytes=0, max_age=0, interval=60, grace=300, on_evict=None, lock_path=None):
+        self.index = index
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.grace = grace
+        self.on_evict = on_evict
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._last_used = {}         # filename -> time it was last served or written
+        self._generation = None
+        self._held = {}              # filename -> responses still sending it
+        self._lock = threading.Lock()
+        self._thread = None
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.quota_bytes or self.max_age)
+
+    def start(self):
+        """Start the background sweeper (idempotent, nothing to do without a limit)"""
+        with self._lock:
+            if self._thread is not None or not self.enabled:
+                return
+            self._thread = threading.Thread(target=self._run, name='disk-janitor')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def touch(self, filepath):
+        """Record that filepath was just served"""
+        name = os.path.basename(filepath)
+        now = time.time()
+        with self._lock:
+            last = self._last_used.get(name)
+            self._last_used[name] = now
+        if last is None or now - last >= self.TOUCH_INTERVAL:
+            mark_used(filepath)
+
+    def hold(self, filepath):
+        """Keep filepath until release() (a response is sending it)"""
+        name = os.path.basename(filepath)
+        with self._lock:
+            self._held[name] = self._held.get(name, 0) + 1
+
+    def release(self, filepath):
+        name = os.path.basename(filepath)
+        with self._lock:
+            count = self._held.get(name, 0) - 1
+            if count > 0:
+                self._held[name] = count
+            else:
+                self._held.pop(name, None)
+
+    def _sync(self, entries):
+        """Learn last-use times for files new to the index and drop vanished ones"""
+        generation = self.index.generation
+        if generation == self._generation:
+            return
+        with self._lock:
+            known = dict(self._last_used)
+        last_used = {}
+        for name, (_, mtime) in entries:
+            if name in known:
+                last_used[name] = known[name]
+                continue
+            try:
+                atime = os.stat(os.path.join(self.index.folder, name)).st_atime
+            except OSError:
+                continue
+            last_used[name] = max(atime, mtime)
+        with self._lock:
+            # Touches that arrived while we were stat-ing win
+            for name, served in self._last_used.items():
+                if name in last_used and served > last_used[name]:
+                    last_used[name] = served
+            self._last_used = last_used
+        self._generation = generation
+
+    def sweep(self):
+        """Remove expired files, then least recently served ones until under quota; returns bytes freed"""
+        entries, _ = self.index.page('modified', False)
+        self._sync(entries)
+        now = time.time()
+        with self._lock:
+            held = set(self._held)
+            last_used = dict(self._last_used)
+
+        used = sum(size for _, (size, _) in entries)
+        candidates = sorted(
+            (last_used.get(name, mtime), name, size) for name, (size, mtime) in entries
+            if name not in held and now - mtime > self.grace
+        )
+        freed = 0
+        for served, name, size in candidates:
+            expired = self.max_age and now - served > self.max_age
+            if not expired and not (self.quota_bytes and used > self.quota_bytes):
+                break
+            # Another process may have served it since it was last looked at
+            try:
+                stat = os.stat(os.path.join(self.index.folder, name))
+            except FileNotFoundError:
+                self.index.remove(name)
+                used -= size
+                continue
+            except OSError:
+                continue
+            used_at = max(stat.st_atime, stat.st_mtime)
+            if used_at > served + 1:
+                with self._lock:
+                    self._last_used[name] = max(self._last_used.get(name, 0), used_at)
+                continue
+            if self._evict(name, size, 'expired' if expired else 'over quota'):
+                used -= size
+                freed += size
+        return freed
+
+    def _evict(self, name, size, reason):
+        filepath = os.path.join(self.index.folder, name)
+        with self._lock:
+            if name in self._held:
+                return False
+            self._last_used.pop(name, None)
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Cleanup could not remove {name}: {str(e)}")
+            return False
+        self.index.remove(name)
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        print(f"Cleanup removed {name} ({reason})")
+        if self.on_evict:
+            self.on_evict(filepath)
+        return True
+
+    def _leads(self):
+        """Whether this process sweeps: the first to lock lock_path keeps the lock
+        until it exits, and then another process takes over"""
+        if self._lock_file is not None or self.lock_path is None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self._leads():
+                    self.sweep()
+            except Exception as e:
+                print(f"Cleanup error: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            held = len(self._held)
+        return {
+            'quota_bytes': self.quota_bytes or None,
+            'max_age_seconds': self.max_age or None,
+            'used_bytes': self.index.total_size(),
+            'files_in_use': held,
+            'evicted_files': self.evicted_files,
+            'evicted_bytes': self.evicted_bytes
+        }
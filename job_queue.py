@@ -0,0 +1,125 @@
+# job_queue.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class JobQueue:
+    """Download jobs waiting for the downloader daemon, in a local SQLite file.
+
+    The web app puts jobs in; each daemon claims the oldest pending one when
+    it has a free worker, heartbeats the jobs it holds and marks them done
+    when they finish. Jobs held by a daemon that stopped heartbeating (it
+    was restarted or crashed) go back to pending, and the next daemon resumes
+    them from their partial files.
+    """
+
+    def __init__(self, db_path, timeout=30):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=timeout, isolation_level=None)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS download_queue (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT UNIQUE NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    claimed_by TEXT,
+                    heartbeat REAL,
+                    enqueued_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_download_queue_state ON download_queue (state, seq);
+            ''')
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def worker_name():
+        """Identifies this daemon process in claimed_by"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def put(self, job_id, payload):
+        """Queue a job; returns its 1-based position among pending jobs"""
+        with self._write() as conn:
+            conn.execute('INSERT INTO download_queue (job_id, payload, enqueued_at) VALUES (?, ?, ?)',
+                         (job_id, json.dumps(payload), time.time()))
+        return self.position(job_id)
+
+    def claim(self, worker):
+        """Take the oldest pending job for worker; returns (job_id, payload) or None"""
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT seq, job_id, payload FROM download_queue WHERE state = 'pending' ORDER BY seq LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE download_queue SET state = 'claimed', claimed_by = ?, heartbeat = ? WHERE seq = ?",
+                         (worker, time.time(), row[0]))
+        return row[1], json.loads(row[2])
+
+    def heartbeat(self, worker):
+        """Mark every job worker holds as still being worked on"""
+        with self._write() as conn:
+            conn.execute("UPDATE download_queue SET heartbeat = ? WHERE claimed_by = ? AND state = 'claimed'",
+                         (time.time(), worker))
+
+    def requeue_stale(self, timeout):
+        """Return jobs whose daemon has not heartbeated for timeout seconds to pending; returns their IDs"""
+        cutoff = time.time() - timeout
+        with self._write() as conn:
+            rows = conn.execute("SELECT job_id FROM download_queue WHERE state = 'claimed' AND heartbeat < ?",
+                                (cutoff,)).fetchall()
+            conn.execute("UPDATE download_queue SET state = 'pending', claimed_by = NULL "
+                         "WHERE state = 'claimed' AND heartbeat < ?", (cutoff,))
+        return [row[0] for row in rows]
+
+    def release(self, worker):
+        """Put every job worker holds back to pending (the daemon is shutting down); returns their IDs"""
+        with self._write() as conn:
+            rows = conn.execute("SELECT job_id FROM download_queue WHERE claimed_by = ? AND state = 'claimed'",
+                                (worker,)).fetchall()
+            conn.execute("UPDATE download_queue SET state = 'pending', claimed_by = NULL "
+                         "WHERE claimed_by = ? AND state = 'claimed'", (worker,))
+        return [row[0] for row in rows]
+
+    def done(self, job_id):
+        with self._write() as conn:
+            conn.execute('DELETE FROM download_queue WHERE job_id = ?', (job_id,))
+
+    def cancel(self, job_id):
+        """Drop a job no daemon has claimed yet"""
+        with self._write() as conn:
+            return conn.execute("DELETE FROM download_queue WHERE job_id = ? AND state = 'pending'",
+                                (job_id,)).rowcount > 0
+
+    def position(self, job_id):
+        """1-based position among pending jobs, or None if not pending"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM download_queue q, download_queue j "
+                "WHERE j.job_id = ? AND j.state = 'pending' AND q.state = 'pending' AND q.seq <= j.seq",
+                (job_id,)
+            ).fetchone()
+        return row[0] or None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT state, COUNT(*) FROM download_queue GROUP BY state').fetchall())
+            workers = self._conn.execute(
+                "SELECT COUNT(DISTINCT claimed_by) FROM download_queue WHERE state = 'claimed'"
+            ).fetchone()[0]
+        return {'pending': counts.get('pending', 0), 'claimed': counts.get('claimed', 0), 'busy_daemons': workers}
@@ -0,0 +1,448 @@
+# job_store.py
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from jobs import FINISHED_STATUSES
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_value(value):
+    return json.dumps(value, default=_json_default)
+
+
+def decode_value(text):
+    return json.loads(text) if text is not None else None
+
+
+def _finished_flag(fields):
+    """'1'/'0' when fields move a job into/out of a final status, '' when they leave it alone"""
+    if 'status' not in fields:
+        return ''
+    return '1' if fields['status'] in FINISHED_STATUSES else '0'
+
+
+class SQLiteJobStore:
+    """Job state in a SQLite database that every worker process opens.
+
+    Each job is a row of bookkeeping (parent playlist, version, finish and
+    access times) plus one row per status key, so an update writes only the
+    keys it changes, in a single transaction that also takes the next value
+    of the shared version counter. The rate limiter's buckets live here too.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path, timeout=30):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=timeout, isolation_level=None)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # Progress ticks need not survive a power cut; skip the fsync per commit
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    parent TEXT,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    finished_at REAL,
+                    accessed_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS job_fields (
+                    job_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (job_id, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS job_counter (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO job_counter (id, version) VALUES (0, 0);
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    full_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_rate_buckets_full_at ON rate_buckets (full_at);
+            ''')
+        self._bucket_writes = 0
+
+    @contextmanager
+    def _write(self):
+        """Exclusive transaction, so the version counter advances atomically across processes"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _bump(self, conn, job_ids):
+        conn.execute('UPDATE job_counter SET version = version + 1 WHERE id = 0')
+        version = conn.execute('SELECT version FROM job_counter WHERE id = 0').fetchone()[0]
+        conn.executemany('UPDATE jobs SET version = ? WHERE job_id = ?',
+                         [(version, job_id) for job_id in job_ids if job_id])
+        return version
+
+    def replace(self, job_id, state):
+        """Create job_id with exactly the keys in state"""
+        now = time.time()
+        parent = state.get('parent_playlist')
+        with self._write() as conn:
+            conn.execute('DELETE FROM job_fields WHERE job_id = ?', (job_id,))
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs (job_id, parent, finished_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (job_id, parent, now if _finished_flag(state) == '1' else None, now)
+            )
+            conn.executemany('INSERT INTO job_fields (job_id, key, value) VALUES (?, ?, ?)',
+                             [(job_id, key, encode_value(value)) for key, value in state.items()])
+            self._bump(conn, (job_id, parent))
+
+    def update(self, job_id, fields):
+        """Set some keys of job_id; False if the job no longer exists"""
+        finished = _finished_flag(fields)
+        with self._write() as conn:
+            row = conn.execute('SELECT parent FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return False
+            conn.executemany('INSERT OR REPLACE INTO job_fields (job_id, key, value) VALUES (?, ?, ?)',
+                             [(job_id, key, encode_value(value)) for key, value in fields.items()])
+            if finished == '1':
+                conn.execute('UPDATE jobs SET finished_at = COALESCE(finished_at, ?) WHERE job_id = ?',
+                             (time.time(), job_id))
+            elif finished == '0':
+                conn.execute('UPDATE jobs SET finished_at = NULL WHERE job_id = ?', (job_id,))
+            self._bump(conn, (job_id, row[0]))
+            return True
+
+    def unset(self, job_id, keys):
+        with self._write() as conn:
+            row = conn.execute('SELECT parent FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return False
+            conn.executemany('DELETE FROM job_fields WHERE job_id = ? AND key = ?', [(job_id, key) for key in keys])
+            self._bump(conn, (job_id, row[0]))
+            return True
+
+    def remove(self, job_id):
+        """Delete job_id; False if it was already gone (e.g. another process evicted it)"""
+        with self._write() as conn:
+            if conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,)).rowcount == 0:
+                return False
+            conn.execute('DELETE FROM job_fields WHERE job_id = ?', (job_id,))
+            self._bump(conn, ())
+            return True
+
+    def touch(self, job_ids):
+        with self._write() as conn:
+            self._bump(conn, job_ids)
+
+    def mark_accessed(self, job_id):
+        with self._write() as conn:
+            conn.execute('UPDATE jobs SET accessed_at = ? WHERE job_id = ?', (time.time(), job_id))
+
+    def load(self, job_id):
+        """job_id's state as a dict, or None"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT f.key, f.value FROM jobs j LEFT JOIN job_fields f ON f.job_id = j.job_id WHERE j.job_id = ?',
+                (job_id,)
+            ).fetchall()
+        if not rows:
+            return None
+        return {key: decode_value(value) for key, value in rows if key is not None}
+
+    def load_many(self, job_ids):
+        """job_id -> state for those of job_ids that exist"""
+        job_ids = list(job_ids)
+        states = {}
+        with self._lock:
+            for start in range(0, len(job_ids), 500):
+                chunk = job_ids[start:start + 500]
+                rows = self._conn.execute(
+                    'SELECT j.job_id, f.key, f.value FROM jobs j LEFT JOIN job_fields f ON f.job_id = j.job_id '
+                    f"WHERE j.job_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for job_id, key, value in rows:
+                    state = states.setdefault(job_id, {})
+                    if key is not None:
+                        state[key] = decode_value(value)
+        return states
+
+    def exists(self, job_id):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM jobs WHERE job_id = ?', (job_id,)).fetchone() is not None
+
+    def job_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT job_id FROM jobs')]
+
+    def version(self):
+        with self._lock:
+            return self._conn.execute('SELECT version FROM job_counter WHERE id = 0').fetchone()[0]
+
+    def job_versions(self, job_ids):
+        """job_id -> version of its last change, for the jobs that exist"""
+        job_ids = list(job_ids)
+        versions = {}
+        with self._lock:
+            for start in range(0, len(job_ids), 500):
+                chunk = job_ids[start:start + 500]
+                versions.update(self._conn.execute(
+                    f"SELECT job_id, version FROM jobs WHERE job_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return versions
+
+    def entries(self):
+        """(job_id, parent, finished_at, accessed_at) for every job"""
+        with self._lock:
+            return self._conn.execute('SELECT job_id, parent, finished_at, accessed_at FROM jobs').fetchall()
+
+    def take_tokens(self, key, capacity, rate, cost):
+        """Token-bucket check shared by all processes (see utils.RateLimiter); returns (allowed, retry_after)"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, now + (capacity - tokens) / rate))
+            # Buckets that have refilled are the same as no bucket; drop them now and then
+            self._bucket_writes += 1
+            if self._bucket_writes % 1000 == 0:
+                conn.execute('DELETE FROM rate_buckets WHERE full_at < ?', (now,))
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            jobs = self._conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            by_status = self._conn.execute(
+                "SELECT value, COUNT(*) FROM job_fields WHERE key = 'status' GROUP BY value"
+            ).fetchall()
+            page_count = self._conn.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        return {
+            'jobs': jobs,
+            'by_status': {decode_value(status): count for status, count in by_status},
+            'approx_bytes': page_count * page_size,
+            'tracked_versions': jobs,
+        }
+
+
+# One script for every change, so the write and the version bump are a single
+# atomic step on the server. KEYS: counter, job hash, meta hash, id set, the
+# parent's meta hash (declared so the script stays cluster-safe). ARGV: mode,
+# job id, now, parent, finished flag, then the keys (unset) or key/value pairs
+# (replace, update). Updates return -1 without writing when the job's stored
+# parent is not the one the caller declared, so the caller can retry.
+_APPLY_SCRIPT = """
+local mode, job_id, now, parent, finished = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5]
+if mode ~= 'replace' and redis.call('EXISTS', KEYS[3]) == 0 then
+    return 0
+end
+if mode == 'access' then
+    redis.call('HSET', KEYS[3], 'accessed_at', now)
+    return 0
+end
+if mode ~= 'replace' and mode ~= 'remove' and (redis.call('HGET', KEYS[3], 'parent') or '') ~= parent then
+    return -1
+end
+local version = redis.call('INCR', KEYS[1])
+if mode == 'remove' then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    redis.call('SREM', KEYS[4], job_id)
+    return version
+end
+if mode == 'replace' then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    redis.call('SADD', KEYS[4], job_id)
+    redis.call('HSET', KEYS[3], 'parent', parent, 'accessed_at', now)
+end
+if #ARGV > 5 then
+    if mode == 'unset' then
+        redis.call('HDEL', KEYS[2], unpack(ARGV, 6))
+    elseif mode ~= 'touch' then
+        redis.call('HSET', KEYS[2], unpack(ARGV, 6))
+    end
+end
+if finished == '1' then
+    redis.call('HSETNX', KEYS[3], 'finished_at', now)
+elseif finished == '0' then
+    redis.call('HDEL', KEYS[3], 'finished_at')
+end
+redis.call('HSET', KEYS[3], 'version', version)
+if parent ~= '' and redis.call('EXISTS', KEYS[5]) == 1 then
+    redis.call('HSET', KEYS[5], 'version', version)
+end
+return version
+"""
+
+# Token bucket for utils.RateLimiter. KEYS: bucket hash. ARGV: capacity, rate
+# per second, cost, now. The bucket expires once it would be full again.
+_TAKE_TOKENS_SCRIPT = """
+local capacity, rate, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisJobStore:
+    """Job state in Redis (or any server speaking its protocol), shared by every worker process.
+
+    A job is a hash of JSON-encoded status keys plus a small hash of
+    bookkeeping; all changes go through one Lua script so concurrent
+    writers from different processes never interleave. The rate limiter's
+    buckets live here too. Needs the optional ``redis`` package.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='jobs:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("JOB_BACKEND=redis needs the redis package (pip install redis)")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._apply_script = self._redis.register_script(_APPLY_SCRIPT)
+        self._take_tokens_script = self._redis.register_script(_TAKE_TOKENS_SCRIPT)
+        self.prefix = prefix
+
+    def _key(self, kind, job_id=''):
+        return f"{self.prefix}{kind}{':' + job_id if job_id else ''}"
+
+    def _apply(self, mode, job_id, parent='', finished='', args=()):
+        keys = [self._key('version'), self._key('state', job_id), self._key('meta', job_id), self._key('ids'),
+                self._key('meta', parent or job_id)]
+        argv = [mode, job_id, repr(time.time()), parent or '', finished] + list(args)
+        return self._apply_script(keys=keys, args=argv)
+
+    def _apply_existing(self, mode, job_id, finished='', args=()):
+        """_apply for a change to an existing job, whose parent (read first) the script must be told up front"""
+        while True:
+            parent = self._redis.hget(self._key('meta', job_id), 'parent')
+            if parent is None:
+                return 0
+            result = self._apply(mode, job_id, parent, finished, args)
+            if result != -1:
+                return result
+
+    @staticmethod
+    def _pairs(fields):
+        args = []
+        for key, value in fields.items():
+            args += [key, encode_value(value)]
+        return args
+
+    def replace(self, job_id, state):
+        self._apply('replace', job_id, state.get('parent_playlist'), _finished_flag(state), self._pairs(state))
+
+    def update(self, job_id, fields):
+        return self._apply_existing('update', job_id, _finished_flag(fields), self._pairs(fields)) != 0
+
+    def unset(self, job_id, keys):
+        return self._apply_existing('unset', job_id, args=list(keys)) != 0
+
+    def remove(self, job_id):
+        return self._apply('remove', job_id) != 0
+
+    def touch(self, job_ids):
+        for job_id in job_ids:
+            if job_id:
+                self._apply_existing('touch', job_id)
+
+    def mark_accessed(self, job_id):
+        self._apply('access', job_id)
+
+    def load(self, job_id):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.exists(self._key('meta', job_id))
+        pipe.hgetall(self._key('state', job_id))
+        exists, fields = pipe.execute()
+        if not exists:
+            return None
+        return {key: decode_value(value) for key, value in fields.items()}
+
+    def load_many(self, job_ids):
+        job_ids = list(job_ids)
+        pipe = self._redis.pipeline(transaction=True)
+        for job_id in job_ids:
+            pipe.exists(self._key('meta', job_id))
+            pipe.hgetall(self._key('state', job_id))
+        results = pipe.execute()
+        return {job_id: {key: decode_value(value) for key, value in fields.items()}
+                for job_id, exists, fields in zip(job_ids, results[::2], results[1::2]) if exists}
+
+    def exists(self, job_id):
+        return bool(self._redis.exists(self._key('meta', job_id)))
+
+    def job_ids(self):
+        return list(self._redis.smembers(self._key('ids')))
+
+    def version(self):
+        return int(self._redis.get(self._key('version')) or 0)
+
+    def job_versions(self, job_ids):
+        job_ids = list(job_ids)
+        pipe = self._redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hget(self._key('meta', job_id), 'version')
+        return {job_id: int(version) for job_id, version in zip(job_ids, pipe.execute()) if version is not None}
+
+    def entries(self):
+        job_ids = self.job_ids()
+        pipe = self._redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(self._key('meta', job_id), 'parent', 'finished_at', 'accessed_at')
+        rows = []
+        for job_id, (parent, finished_at, accessed_at) in zip(job_ids, pipe.execute()):
+            rows.append((job_id, parent or None,
+                         float(finished_at) if finished_at else None,
+                         float(accessed_at) if accessed_at else None))
+        return rows
+
+    def take_tokens(self, key, capacity, rate, cost):
+        """Token-bucket check shared by all processes (see utils.RateLimiter); returns (allowed, retry_after)"""
+        allowed, tokens = self._take_tokens_script(
+            keys=[f"{self.prefix}rate:{key}"], args=[capacity, rate, cost, repr(time.time())]
+        )
+        return bool(allowed), 0.0 if allowed else (cost - float(tokens)) / rate
+
+    def stats(self):
+        job_ids = self.job_ids()
+        pipe = self._redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hget(self._key('state', job_id), 'status')
+        by_status = {}
+        for status in pipe.execute():
+            status = decode_value(status)
+            by_status[status] = by_status.get(status, 0) + 1
+        return {
+            'jobs': len(job_ids),
+            'by_status': by_status,
+            'approx_bytes': None,
+            'tracked_versions': len(job_ids),
+        }
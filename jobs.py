@@ -0,0 +1,493 @@
+# jobs.py
+import sys
+import threading
+import time
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+FINISHED_STATUSES = ('completed', 'error')
+
+
+def _plan_eviction(entries, now, ttl, max_finished):
+    """Pick the finished top-level jobs to evict from (job_id, parent, finished_at, last_used)
+    entries: those idle for longer than ttl, then the least recently used beyond
+    max_finished. Returns (expired job IDs, parent ID -> its item job IDs)."""
+    finished = []
+    children = {}
+    for job_id, parent, finished_at, last_used in entries:
+        if parent:
+            children.setdefault(parent, []).append(job_id)
+        elif finished_at is not None:
+            finished.append((max(finished_at, last_used or finished_at), job_id))
+    finished.sort()
+
+    expired = [job_id for last_used, job_id in finished if now - last_used > ttl]
+    overflow = len(finished) - len(expired) - max_finished
+    if overflow > 0:
+        expired += [job_id for _, job_id in finished[len(expired):len(expired) + overflow]]
+    return expired, children
+
+
+def _start_sweeper(registry, ttl, max_finished, on_evict, interval):
+    def evict_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.evict_finished(ttl, max_finished, on_evict)
+            except Exception as e:
+                print(f"Job eviction error: {str(e)}")
+
+    thread = threading.Thread(target=evict_loop, name='job-eviction')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class JobRecord(MutableMapping):
+    """A job's status: a mapping over fixed slots that tells its registry whenever it changes.
+
+    The keys every job carries live in __slots__ instead of a per-job dict,
+    and repeated short strings (status, type, quality) are interned; rarer
+    keys go to a small overflow dict. A change to a playlist item also
+    counts as a change to its playlist, whose aggregate progress depends
+    on it.
+    """
+
+    FIELDS = (
+        'url', 'filename', 'quality', 'type', 'status', 'progress', 'started_at', 'completed_at',
+        'error', 'filepath', 'is_playlist', 'result_key', 'parent_playlist', 'playlist_index',
+        'attempt', 'title', 'stage', 'cached', 'downloaded_bytes', 'total_bytes', 'downloaded',
+        'total_size', 'speed', 'eta',
+    )
+    INTERNED = frozenset(('status', 'type', 'quality', 'stage'))
+    _FIELD_SET = frozenset(FIELDS)
+
+    __slots__ = FIELDS + ('_registry', '_job_id', '_extra', 'finished_at', 'accessed_at')
+
+    def __init__(self, registry, job_id, data=()):
+        self._registry = registry
+        self._job_id = job_id
+        self._extra = None
+        self.finished_at = None      # monotonic time the job reached a final status
+        self.accessed_at = time.monotonic()
+        for key, value in (data.items() if hasattr(data, 'items') else data):
+            self._set(key, value)
+
+    def _set(self, key, value):
+        if key in self._FIELD_SET:
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+            if key == 'status':
+                if value in FINISHED_STATUSES:
+                    self.finished_at = self.finished_at or time.monotonic()
+                else:
+                    self.finished_at = None
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def _notify(self):
+        self._registry.touch(self._job_id, getattr(self, 'parent_playlist', None))
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            value = getattr(self, key, _MISSING)
+        else:
+            value = self._extra.get(key, _MISSING) if self._extra else _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+        self._notify()
+
+    def __delitem__(self, key):
+        if key in self._FIELD_SET and hasattr(self, key):
+            delattr(self, key)
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+        self._notify()
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def update(self, *args, **kwargs):
+        """Apply several changes with a single notification"""
+        for key, value in dict(*args, **kwargs).items():
+            self._set(key, value)
+        self._notify()
+
+    def memory_size(self):
+        """Approximate bytes held by this record and its values"""
+        size = sys.getsizeof(self)
+        if self._extra:
+            size += sys.getsizeof(self._extra)
+        for key in self:
+            value = self[key]
+            if key in self.INTERNED and isinstance(value, str):
+                continue  # shared with every other job
+            size += sys.getsizeof(value)
+            if isinstance(value, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in value)
+        return size
+
+    def __repr__(self):
+        return f"JobRecord({self._job_id!r}, {dict(self)!r})"
+
+
+class JobRegistry(dict):
+    """job_id -> JobRecord, with a global version counter bumped on every change.
+
+    Readers can block in wait_for_change() until a job they care about
+    changes instead of polling it. Finished jobs are evicted after a TTL,
+    or least recently used first once there are too many of them; a
+    playlist's item jobs leave together with the playlist.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.version = 0
+        self._versions = {}      # job_id -> version of its last change
+        self._cond = threading.Condition()
+        self.evicted = 0
+        self._evictor = None
+
+    def __setitem__(self, job_id, state):
+        super().__setitem__(job_id, JobRecord(self, job_id, state))
+        self.touch(job_id)
+
+    def __delitem__(self, job_id):
+        super().__delitem__(job_id)
+        self._forget(job_id)
+
+    def get(self, job_id, default=None):
+        record = super().get(job_id, default)
+        if record is not default:
+            record.accessed_at = time.monotonic()
+        return record
+
+    def get_many(self, job_ids):
+        """job_id -> record for those of job_ids that exist; not counted as an access"""
+        records = {}
+        for job_id in job_ids:
+            record = super().get(job_id)
+            if record is not None:
+                records[job_id] = record
+        return records
+
+    def pop(self, job_id, *default):
+        value = super().pop(job_id, *default)
+        self._forget(job_id)
+        return value
+
+    def touch(self, job_id, parent_id=None):
+        """Record that job_id (and its parent, if any) changed and wake up waiting readers.
+        Jobs no longer in the registry (a record still held by a running download) get no version."""
+        with self._cond:
+            self.version += 1
+            if job_id in self:
+                self._versions[job_id] = self.version
+            if parent_id and parent_id in self:
+                self._versions[parent_id] = self.version
+            self._cond.notify_all()
+
+    def _forget(self, job_id):
+        """job_id was removed: drop its version and wake its readers, who then see version 0"""
+        with self._cond:
+            self.version += 1
+            self._versions.pop(job_id, None)
+            self._cond.notify_all()
+
+    def changed_since(self, job_ids, since_version):
+        """The subset of job_ids that changed after since_version or no longer exist"""
+        with self._cond:
+            return [job_id for job_id in job_ids if self._versions.get(job_id, 0) > since_version
+                    or job_id not in self._versions]
+
+    def job_version(self, job_id):
+        with self._cond:
+            return self._versions.get(job_id, 0)
+
+    def wait_for_change(self, job_id, since_version, timeout=None):
+        """Block until job_id changes after since_version; returns its version (unchanged on
+        timeout), or 0 at once if the job no longer exists"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while job_id in self._versions and self._versions[job_id] <= since_version:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._versions.get(job_id, 0)
+
+    def evict_finished(self, ttl, max_finished, on_evict=None):
+        """Drop finished jobs idle for longer than ttl seconds, then the least recently
+        used ones beyond max_finished; on_evict(job_id, record) sees each top-level job.
+        Returns the number of records removed."""
+        expired, children = _plan_eviction(
+            ((job_id, getattr(record, 'parent_playlist', None), record.finished_at, record.accessed_at)
+             for job_id, record in list(self.items())),
+            time.monotonic(), ttl, max_finished
+        )
+
+        dropped = []
+        # Items whose playlist was deleted have nothing left to leave with
+        for parent in [parent for parent in children if parent not in self]:
+            for child_id in children.pop(parent):
+                if super().pop(child_id, None) is not None:
+                    dropped.append(child_id)
+
+        for job_id in expired:
+            record = super().pop(job_id, None)
+            if record is None:
+                continue
+            dropped.append(job_id)
+            for child_id in children.get(job_id, ()):
+                if super().pop(child_id, None) is not None:
+                    dropped.append(child_id)
+            if on_evict:
+                try:
+                    on_evict(job_id, record)
+                except Exception as e:
+                    print(f"Error archiving job {job_id}: {str(e)}")
+
+        if dropped:
+            with self._cond:
+                for job_id in dropped:
+                    self._versions.pop(job_id, None)
+                self.version += 1
+                self.evicted += len(dropped)
+                self._cond.notify_all()
+        return len(dropped)
+
+    def start_eviction(self, ttl, max_finished, on_evict=None, interval=30):
+        """Run evict_finished every interval seconds in the background (idempotent)"""
+        if self._evictor is None:
+            self._evictor = _start_sweeper(self, ttl, max_finished, on_evict, interval)
+
+    def stats(self):
+        by_status = {}
+        memory = 0
+        for record in list(self.values()):
+            status = record.get('status')
+            by_status[status] = by_status.get(status, 0) + 1
+            memory += record.memory_size()
+        with self._cond:
+            tracked_versions = len(self._versions)
+        return {
+            'backend': 'memory',
+            'jobs': sum(by_status.values()),
+            'by_status': by_status,
+            'approx_bytes': memory + sys.getsizeof(self),
+            'tracked_versions': tracked_versions,
+            'evicted': self.evicted,
+        }
+
+
+class SharedJobRecord(MutableMapping):
+    """A job's status in a shared store (see job_store.py).
+
+    Reads come from the snapshot loaded when the record was looked up;
+    writes go straight to the store, only the keys that changed, so
+    processes updating different keys of the same job do not overwrite
+    each other.
+    """
+
+    __slots__ = ('_registry', '_job_id', '_snapshot')
+
+    def __init__(self, registry, job_id, snapshot):
+        self._registry = registry
+        self._job_id = job_id
+        self._snapshot = snapshot
+
+    def __getitem__(self, key):
+        return self._snapshot[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        if key not in self._snapshot:
+            raise KeyError(key)
+        del self._snapshot[key]
+        self._registry.store.unset(self._job_id, [key])
+        self._registry.notify()
+
+    def __iter__(self):
+        return iter(list(self._snapshot))
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def update(self, *args, **kwargs):
+        """Apply several changes in one atomic write"""
+        fields = dict(*args, **kwargs)
+        self._snapshot.update(fields)
+        self._registry.store.update(self._job_id, fields)
+        self._registry.notify()
+
+    def __repr__(self):
+        return f"SharedJobRecord({self._job_id!r}, {self._snapshot!r})"
+
+
+class SharedJobRegistry(MutableMapping):
+    """JobRegistry over a store that several worker processes share.
+
+    Offers the same interface as JobRegistry, so any process can answer
+    status requests for jobs another one runs. Changes made in this process
+    wake waiting readers at once; changes from other processes are picked
+    up by polling the store's version counter.
+    """
+
+    POLL_INTERVAL = 0.25
+    ACCESS_INTERVAL = 60   # seconds between access-time writes for the same job
+
+    def __init__(self, store):
+        self.store = store
+        self._cond = threading.Condition()
+        self._accessed = {}    # job_id -> when this process last wrote its access time
+        self.evicted = 0
+        self._evictor = None
+
+    @property
+    def version(self):
+        return self.store.version()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def __getitem__(self, job_id):
+        snapshot = self.store.load(job_id)
+        if snapshot is None:
+            raise KeyError(job_id)
+        return SharedJobRecord(self, job_id, snapshot)
+
+    def __setitem__(self, job_id, state):
+        self.store.replace(job_id, dict(state))
+        self.notify()
+
+    def __delitem__(self, job_id):
+        if not self.store.remove(job_id):
+            raise KeyError(job_id)
+        self.notify()
+
+    def __contains__(self, job_id):
+        return self.store.exists(job_id)
+
+    def __iter__(self):
+        return iter(self.store.job_ids())
+
+    def __len__(self):
+        return len(self.store.job_ids())
+
+    def get(self, job_id, default=None):
+        snapshot = self.store.load(job_id)
+        if snapshot is None:
+            return default
+        if snapshot.get('status') in FINISHED_STATUSES:
+            self._mark_accessed(job_id)
+        return SharedJobRecord(self, job_id, snapshot)
+
+    def get_many(self, job_ids):
+        """job_id -> record for those of job_ids that exist, in one read; not counted as an access"""
+        return {job_id: SharedJobRecord(self, job_id, snapshot)
+                for job_id, snapshot in self.store.load_many(job_ids).items()}
+
+    def _mark_accessed(self, job_id):
+        """Write job_id's access time unless this process did so recently; eviction
+        works in JOB_TTL units, so a read is not worth a write transaction each time"""
+        now = time.monotonic()
+        with self._cond:
+            if now - self._accessed.get(job_id, -self.ACCESS_INTERVAL) < self.ACCESS_INTERVAL:
+                return
+            if len(self._accessed) > 10000:
+                self._accessed = {key: marked for key, marked in self._accessed.items()
+                                  if now - marked < self.ACCESS_INTERVAL}
+            self._accessed[job_id] = now
+        self.store.mark_accessed(job_id)
+
+    def pop(self, job_id, *default):
+        snapshot = self.store.load(job_id)
+        if snapshot is None or not self.store.remove(job_id):
+            if default:
+                return default[0]
+            raise KeyError(job_id)
+        self.notify()
+        return SharedJobRecord(self, job_id, snapshot)
+
+    def touch(self, job_id, parent_id=None):
+        self.store.touch((job_id, parent_id))
+        self.notify()
+
+    def changed_since(self, job_ids, since_version):
+        versions = self.store.job_versions(job_ids)
+        return [job_id for job_id in job_ids if versions.get(job_id, 0) > since_version or job_id not in versions]
+
+    def job_version(self, job_id):
+        return self.store.job_versions([job_id]).get(job_id, 0)
+
+    def wait_for_change(self, job_id, since_version, timeout=None):
+        """Like JobRegistry.wait_for_change; a job that no longer exists reports version 0 at once"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            versions = self.store.job_versions([job_id])
+            if job_id not in versions:
+                return 0
+            if versions[job_id] > since_version:
+                return versions[job_id]
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return versions[job_id]
+            with self._cond:
+                self._cond.wait(self.POLL_INTERVAL if remaining is None else min(self.POLL_INTERVAL, remaining))
+
+    def evict_finished(self, ttl, max_finished, on_evict=None):
+        """Same policy as JobRegistry.evict_finished; when several processes sweep at
+        once, only the one that actually removes a job calls on_evict for it"""
+        entries = self.store.entries()
+        expired, children = _plan_eviction(entries, time.time(), ttl, max_finished)
+        existing = {job_id for job_id, _, _, _ in entries}
+
+        removed = 0
+        for parent in [parent for parent in children if parent not in existing]:
+            removed += sum(1 for child_id in children.pop(parent) if self.store.remove(child_id))
+
+        for job_id in expired:
+            snapshot = self.store.load(job_id)
+            if snapshot is None or not self.store.remove(job_id):
+                continue
+            removed += 1 + sum(1 for child_id in children.get(job_id, ()) if self.store.remove(child_id))
+            if on_evict:
+                try:
+                    on_evict(job_id, snapshot)
+                except Exception as e:
+                    print(f"Error archiving job {job_id}: {str(e)}")
+
+        if removed:
+            self.evicted += removed
+            self.notify()
+        return removed
+
+    def start_eviction(self, ttl, max_finished, on_evict=None, interval=30):
+        """Run evict_finished every interval seconds in the background (idempotent)"""
+        if self._evictor is None:
+            self._evictor = _start_sweeper(self, ttl, max_finished, on_evict, interval)
+
+    def stats(self):
+        stats = self.store.stats()
+        stats.update({'backend': self.store.name, 'evicted': self.evicted})
+        return stats
@@ -0,0 +1,80 @@
+# media.py
+import os
+import shutil
+import subprocess
+
+# Path of the ffmpeg binary, or None when it is not installed
+FFMPEG = shutil.which('ffmpeg')
+
+
+class MediaError(Exception):
+    """ffmpeg failed to process a file"""
+    pass
+
+
+def _run_ffmpeg(args, output_path, output_format, timeout=3600):
+    """Run ffmpeg writing to a temporary file, moved to output_path on success"""
+    if not FFMPEG:
+        raise MediaError("ffmpeg is not installed")
+    temp_path = output_path + '.part'
+    cmd = [FFMPEG, '-y', '-nostdin', '-v', 'error'] + args + ['-f', output_format, temp_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result = None
+    if result is None or result.returncode != 0:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        detail = result.stderr.strip().splitlines()[-5:] if result is not None else ['timed out']
+        raise MediaError(f"ffmpeg failed: {' '.join(detail)}")
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def mux(video_path, audio_path, output_path, container='mp4'):
+    """Combine a video-only and an audio-only file into one, copying both streams
+    as they are (no re-encoding); container is 'mp4' or 'mkv'"""
+    args = ['-i', video_path, '-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy']
+    if container == 'mp4':
+        return _run_ffmpeg(args + ['-movflags', '+faststart'], output_path, 'mp4')
+    return _run_ffmpeg(args, output_path, 'matroska')
+
+
+# Codec carried by each source stream format
+SOURCE_CODECS = {'mp4': 'aac', 'm4a': 'aac', 'webm': 'opus', 'opus': 'opus', 'mp3': 'mp3'}
+
+# target -> (extension, ffmpeg muxer, codec the container takes as-is, encoder arguments)
+AUDIO_TARGETS = {
+    'mp3': ('mp3', 'mp3', 'mp3', ['-c:a', 'libmp3lame', '-q:a', '0']),
+    'm4a': ('m4a', 'ipod', 'aac', ['-c:a', 'aac', '-b:a', '192k']),
+    'opus': ('opus', 'ogg', 'opus', ['-c:a', 'libopus', '-b:a', '160k']),
+}
+
+
+def convert_audio(source_path, stem, target='mp3'):
+    """Turn a downloaded audio stream (named like ``title.webm.tmp``) into stem.<target>.
+
+    The stream is remuxed when the target container can hold its codec and
+    transcoded otherwise; each transcode uses one thread so a pool sized to
+    the CPU count keeps every core busy. Without ffmpeg the stream is kept
+    under its real extension. Returns the output path.
+    """
+    name = source_path[:-len('.tmp')] if source_path.endswith('.tmp') else source_path
+    source_format = os.path.splitext(name)[1].lstrip('.').lower()
+
+    if not FFMPEG:
+        output_path = f"{stem}.{'m4a' if source_format == 'mp4' else source_format}"
+        os.replace(source_path, output_path)
+        return output_path
+
+    extension, muxer, native_codec, encode_args = AUDIO_TARGETS.get(target, AUDIO_TARGETS['mp3'])
+    if SOURCE_CODECS.get(source_format) == native_codec:
+        codec_args = ['-c:a', 'copy']
+    else:
+        codec_args = encode_args + ['-threads', '1']
+    output_path = f"{stem}.{extension}"
+    _run_ffmpeg(['-i', source_path, '-vn', '-map_metadata', '0'] + codec_args, output_path, muxer)
+    os.remove(source_path)
+    return output_path
@@ -0,0 +1,1622 @@
+# pipeline.py
+"""The download pipeline: job state, the worker pool and every way of fetching a video.
+
+Shared by the web app (app.py) and the downloader daemon (downloader.py).
+Importing it starts no background threads; the web app starts its own.
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import Config
+from scheduler import DownloadScheduler
+from jobs import JobRegistry, SharedJobRegistry
+from job_store import SQLiteJobStore, RedisJobStore
+from job_queue import JobQueue
+from history import HistoryStore
+from file_index import FolderIndex
+from janitor import mark_used
+from streaming import process_chunks
+from fetcher import FetchCancelled, fetch_segmented
+from bandwidth import BandwidthShaper
+import media
+from cache import MetadataCache
+from results import ResultCache
+from utils import canonical_cache_key, extract_youtube_id
+import ytdlp_engine as ytdlp_engine_module
+
+# Try multiple YouTube libraries for better compatibility; YOUTUBE_LIB in the
+# environment forces one of 'pytubefix', 'pytube' or 'yt-dlp'
+YOUTUBE_LIB = 'yt-dlp'
+if Config.YOUTUBE_LIB in ('auto', 'pytubefix'):
+    try:
+        from pytubefix import YouTube, Playlist
+        YOUTUBE_LIB = 'pytubefix'
+    except ImportError:
+        pass
+if YOUTUBE_LIB == 'yt-dlp' and Config.YOUTUBE_LIB in ('auto', 'pytube'):
+    try:
+        from pytube import YouTube, Playlist
+        YOUTUBE_LIB = 'pytube'
+    except ImportError:
+        pass
+
+# yt-dlp runs in-process on warm worker processes when the module is installed,
+# otherwise through the yt-dlp command line
+ytdlp_engine = None
+if Config.YTDLP_ENGINE == 'embedded' and ytdlp_engine_module.AVAILABLE:
+    ytdlp_engine = ytdlp_engine_module.YtdlpEngine(workers=Config.YTDLP_ENGINE_WORKERS)
+
+if YOUTUBE_LIB == 'yt-dlp':
+    print(f"Using yt-dlp as fallback ({'embedded engine' if ytdlp_engine else 'command line'})")
+else:
+    print(f"Using {YOUTUBE_LIB} library")
+
+# Configuration
+DOWNLOAD_FOLDER = 'downloads'
+HISTORY_FILE = 'download_history.json'  # legacy format, imported into HISTORY_DB once
+HISTORY_DB = Config.HISTORY_DB
+MAX_CONCURRENT_DOWNLOADS = Config.MAX_CONCURRENT_DOWNLOADS
+PLAYLIST_PARALLELISM = Config.PLAYLIST_PARALLELISM
+PLAYLIST_ITEM_RETRIES = Config.PLAYLIST_ITEM_RETRIES
+DOWNLOAD_RETRIES = Config.DOWNLOAD_RETRIES
+STALL_TIMEOUT = Config.STALL_TIMEOUT
+SEGMENT_CONNECTIONS = Config.SEGMENT_CONNECTIONS
+AUDIO_FORMAT = Config.AUDIO_FORMAT if Config.AUDIO_FORMAT in media.AUDIO_TARGETS else 'mp3'
+POSTPROCESS_WORKERS = Config.POSTPROCESS_WORKERS or os.cpu_count() or 1
+JOB_BACKEND = Config.JOB_BACKEND
+DOWNLOAD_EXECUTOR = Config.DOWNLOAD_EXECUTOR
+BANDWIDTH_LIMIT = Config.BANDWIDTH_LIMIT
+JOB_BANDWIDTH_LIMIT = Config.JOB_BANDWIDTH_LIMIT
+CLIENT_BANDWIDTH_LIMIT = Config.CLIENT_BANDWIDTH_LIMIT
+
+# Headers pytube itself sends when fetching stream URLs
+PYTUBE_HEADERS = {'User-Agent': 'Mozilla/5.0', 'accept-language': 'en-US,en'}
+
+# Markers for the lines yt-dlp prints about a running download
+YTDLP_PROGRESS_PREFIX = '[ytdl-progress]'
+YTDLP_TITLE_PREFIX = '[ytdl-title]'
+YTDLP_FILEPATH_PREFIX = '[ytdl-filepath]'
+
+# Create downloads directory if it doesn't exist
+if not os.path.exists(DOWNLOAD_FOLDER):
+    os.makedirs(DOWNLOAD_FOLDER)
+
+# Global variables for tracking downloads; every change bumps a version that
+# event-stream readers wait on. The web app evicts finished jobs after JOB_TTL (see app.archive_job).
+# With a shared backend every worker process sees every job
+if JOB_BACKEND == 'sqlite':
+    active_downloads = SharedJobRegistry(SQLiteJobStore(Config.JOB_DB))
+elif JOB_BACKEND == 'redis':
+    active_downloads = SharedJobRegistry(RedisJobStore(Config.REDIS_URL))
+else:
+    active_downloads = JobRegistry()
+
+# Jobs waiting for the downloader daemon (downloader.py), when downloads run there
+if DOWNLOAD_EXECUTOR == 'daemon':
+    if JOB_BACKEND == 'memory':
+        raise RuntimeError("DOWNLOAD_EXECUTOR=daemon needs JOB_BACKEND=sqlite or redis so the web app can see the daemon's jobs")
+    job_queue = JobQueue(Config.JOB_DB)
+else:
+    job_queue = None
+
+# Fixed-size worker pool; jobs wait in its queue until a slot frees up
+download_scheduler = DownloadScheduler(max_workers=MAX_CONCURRENT_DOWNLOADS)
+
+# Download bandwidth divided between running jobs; each job's current
+# allocation is shown as rate_limit (bytes/s) in its status
+def report_rate(download_id, rate):
+    if download_id in active_downloads:
+        active_downloads[download_id]['rate_limit'] = rate
+
+bandwidth = BandwidthShaper(BANDWIDTH_LIMIT, JOB_BANDWIDTH_LIMIT, CLIENT_BANDWIDTH_LIMIT,
+                            small_job_bytes=Config.SMALL_DOWNLOAD_BYTES, on_rate=report_rate,
+                            slots=MAX_CONCURRENT_DOWNLOADS)
+
+# Playlist fan-out state by parent download_id
+playlist_runs = {}
+
+# Files in DOWNLOAD_FOLDER, kept current by the pipeline and a change watcher
+folder_index = FolderIndex(DOWNLOAD_FOLDER)
+
+# Completed downloads, appended one row at a time
+history_store = HistoryStore(HISTORY_DB, legacy_json_path=HISTORY_FILE)
+
+# Video/playlist metadata keyed by canonical ID; concurrent lookups share one extraction
+metadata_cache = MetadataCache(max_entries=Config.METADATA_CACHE_SIZE, ttl=Config.METADATA_CACHE_TTL)
+
+# Finished files by (video ID, quality, type) and the jobs currently producing them
+result_cache = ResultCache(HISTORY_DB)
+
+# Audio conversion, one ffmpeg process per core; download slots hand audio off
+# here instead of converting it themselves
+audio_processor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix='postprocess')
+
+# Returned by download_video_safe when the result will arrive through on_complete
+DEFERRED = object()
+
+def record_history(entry):
+    """Append a completed download to the history store"""
+    try:
+        history_store.add(entry)
+    except Exception as e:
+        print(f"Error saving history: {str(e)}")
+
+def sanitize_filename(filename):
+    """Remove invalid characters from filename"""
+    return re.sub(r'[<>:"/\\|?*]', '', filename)
+
+def output_name(title, url, quality, download_type):
+    """File name (without extension) for a download: the title plus the video ID
+    and, for video, the quality, so different results never share a file"""
+    name = sanitize_filename(title)
+    media_id = extract_youtube_id(url)
+    if media_id and media_id[0] == 'video':
+        name += f" [{media_id[1]}]"
+    if download_type != 'audio':
+        name += f" {quality}"
+    return name
+
+def result_key(url, quality, download_type):
+    """Result cache key for a single video, or None when the URL has no video ID"""
+    media_id = extract_youtube_id(url)
+    if not media_id or media_id[0] != 'video':
+        return None
+    # Audio downloads always take the best audio stream and differ only in output format
+    return f"{media_id[1]}:{AUDIO_FORMAT if download_type == 'audio' else quality}:{download_type}"
+
+def get_video_info_safe(url):
+    """Get video info, served from the metadata cache when possible"""
+    return metadata_cache.get_or_load(canonical_cache_key(url), lambda: extract_video_info(url))
+
+def extract_video_info(url):
+    """Get video info using multiple methods with fallbacks"""
+    try:
+        if YOUTUBE_LIB == 'pytubefix':
+            from pytubefix import YouTube, Playlist
+            if is_playlist_url(url):
+                return describe_playlist(Playlist(url))
+            else:
+                yt = YouTube(url)
+                return {
+                    'success': True,
+                    'type': 'video',
+                    'title': yt.title or 'Untitled Video',
+                    'thumbnail': yt.thumbnail_url or '',
+                    'duration': yt.length or 0,
+                    'description': (yt.description[:200] + '...') if yt.description and len(yt.description) > 200 else (yt.description or 'No description available')
+                }
+        
+        elif YOUTUBE_LIB == 'pytube':
+            from pytube import YouTube, Playlist
+            if is_playlist_url(url):
+                return describe_playlist(Playlist(url))
+            else:
+                yt = YouTube(url)
+                return {
+                    'success': True,
+                    'type': 'video',
+                    'title': yt.title or 'Untitled Video',
+                    'thumbnail': yt.thumbnail_url or '',
+                    'duration': yt.length or 0,
+                    'description': (yt.description[:200] + '...') if yt.description and len(yt.description) > 200 else (yt.description or 'No description available')
+                }
+        
+        else:  # yt-dlp fallback
+            return get_video_info_ytdlp(url)
+            
+    except Exception as e:
+        print(f"Error with {YOUTUBE_LIB}: {str(e)}")
+        # Try yt-dlp as fallback
+        try:
+            return get_video_info_ytdlp(url)
+        except Exception as e2:
+            print(f"Error with yt-dlp fallback: {str(e2)}")
+            return {
+                'success': False,
+                'error': f"Failed to get video info: {str(e)}"
+            }
+
+def is_playlist_url(url):
+    return 'playlist' in url.lower() or 'list=' in url
+
+def describe_playlist(playlist):
+    """Playlist info from its first page only; the count comes from the page header when shown"""
+    try:
+        video_count = playlist.length
+    except Exception:
+        video_count = None
+    return {
+        'success': True,
+        'type': 'playlist',
+        'title': playlist.title or 'Untitled Playlist',
+        'thumbnail': '',
+        'duration': 0,
+        'video_count': video_count,
+        'description': f"Playlist with {video_count} videos" if video_count else "Playlist"
+    }
+
+def iter_playlist_videos(url):
+    """Yield a playlist's video URLs as each page of the listing arrives"""
+    if YOUTUBE_LIB in ('pytubefix', 'pytube'):
+        try:
+            if YOUTUBE_LIB == 'pytubefix':
+                from pytubefix import Playlist
+            else:
+                from pytube import Playlist
+            # video_urls is a deferred list that fetches one page at a time
+            # as it is iterated
+            iterator = iter(Playlist(url).video_urls)
+            first = next(iterator, None)
+        except Exception as e:
+            print(f"Error listing playlist with {YOUTUBE_LIB}: {str(e)}")
+        else:
+            if first is not None:
+                yield first
+                yield from iterator
+                return
+    yield from iter_playlist_videos_ytdlp(url)
+
+def iter_playlist_videos_ytdlp(url):
+    """Flat, lazy playlist listing through yt-dlp: one line per entry, no per-video extraction"""
+    cmd = [
+        'yt-dlp',
+        '--flat-playlist',
+        '--lazy-playlist',
+        '--no-warnings',
+        '--print', '%(id)s',
+        url
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    try:
+        for line in process.stdout:
+            video_id = line.strip()
+            if video_id:
+                yield f"https://www.youtube.com/watch?v={video_id}"
+        process.wait()
+        if process.returncode != 0:
+            raise Exception(f"yt-dlp playlist error: {process.stderr.read()[-500:]}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+
+def get_video_info_ytdlp(url):
+    """Get video info using yt-dlp with enhanced options"""
+    if ytdlp_engine:
+        try:
+            params = ytdlp_base_params()
+            if is_playlist_url(url):
+                params['playlistend'] = 1  # title and count only; entries are listed lazily later
+            info = ytdlp_engine.extract_info(url, params)
+            description = info.get('description') or ''
+            info.update({
+                'success': True,
+                'title': info.get('title') or 'Untitled Video',
+                'description': (description[:200] + '...') if len(description) > 200 else (description or 'No description available')
+            })
+            return info
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"yt-dlp info failed: {str(e)}"
+            }
+    
+    try:
+        import subprocess
+        import json
+        
+        cmd = [
+            'yt-dlp', 
+            '--dump-json', 
+            '--no-download',
+            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            '--extractor-args', 'youtube:player_client=web,android',
+            '--no-warnings',
+            '--no-check-certificate',
+            '--prefer-free-formats',
+            '--add-header', 'Accept-Language:en-US,en;q=0.9',
+        ]
+        if is_playlist_url(url):
+            # One JSON object for the playlist itself instead of one per video
+            cmd[1:2] = ['--flat-playlist', '--dump-single-json', '--playlist-end', '1']
+        cmd.append(url)
+        
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=45)
+        
+        if result.returncode == 0:
+            # Parse the first line of JSON output
+            lines = result.stdout.strip().split('\n')
+            for line in lines:
+                if line.strip():
+                    try:
+                        info = json.loads(line)
+                        heights = {f.get('height') for f in info.get('formats') or [] if f.get('height')}
+                        return {
+                            'success': True,
+                            'type': 'playlist' if info.get('_type') == 'playlist' else 'video',
+                            'title': info.get('title', 'Untitled Video'),
+                            'thumbnail': info.get('thumbnail', ''),
+                            'duration': info.get('duration', 0),
+                            'description': (info.get('description', '')[:200] + '...') if info.get('description', '') and len(info.get('description', '')) > 200 else (info.get('description', '') or 'No description available'),
+                            'available_qualities': [f"{h}p" for h in sorted(heights, reverse=True)],
+                            'video_count': info.get('playlist_count')
+                        }
+                    except json.JSONDecodeError:
+                        continue
+            
+            # If we get here, no valid JSON was found
+            return {
+                'success': False,
+                'error': "Could not parse video information"
+            }
+        else:
+            error_msg = result.stderr or "Unknown error"
+            return {
+                'success': False,
+                'error': f"yt-dlp info error: {error_msg}"
+            }
+    except subprocess.TimeoutExpired:
+        return {
+            'success': False,
+            'error': "Timeout while getting video information"
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"yt-dlp info failed: {str(e)}"
+        }
+
+def download_video_safe(url, quality='highest', download_type='video', download_id=None, on_complete=None):
+    """Download video using multiple methods with fallbacks.
+
+    An identical earlier download is reused from disk, and if another job is
+    already downloading the same video/quality/type this one waits for it
+    instead of fetching (and overwriting) the same file.
+    
+    Audio is converted after the download by the post-processing pool. With
+    on_complete, this returns DEFERRED as soon as the bytes are fetched and
+    on_complete(result) is called once the conversion finishes; without it,
+    the call waits for the conversion.
+    """
+    key = result_key(url, quality, download_type)
+    token = download_id or str(uuid.uuid4())
+    while key:
+        cached = result_cache.lookup(key)
+        if cached:
+            return complete_from_cache(download_id, cached)
+        # A producer that has not started yet is taken over rather than waited
+        # for, so running jobs never wait on jobs stuck behind them in the queue
+        owner = result_cache.claim(key, token, takeover=lambda owner: job_is_queued(owner))
+        if owner == token:
+            break
+        while not result_cache.wait(key, owner, timeout=5):
+            if owner not in active_downloads:
+                result_cache.release(key, owner)
+    
+    def settle(result):
+        """Record a finished file and let other jobs for the same key proceed"""
+        try:
+            if result:
+                state = active_downloads.get(download_id) or {}
+                filepath = state.get('filepath') or os.path.join(DOWNLOAD_FOLDER, result)
+                # Counts as used now for the disk janitor, whatever times the source gave the file
+                mark_used(filepath)
+                folder_index.add(filepath)
+                if key:
+                    result_cache.store(key, filepath)
+            return result
+        finally:
+            if key:
+                result_cache.release(key, token)
+    
+    if download_id and download_id in active_downloads:
+        active_downloads[download_id]['status'] = 'downloading'
+    try:
+        with bandwidth.flow(download_id, job_client(download_id)):
+            result = _download_video_any(url, quality, download_type, download_id)
+    except Exception:
+        settle(False)
+        raise
+    
+    if not isinstance(result, Future):
+        return settle(result)
+    if on_complete is None:
+        return settle(result.result())
+    result.add_done_callback(lambda future: on_complete(settle(future.result())))
+    return DEFERRED
+
+def audio_stem(source_path):
+    """'dir/Title [id].m4a.tmp' -> 'dir/Title [id]'"""
+    return os.path.splitext(source_path[:-len('.tmp')])[0]
+
+def postprocess_audio(source_path, stem, download_id):
+    """Queue a downloaded audio stream for conversion to AUDIO_FORMAT; returns a
+    Future of the final filename (False on failure)"""
+    if download_id and download_id in active_downloads:
+        active_downloads[download_id].update({'stage': 'converting', 'progress': 99.9})
+    
+    def convert():
+        try:
+            filepath = media.convert_audio(source_path, stem, AUDIO_FORMAT)
+        except Exception as e:
+            print(f"Audio conversion error: {str(e)}")
+            if download_id and download_id in active_downloads:
+                active_downloads[download_id].update({
+                    'status': 'error',
+                    'error': f"Audio conversion failed: {str(e)}",
+                    'stage': None
+                })
+            return False
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id].update({
+                'status': 'completed',
+                'progress': 100,
+                'filepath': filepath,
+                'filename': os.path.basename(filepath),
+                'stage': None
+            })
+        return os.path.basename(filepath)
+    
+    return audio_processor.submit(convert)
+
+def job_client(download_id):
+    """Address of the client that started the job (or its playlist/batch), for per-client limits"""
+    state = active_downloads.get(download_id) or {}
+    if state.get('client') is None and state.get('parent_playlist'):
+        state = active_downloads.get(state['parent_playlist']) or {}
+    return state.get('client')
+
+def job_is_queued(download_id):
+    state = active_downloads.get(download_id)
+    return state is None or state.get('status') == 'queued'
+
+def complete_from_cache(download_id, filepath):
+    """Finish a job with a file an identical earlier download produced"""
+    filename = os.path.basename(filepath)
+    if download_id and download_id in active_downloads:
+        active_downloads[download_id].update({
+            'status': 'completed',
+            'progress': 100,
+            'filepath': filepath,
+            'filename': filename,
+            'cached': True
+        })
+    return filename
+
+def _download_video_any(url, quality, download_type, download_id):
+    try:
+        if YOUTUBE_LIB == 'pytubefix':
+            return download_with_pytubefix(url, quality, download_type, download_id)
+        elif YOUTUBE_LIB == 'pytube':
+            return download_with_pytube(url, quality, download_type, download_id)
+        else:
+            return download_with_ytdlp(url, quality, download_type, download_id)
+    except Exception as e:
+        print(f"Error with {YOUTUBE_LIB}: {str(e)}")
+        # Try yt-dlp as fallback
+        try:
+            return download_with_ytdlp(url, quality, download_type, download_id)
+        except Exception as e2:
+            print(f"Error with yt-dlp fallback: {str(e2)}")
+            if download_id and download_id in active_downloads:
+                active_downloads[download_id]['status'] = 'error'
+                active_downloads[download_id]['error'] = str(e)
+            return False
+
+def fetch_stream(stream, filepath, url, download_id, on_progress=None, connections=SEGMENT_CONNECTIONS, cancel=None):
+    """Download a pytube/pytubefix stream to filepath over parallel range requests,
+    resuming partial data after dropped connections and across restarts, at
+    the job's share of the bandwidth. Setting the Event cancel stops it."""
+    def report_progress(downloaded, total):
+        if download_id and download_id in active_downloads and total:
+            active_downloads[download_id].update({
+                'progress': (downloaded / total) * 100,
+                'downloaded_bytes': downloaded,
+                'total_bytes': total
+            })
+    
+    bandwidth.expect(download_id, stream.filesize)
+    fetch_segmented(
+        stream.url,
+        filepath,
+        total_bytes=stream.filesize,
+        identity=f"{canonical_cache_key(url)}:{stream.itag}",
+        on_progress=on_progress or report_progress,
+        connections=connections,
+        retries=DOWNLOAD_RETRIES,
+        stall_timeout=STALL_TIMEOUT,
+        headers=PYTUBE_HEADERS,
+        throttle=(lambda nbytes: bandwidth.throttle(download_id, nbytes)) if bandwidth.get(download_id) else None,
+        cancel=cancel
+    )
+
+def _stream_height(stream):
+    try:
+        return int((stream.resolution or '0p').rstrip('p'))
+    except ValueError:
+        return 0
+
+def select_adaptive_streams(yt, quality):
+    """(video, audio) adaptive streams to mux when they beat the best progressive
+    stream for the requested quality, else None"""
+    if not media.FFMPEG or quality == 'lowest':
+        return None
+    limit = None if quality == 'highest' else int(quality.rstrip('p')) if quality.rstrip('p').isdigit() else 720
+    
+    videos = [stream for stream in yt.streams.filter(adaptive=True, only_video=True)
+              if limit is None or _stream_height(stream) <= limit]
+    if not videos:
+        return None
+    # Highest resolution first; MP4 (H.264/AV1) over WebM at the same height
+    video = max(videos, key=lambda stream: (_stream_height(stream), stream.subtype == 'mp4'))
+    
+    progressive = [stream for stream in yt.streams.filter(progressive=True)
+                   if limit is None or _stream_height(stream) <= limit]
+    if progressive and max(_stream_height(stream) for stream in progressive) >= _stream_height(video):
+        return None
+    
+    # Audio in the same family as the video so the result fits in an MP4 when possible
+    audio = (yt.streams.filter(only_audio=True, subtype=video.subtype).order_by('abr').desc().first() or
+             yt.streams.filter(only_audio=True).order_by('abr').desc().first())
+    if not audio:
+        return None
+    return video, audio
+
+def download_adaptive(yt, video_stream, audio_stream, url, quality, download_type, download_id):
+    """Fetch the adaptive video and audio streams at the same time, then combine
+    them with a stream copy into MP4 (or MKV for WebM/mixed codecs)"""
+    container = 'mp4' if video_stream.subtype == 'mp4' and audio_stream.subtype == 'mp4' else 'mkv'
+    filename = f"{output_name(yt.title, url, quality, download_type)}.{container}"
+    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    video_path = filepath + '.video.tmp'
+    audio_path = filepath + '.audio.tmp'
+    
+    # Combined progress over both streams
+    parts = {'video': (0, video_stream.filesize), 'audio': (0, audio_stream.filesize)}
+    parts_lock = threading.Lock()
+    
+    def part_progress(part):
+        def on_progress(downloaded, total):
+            with parts_lock:
+                parts[part] = (downloaded, total)
+                downloaded_bytes = sum(done for done, _ in parts.values())
+                total_bytes = sum(size or 0 for _, size in parts.values())
+            if download_id and download_id in active_downloads and total_bytes:
+                active_downloads[download_id].update({
+                    'progress': min(downloaded_bytes / total_bytes * 100, 99.9),
+                    'downloaded_bytes': downloaded_bytes,
+                    'total_bytes': total_bytes
+                })
+        return on_progress
+    
+    # The audio stream is small; give the video stream the rest of the job's connections
+    video_connections = max(1, SEGMENT_CONNECTIONS - 1)
+    audio_thread_error = []
+    cancel = threading.Event()
+    
+    def fetch_audio():
+        try:
+            fetch_stream(audio_stream, audio_path, url, download_id, part_progress('audio'), connections=1,
+                         cancel=cancel)
+        except Exception as e:
+            audio_thread_error.append(e)
+            cancel.set()  # the video is no use without its audio
+    
+    audio_thread = threading.Thread(target=fetch_audio)
+    audio_thread.daemon = True
+    audio_thread.start()
+    try:
+        fetch_stream(video_stream, video_path, url, download_id, part_progress('video'),
+                     connections=video_connections, cancel=cancel)
+    except FetchCancelled:
+        pass  # the audio fetch failed; its error is raised below
+    except BaseException:
+        # Stop the audio fetch before passing the error on, so a retry
+        # never finds it still writing to the same .part file
+        cancel.set()
+        audio_thread.join()
+        raise
+    audio_thread.join()
+    if audio_thread_error:
+        raise audio_thread_error[0]
+    
+    if download_id and download_id in active_downloads:
+        active_downloads[download_id]['stage'] = 'muxing'
+    media.mux(video_path, audio_path, filepath, container)
+    for path in (video_path, audio_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    if download_id and download_id in active_downloads:
+        active_downloads[download_id].update({
+            'status': 'completed',
+            'progress': 100,
+            'filepath': filepath,
+            'filename': os.path.basename(filepath),
+            'stage': None
+        })
+    return filename
+
+def download_with_pytubefix(url, quality, download_type, download_id):
+    """Download using pytubefix with enhanced settings"""
+    try:
+        from pytubefix import YouTube
+        
+        # Initialize with enhanced settings
+        yt = YouTube(
+            url, 
+            use_oauth=False,
+            allow_oauth_cache=False
+        )
+        
+        # Above the best progressive resolution, fetch separate video and audio and mux them
+        adaptive = select_adaptive_streams(yt, quality) if download_type == 'video' else None
+        if adaptive:
+            return download_adaptive(yt, adaptive[0], adaptive[1], url, quality, download_type, download_id)
+        
+        if download_type == 'audio':
+            # Try different audio stream options
+            stream = (yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc().first() or
+                     yt.streams.filter(only_audio=True).order_by('abr').desc().first())
+            # Fetched as-is, then converted by the post-processing stage
+            filename = f"{output_name(yt.title, url, quality, download_type)}.{stream.subtype}.tmp" if stream else None
+        else:
+            # Priority: Get video WITH audio - progressive streams are guaranteed to have both
+            if quality == 'highest':
+                # First try progressive (video+audio), then fallback with explicit audio check
+                stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
+                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').desc().first() or
+                         yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first())
+            elif quality == 'lowest':
+                # Try progressive first for lowest quality with audio
+                stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').asc().first() or
+                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').asc().first() or
+                         yt.streams.filter(file_extension='mp4').order_by('resolution').asc().first())
+            else:
+                # Try exact quality with progressive streams first (guaranteed video+audio)
+                stream = (yt.streams.filter(progressive=True, file_extension='mp4', res=quality).first() or
+                         yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
+                         yt.streams.filter(file_extension='mp4', res=quality, adaptive=False).first() or
+                         yt.streams.filter(file_extension='mp4', adaptive=False).order_by('resolution').desc().first())
+            
+            # Final fallback - ensure we get SOMETHING with audio
+            if not stream:
+                print("Warning: No progressive stream found, trying any available stream")
+                stream = yt.streams.filter(file_extension='mp4').first() or yt.streams.first()
+            
+            filename = f"{output_name(yt.title, url, quality, download_type)}.mp4"
+        
+        if stream:
+            filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+            
+            # Retries resume from the bytes already on disk
+            fetch_stream(stream, filepath, url, download_id)
+            
+            if download_type == 'audio':
+                return postprocess_audio(filepath, os.path.join(DOWNLOAD_FOLDER, output_name(yt.title, url, quality, download_type)), download_id)
+            
+            if download_id and download_id in active_downloads:
+                active_downloads[download_id].update({
+                    'status': 'completed',
+                    'progress': 100,
+                    'filepath': filepath,
+                    'filename': os.path.basename(filepath)
+                })
+            
+            return filename
+        else:
+            raise Exception("No suitable stream found")
+            
+    except Exception as e:
+        print(f"Pytubefix download error: {str(e)}")
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = f"Pytubefix error: {str(e)}"
+        return False
+
+def download_with_pytube(url, quality, download_type, download_id):
+    """Download using original pytube"""
+    from pytube import YouTube
+    
+    yt = YouTube(url)
+    
+    adaptive = select_adaptive_streams(yt, quality) if download_type == 'video' else None
+    if adaptive:
+        return download_adaptive(yt, adaptive[0], adaptive[1], url, quality, download_type, download_id)
+    
+    if download_type == 'audio':
+        stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+        filename = f"{output_name(yt.title, url, quality, download_type)}.{stream.subtype}.tmp" if stream else None
+    else:
+        # Prioritize progressive streams (video + audio) for complete downloads
+        if quality == 'highest':
+            stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
+                     yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first() or
+                     yt.streams.get_highest_resolution())
+        elif quality == 'lowest':
+            stream = (yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').asc().first() or
+                     yt.streams.filter(file_extension='mp4').order_by('resolution').asc().first() or
+                     yt.streams.get_lowest_resolution())
+        else:
+            # Try exact quality with progressive (video+audio) first
+            stream = (yt.streams.filter(progressive=True, file_extension='mp4', res=quality).first() or
+                     yt.streams.filter(file_extension='mp4', res=quality).first() or
+                     yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first() or
+                     yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first() or
+                     yt.streams.get_highest_resolution())
+        
+        filename = f"{output_name(yt.title, url, quality, download_type)}.mp4"
+    
+    if stream:
+        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+        fetch_stream(stream, filepath, url, download_id)
+        
+        if download_type == 'audio':
+            return postprocess_audio(filepath, os.path.join(DOWNLOAD_FOLDER, output_name(yt.title, url, quality, download_type)), download_id)
+        
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id].update({
+                'status': 'completed',
+                'progress': 100,
+                'filepath': filepath,
+                'filename': os.path.basename(filepath)
+            })
+        
+        return filename
+    return False
+
+def ytdlp_format_selector(quality):
+    """yt-dlp format string for a quality choice - FORCE video+audio combination"""
+    if quality == 'highest':
+        return 'best[ext=mp4][acodec!=none][vcodec!=none]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+    elif quality == 'lowest':
+        return 'worst[ext=mp4][acodec!=none][vcodec!=none]/worstvideo[ext=mp4]+worstaudio[ext=m4a]/worst[ext=mp4]/worst'
+    else:
+        # Extract resolution number (e.g., "720p" -> "720")
+        res = quality.replace('p', '') if 'p' in quality else '720'
+        return f'best[height<={res}][ext=mp4][acodec!=none][vcodec!=none]/bestvideo[height<={res}][ext=mp4]+bestaudio[ext=m4a]/best[height<={res}][ext=mp4]/best[height<={res}]/best'
+
+def ytdlp_base_params():
+    """YoutubeDL options matching the command-line flags used for yt-dlp"""
+    return {
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept-Language': 'en-US,en;q=0.9'
+        },
+        'extractor_args': {'youtube': {'player_client': ['web', 'android']}},
+        'nocheckcertificate': True,
+        'prefer_free_formats': True
+    }
+
+def ytdlp_download_params(quality, download_type, outtmpl):
+    """YoutubeDL options for a download, mirroring download_with_ytdlp's command"""
+    params = ytdlp_base_params()
+    params.update({
+        'outtmpl': outtmpl,
+        'sleep_interval': 1,
+        'max_sleep_interval': 5,
+        'continuedl': True,
+        'retries': DOWNLOAD_RETRIES,
+        'fragment_retries': DOWNLOAD_RETRIES,
+        'socket_timeout': STALL_TIMEOUT,
+        'concurrent_fragment_downloads': SEGMENT_CONNECTIONS,
+        'updatetime': False   # keep the download's own mtime, not the server's Last-Modified
+    })
+    if download_type == 'audio':
+        # Converted afterwards by the post-processing stage
+        params['format'] = 'bestaudio[ext=m4a]/bestaudio'
+    else:
+        params['format'] = ytdlp_format_selector(quality)
+        params['writethumbnail'] = True
+        params['postprocessors'] = [
+            {'key': 'FFmpegMetadata', 'add_metadata': True},
+            {'key': 'EmbedThumbnail'}
+        ]
+    return params
+
+def download_with_ytdlp_engine(url, quality, download_type, download_id):
+    """Download through the embedded yt-dlp engine with live progress hooks"""
+    info = metadata_cache.get(canonical_cache_key(url))
+    video_title = sanitize_filename(info['title']) if info and info.get('title') else '%(title)s'
+    outtmpl = os.path.join(DOWNLOAD_FOLDER, f"{output_name(video_title, url, quality, download_type)}.%(ext)s")
+    if download_type == 'audio':
+        outtmpl += '.tmp'
+    
+    def on_progress(event):
+        if event.get('title') and download_id in active_downloads:
+            active_downloads[download_id]['title'] = event['title']
+        update_ytdlp_progress(download_id, [event.get('downloaded_bytes'), event.get('total_bytes'), None,
+                                            event.get('speed'), event.get('eta')])
+    
+    try:
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'downloading'
+        
+        params = ytdlp_download_params(quality, download_type, outtmpl)
+        rate = bandwidth.pin(download_id)
+        if rate:
+            params['ratelimit'] = rate
+        # A download without progress for STALL_TIMEOUT seconds is interrupted
+        # and resumed from its .part file, like the command-line path
+        stalls = 0
+        while True:
+            try:
+                result = ytdlp_engine.download(download_id, url, params, on_progress, stall_timeout=STALL_TIMEOUT)
+                break
+            except ytdlp_engine_module.DownloadStalled:
+                stalls += 1
+                if stalls > DOWNLOAD_RETRIES:
+                    raise Exception(f"Download stalled - no data for {STALL_TIMEOUT} seconds after {DOWNLOAD_RETRIES} retries")
+                print(f"yt-dlp stalled for {STALL_TIMEOUT}s, resuming ({stalls}/{DOWNLOAD_RETRIES})")
+        if not result.get('filepath'):
+            raise Exception("yt-dlp did not report an output file")
+        
+        if download_type == 'audio':
+            return postprocess_audio(result['filepath'], audio_stem(result['filepath']), download_id)
+        
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id].update({
+                'status': 'completed',
+                'progress': 100,
+                'filepath': result['filepath'],
+                'filename': os.path.basename(result['filepath'])
+            })
+        
+        return os.path.basename(result['filepath'])
+    except Exception as e:
+        error_msg = f"yt-dlp engine error: {str(e)}"
+        print(error_msg)
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = error_msg
+        return False
+
+def download_with_ytdlp(url, quality, download_type, download_id):
+    """Download using yt-dlp with enhanced options to bypass restrictions"""
+    if ytdlp_engine:
+        return download_with_ytdlp_engine(url, quality, download_type, download_id)
+    
+    try:
+        # Name the file from cached metadata when we already have it; otherwise
+        # let yt-dlp fill in the title itself rather than running a second extraction
+        info = metadata_cache.get(canonical_cache_key(url))
+        video_title = sanitize_filename(info['title']) if info and info.get('title') else '%(title)s'
+        filename = f"{output_name(video_title, url, quality, download_type)}.%(ext)s"
+        
+        if download_type == 'audio':
+            # The raw audio stream is converted afterwards by the post-processing stage
+            filename += '.tmp'
+            cmd = [
+                'yt-dlp', 
+                '-f', 'bestaudio[ext=m4a]/bestaudio',
+                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                '--extractor-args', 'youtube:player_client=web,android',
+                '--no-warnings',
+                '--no-check-certificate',
+                '--prefer-free-formats',
+                '--add-header', 'Accept-Language:en-US,en;q=0.9',
+                '--sleep-interval', '1',
+                '--max-sleep-interval', '5',
+                '--continue',
+                '--retries', str(DOWNLOAD_RETRIES),
+                '--fragment-retries', str(DOWNLOAD_RETRIES),
+                '--socket-timeout', str(STALL_TIMEOUT),
+                '--concurrent-fragments', str(SEGMENT_CONNECTIONS),
+                '--no-mtime',
+                '-o', os.path.join(DOWNLOAD_FOLDER, filename),
+            ]
+        else:
+            cmd = [
+                'yt-dlp',
+                '-f', ytdlp_format_selector(quality),
+                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                '--extractor-args', 'youtube:player_client=web,android',
+                '--no-warnings',
+                '--no-check-certificate',
+                '--prefer-free-formats',
+                '--add-header', 'Accept-Language:en-US,en;q=0.9',
+                '--sleep-interval', '1',
+                '--max-sleep-interval', '5',
+                '--continue',
+                '--retries', str(DOWNLOAD_RETRIES),
+                '--fragment-retries', str(DOWNLOAD_RETRIES),
+                '--socket-timeout', str(STALL_TIMEOUT),
+                '--concurrent-fragments', str(SEGMENT_CONNECTIONS),
+                '--no-mtime',
+                '--embed-thumbnail',
+                '--add-metadata',
+                '-o', os.path.join(DOWNLOAD_FOLDER, filename),
+            ]
+        
+        # Machine-readable progress and the final path, one line each
+        cmd += [
+            '--newline',
+            '--progress',
+            '--progress-template', 'download:' + YTDLP_PROGRESS_PREFIX + ' %(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s',
+            '--print', 'before_dl:' + YTDLP_TITLE_PREFIX + ' %(title)s',
+            '--print', 'after_move:' + YTDLP_FILEPATH_PREFIX + ' %(filepath)s'
+        ]
+        # yt-dlp cannot be throttled from here as it goes; it gets a fixed fair share
+        rate = bandwidth.pin(download_id)
+        if rate:
+            cmd += ['--limit-rate', str(rate)]
+        cmd.append(url)
+        
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'downloading'
+        
+        # Execute download, reading its output as it is produced. A run that
+        # prints nothing for STALL_TIMEOUT seconds is killed and started again,
+        # picking up from yt-dlp's .part file
+        stalls = 0
+        while True:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            stalled = threading.Event()
+            last_output = [time.monotonic()]
+            
+            def watch_for_stall():
+                while process.poll() is None:
+                    time.sleep(1)
+                    if time.monotonic() - last_output[0] > STALL_TIMEOUT:
+                        stalled.set()
+                        process.kill()
+                        return
+            
+            watchdog = threading.Thread(target=watch_for_stall)
+            watchdog.daemon = True
+            watchdog.start()
+            
+            final_path = None
+            recent_output = deque(maxlen=20)  # kept only for the error message
+            for line in process.stdout:
+                last_output[0] = time.monotonic()
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith(YTDLP_PROGRESS_PREFIX):
+                    update_ytdlp_progress(download_id, line[len(YTDLP_PROGRESS_PREFIX):].split())
+                elif line.startswith(YTDLP_TITLE_PREFIX):
+                    if download_id and download_id in active_downloads:
+                        active_downloads[download_id]['title'] = line[len(YTDLP_TITLE_PREFIX):].strip()
+                elif line.startswith(YTDLP_FILEPATH_PREFIX):
+                    final_path = line[len(YTDLP_FILEPATH_PREFIX):].strip()
+                else:
+                    recent_output.append(line)
+            process.wait()
+            
+            if not stalled.is_set():
+                break
+            stalls += 1
+            if stalls > DOWNLOAD_RETRIES:
+                raise subprocess.TimeoutExpired(cmd, STALL_TIMEOUT)
+            print(f"yt-dlp stalled for {STALL_TIMEOUT}s, resuming ({stalls}/{DOWNLOAD_RETRIES})")
+        
+        if process.returncode == 0 and final_path:
+            if download_type == 'audio':
+                return postprocess_audio(final_path, audio_stem(final_path), download_id)
+            
+            filename = os.path.basename(final_path)
+            
+            if download_id and download_id in active_downloads:
+                active_downloads[download_id].update({
+                    'status': 'completed',
+                    'progress': 100,
+                    'filepath': final_path,
+                    'filename': filename
+                })
+            
+            return filename
+        else:
+            error_msg = "\n".join(recent_output) or "Download failed"
+            print(f"yt-dlp error: {error_msg}")
+            if download_id and download_id in active_downloads:
+                active_downloads[download_id]['status'] = 'error'
+                active_downloads[download_id]['error'] = f"yt-dlp error: {error_msg}"
+            return False
+            
+    except subprocess.TimeoutExpired:
+        error_msg = f"Download stalled - no data for {STALL_TIMEOUT} seconds after {DOWNLOAD_RETRIES} retries"
+        print(error_msg)
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = error_msg
+        return False
+    except Exception as e:
+        error_msg = f"Download exception: {str(e)}"
+        print(error_msg)
+        if download_id and download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = error_msg
+        return False
+
+def stream_filename(url, quality, download_type):
+    """Name a streamed download is saved under: progressive MP4 video or M4A audio"""
+    info = get_video_info_safe(url)
+    if not info['success']:
+        raise Exception(info.get('error', 'Failed to get video information'))
+    name = output_name(info['title'], url, quality, download_type)
+    # Progressive video can differ from what /download produces, so it gets its own name
+    return f"{name}.m4a" if download_type == 'audio' else f"{name} progressive.mp4"
+
+def open_media_stream(url, quality, download_type, client=None):
+    """(total_bytes or None, chunk iterator) reading a video straight from its source.
+
+    Only single-file formats can be streamed: progressive MP4 for video (no
+    merging of separate video/audio streams) and M4A for audio (no MP3
+    conversion). The stream counts against the bandwidth limits like a
+    download started by client.
+    """
+    stream_id = f"stream-{uuid.uuid4()}"
+    if YOUTUBE_LIB in ('pytubefix', 'pytube'):
+        try:
+            return open_pytube_stream(url, quality, download_type, stream_id, client)
+        except Exception as e:
+            print(f"Error streaming with {YOUTUBE_LIB}: {str(e)}")
+    return None, open_ytdlp_stream(url, quality, download_type, stream_id, client)
+
+def _shaped_chunks(stream_id, client, total_bytes, url):
+    """Chunks of url, throttled to the stream's share of the bandwidth"""
+    if YOUTUBE_LIB == 'pytubefix':
+        from pytubefix import request as pytube_request
+    else:
+        from pytube import request as pytube_request
+    
+    with bandwidth.flow(stream_id, client) as flow:
+        bandwidth.expect(stream_id, total_bytes)
+        chunks = pytube_request.stream(url)
+        try:
+            for chunk in chunks:
+                if flow:
+                    bandwidth.throttle(stream_id, len(chunk))
+                yield chunk
+        finally:
+            chunks.close()
+
+def open_pytube_stream(url, quality, download_type, stream_id, client=None):
+    yt = YouTube(url)
+    if download_type == 'audio':
+        stream = yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc().first()
+    else:
+        progressive = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution')
+        if quality == 'lowest':
+            stream = progressive.asc().first()
+        elif quality == 'highest':
+            stream = progressive.desc().first()
+        else:
+            stream = yt.streams.filter(progressive=True, file_extension='mp4', res=quality).first() or progressive.desc().first()
+    if not stream:
+        raise Exception("No single-file stream available")
+    return stream.filesize, _shaped_chunks(stream_id, client, stream.filesize, stream.url)
+
+def open_ytdlp_stream(url, quality, download_type, stream_id, client=None):
+    """yt-dlp's output for url, at a rate pinned from the bandwidth budget for as long as it runs"""
+    with bandwidth.flow(stream_id, client):
+        rate = bandwidth.pin(stream_id)
+        yield from process_chunks(_ytdlp_stream_cmd(url, quality, download_type, rate))
+
+def _ytdlp_stream_cmd(url, quality, download_type, rate=None):
+    if download_type == 'audio':
+        format_selector = 'bestaudio[ext=m4a]'
+    elif quality == 'lowest':
+        format_selector = 'worst[ext=mp4][acodec!=none][vcodec!=none]'
+    elif quality == 'highest':
+        format_selector = 'best[ext=mp4][acodec!=none][vcodec!=none]'
+    else:
+        res = quality.replace('p', '') if 'p' in quality else '720'
+        format_selector = f'best[height<={res}][ext=mp4][acodec!=none][vcodec!=none]/best[ext=mp4][acodec!=none][vcodec!=none]'
+    
+    cmd = [
+        'yt-dlp',
+        '-f', format_selector,
+        '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        '--extractor-args', 'youtube:player_client=web,android',
+        '--no-warnings',
+        '--no-check-certificate',
+        '--add-header', 'Accept-Language:en-US,en;q=0.9',
+        '--quiet',
+        '-o', '-',
+        url
+    ]
+    if rate:
+        cmd[-1:-1] = ['--limit-rate', str(rate)]
+    return cmd
+
+def _parse_number(value):
+    """Parse a yt-dlp template field, which is 'NA' when unknown"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def update_ytdlp_progress(download_id, fields):
+    """Apply one parsed yt-dlp progress line to the job state"""
+    if not download_id or download_id not in active_downloads or len(fields) < 5:
+        return
+    downloaded, total, estimate, speed, eta = (_parse_number(f) for f in fields[:5])
+    total = total or estimate
+    
+    update = {'status': 'downloading'}
+    if downloaded is not None:
+        update['downloaded_bytes'] = int(downloaded)
+        update['downloaded'] = format_bytes(downloaded)
+    if total:
+        update['total_bytes'] = int(total)
+        update['total_size'] = format_bytes(total)
+        if downloaded is not None:
+            update['progress'] = round(min(downloaded / total * 100, 100), 1)
+    update['speed'] = f"{format_bytes(speed)}/s" if speed else None
+    update['eta'] = int(eta) if eta is not None else None
+    active_downloads[download_id].update(update)
+
+def format_bytes(bytes):
+    """Convert bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if bytes < 1024.0:
+            return f"{bytes:.1f} {unit}"
+        bytes /= 1024.0
+    return f"{bytes:.1f} TB"
+
+def progress_callback(stream, chunk, bytes_remaining):
+    """Progress callback for downloads"""
+    download_id = getattr(stream, 'download_id', None)
+    if download_id and download_id in active_downloads:
+        total_size = stream.filesize
+        downloaded = total_size - bytes_remaining
+        progress = (downloaded / total_size) * 100 if total_size > 0 else 0
+        
+        active_downloads[download_id].update({
+            'progress': round(progress, 1),
+            'downloaded': format_bytes(downloaded),
+            'total_size': format_bytes(total_size),
+            'status': 'downloading'
+        })
+
+def download_video(url, quality, download_type, download_id):
+    """Download a single video"""
+    try:
+        active_downloads[download_id]['status'] = 'processing'
+        
+        yt = YouTube(url)
+        yt.register_on_progress_callback(progress_callback)
+        
+        # Set download_id on the stream for progress tracking
+        if download_type == 'audio':
+            stream = yt.streams.filter(only_audio=True).first()
+        elif quality == 'highest':
+            stream = yt.streams.get_highest_resolution()
+        elif quality == 'lowest':
+            stream = yt.streams.get_lowest_resolution()
+        else:
+            stream = yt.streams.filter(res=quality).first()
+            if not stream:
+                stream = yt.streams.get_highest_resolution()
+        
+        if not stream:
+            raise Exception("No suitable stream found")
+            
+        stream.download_id = download_id
+        
+        # Create filename
+        safe_title = sanitize_filename(yt.title)
+        if download_type == 'audio':
+            filename = f"{safe_title}.mp4"  # pytube downloads audio as mp4
+        else:
+            filename = f"{safe_title}_{quality}.{stream.subtype}"
+            
+        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+        
+        # Update download info
+        active_downloads[download_id].update({
+            'title': yt.title,
+            'thumbnail': yt.thumbnail_url,
+            'duration': yt.length,
+            'filename': filename,
+            'filepath': filepath
+        })
+        
+        # Download the file
+        stream.download(output_path=DOWNLOAD_FOLDER, filename=filename)
+        
+        # Mark as completed
+        active_downloads[download_id]['status'] = 'completed'
+        active_downloads[download_id]['progress'] = 100
+        active_downloads[download_id]['completed_at'] = datetime.now().isoformat()
+        
+        # Add to history
+        history_entry = {
+            'id': download_id,
+            'title': yt.title,
+            'url': url,
+            'quality': quality,
+            'type': download_type,
+            'filename': filename,
+            'downloaded_at': datetime.now().isoformat(),
+            'file_size': format_bytes(os.path.getsize(filepath)) if os.path.exists(filepath) else 'Unknown'
+        }
+        record_history(history_entry)
+        
+    except Exception as e:
+        active_downloads[download_id]['status'] = 'error'
+        active_downloads[download_id]['error'] = str(e)
+
+class PlaylistRun:
+    """Fans a playlist's videos out over the download workers.
+
+    Videos are dispatched as the listing yields them, so downloads start
+    with the first page while later pages are still being fetched. At most
+    PLAYLIST_PARALLELISM items of one playlist are queued or running at a
+    time; failed items are retried up to PLAYLIST_ITEM_RETRIES times.
+    """
+    
+    def __init__(self, download_id, video_urls, quality, download_type, on_finished=None, expected_count=None):
+        self.download_id = download_id
+        self.expected_count = expected_count
+        self.quality = quality
+        self.download_type = download_type
+        self.on_finished = on_finished
+        self.source = video_urls
+        self.pending = deque()
+        self.results = []   # filename, False for a failed item, None while unfinished
+        self.attempts = {}
+        self.active = 0
+        self.enumerated = False
+        self.cancelled = False
+        self.finished = False
+        self.lock = threading.Lock()
+    
+    @property
+    def total(self):
+        """Number of videos, once the whole listing has been read"""
+        return len(self.results) if self.enumerated else None
+    
+    def expect(self, count):
+        """Add count videos the listing will reach later (a playlist in a batch) to the expected
+        total, or take them off (duplicates it skipped) with a negative count"""
+        with self.lock:
+            self.expected_count = (self.expected_count or 0) + count
+            expected = self.expected_count
+        if self.download_id in active_downloads:
+            active_downloads[self.download_id]['expected_videos'] = expected
+    
+    def start(self):
+        feeder = threading.Thread(target=self._enumerate, name=f"playlist-{self.download_id}")
+        feeder.daemon = True
+        feeder.start()
+    
+    def _enumerate(self):
+        error = None
+        try:
+            for video_url in self.source:
+                with self.lock:
+                    if self.cancelled:
+                        break
+                    self.pending.append((len(self.results), video_url))
+                    self.results.append(None)
+                    discovered = len(self.results)
+                if self.download_id in active_downloads:
+                    active_downloads[self.download_id]['discovered_videos'] = discovered
+                self._dispatch()
+        except Exception as e:
+            error = e
+            print(f"Playlist listing error: {str(e)}")
+        
+        with self.lock:
+            self.enumerated = True
+            done = self.active == 0 and not self.pending
+        if self.download_id in active_downloads:
+            active_downloads[self.download_id]['total_videos'] = len(self.results)
+            if error is not None:
+                active_downloads[self.download_id]['error'] = f"Playlist listing stopped early: {str(error)}"
+        if done:
+            self._finish()
+    
+    def _dispatch(self):
+        to_start = []
+        with self.lock:
+            while not self.cancelled and self.active < PLAYLIST_PARALLELISM and self.pending:
+                index, video_url = self.pending.popleft()
+                self.attempts[index] = self.attempts.get(index, 0) + 1
+                to_start.append((index, video_url, self.attempts[index]))
+                self.active += 1
+        
+        for index, video_url, attempt in to_start:
+            video_download_id = f"{self.download_id}_video_{index}"
+            active_downloads[video_download_id] = {
+                'url': video_url,
+                'quality': self.quality,
+                'type': self.download_type,
+                'status': 'queued',
+                'progress': 0,
+                'parent_playlist': self.download_id,
+                'playlist_index': index,
+                'attempt': attempt
+            }
+            download_scheduler.submit(video_download_id, self._run_item, index, video_url, video_download_id)
+    
+    def _run_item(self, index, video_url, video_download_id):
+        result = False
+        try:
+            if self.download_id not in active_downloads:
+                return  # playlist was deleted while this item waited
+            print(f"Downloading video {index + 1}/{self.total or '?'}: {video_url}")
+            result = download_video_safe(video_url, self.quality, self.download_type, video_download_id,
+                                         on_complete=lambda converted: self._item_finished(index, video_url, converted))
+        except Exception as e:
+            print(f"Error downloading video {index + 1}: {e}")
+            if video_download_id in active_downloads:
+                active_downloads[video_download_id]['status'] = 'error'
+                active_downloads[video_download_id]['error'] = str(e)
+        finally:
+            # Audio still being converted reports back through on_complete
+            if result is not DEFERRED:
+                self._item_finished(index, video_url, result)
+    
+    def _item_finished(self, index, video_url, result):
+        retry = False
+        with self.lock:
+            self.active -= 1
+            if result:
+                self.results[index] = result
+                print(f"Successfully downloaded: {result}")
+            elif not self.cancelled and self.attempts.get(index, 0) <= PLAYLIST_ITEM_RETRIES:
+                # Retry at the back of this playlist's line
+                self.pending.append((index, video_url))
+                retry = True
+            else:
+                self.results[index] = False
+            done = self.enumerated and self.active == 0 and not self.pending
+        
+        if retry:
+            print(f"Retrying video {index + 1}/{self.total or '?'}: {video_url}")
+        self._update_parent()
+        if done:
+            self._finish()
+        else:
+            self._dispatch()
+    
+    def _update_parent(self):
+        parent = active_downloads.get(self.download_id)
+        if parent is None:
+            return
+        with self.lock:
+            results = list(self.results)
+        finished = sum(1 for r in results if r is not None)
+        next_in_order = next((i for i, r in enumerate(results) if r is None), len(results))
+        parent.update({
+            'completed_videos': finished,
+            'failed_videos': sum(1 for r in results if r is False),
+            'completed_in_order': next_in_order,
+            'downloaded_files': [r for r in results if r],
+            'progress': self.progress()
+        })
+    
+    def progress(self):
+        """Byte-weighted progress over the videos listed so far; unknown sizes count as the average known size"""
+        with self.lock:
+            results = list(self.results)
+            enumerated = self.enumerated
+            complete = enumerated and not self.pending and self.active == 0
+        # Until the listing ends, the count from the playlist header is the best denominator
+        item_count = len(results) if enumerated else max(len(results), self.expected_count or 0)
+        if not item_count:
+            return 100 if complete else 0
+        
+        known_total = known_done = 0
+        known_items = finished_unknown = 0
+        children = active_downloads.get_many([f"{self.download_id}_video_{index}" for index in range(len(results))])
+        for index, result in enumerate(results):
+            child = children.get(f"{self.download_id}_video_{index}")
+            total = child.get('total_bytes') if child else None
+            if total:
+                known_items += 1
+                known_total += total
+                known_done += total if result is not None else min(child.get('downloaded_bytes') or 0, total)
+            elif result is not None:
+                finished_unknown += 1
+        
+        ceiling = 100 if complete else 99.9
+        if not known_items:
+            return round(min(finished_unknown / item_count * 100, ceiling), 1)
+        average = known_total / known_items
+        estimated_total = known_total + (item_count - known_items) * average
+        estimated_done = known_done + finished_unknown * average
+        return round(min(estimated_done / estimated_total * 100, ceiling), 1)
+    
+    def cancel(self):
+        """Stop listing and dispatching items and drop the ones still waiting for a worker"""
+        with self.lock:
+            self.cancelled = True
+            self.pending.clear()
+            count = len(self.results)
+        for index in range(count):
+            video_download_id = f"{self.download_id}_video_{index}"
+            if download_scheduler.cancel(video_download_id):
+                self._item_finished(index, None, False)
+    
+    def _finish(self):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        playlist_runs.pop(self.download_id, None)
+        successful = sum(1 for r in self.results if r)
+        summary = f"Playlist: {successful}/{len(self.results)} videos downloaded"
+        if self.download_id in active_downloads:
+            active_downloads[self.download_id]['status'] = 'completed' if successful else 'error'
+            active_downloads[self.download_id]['progress'] = 100
+            if not successful:
+                active_downloads[self.download_id]['error'] = (
+                    active_downloads[self.download_id].get('error') or
+                    ('No videos in the playlist could be downloaded' if self.results else 'The playlist has no videos')
+                )
+        if self.on_finished:
+            self.on_finished(summary if successful else False)
+
+def download_playlist(url, quality, download_type, download_id, on_finished=None):
+    """Start downloading all videos from a playlist on the worker pool"""
+    try:
+        active_downloads[download_id]['status'] = 'processing'
+        
+        # Title comes from the cached playlist info; the videos themselves
+        # are listed lazily, page by page, while downloads already run
+        info = get_video_info_safe(url)
+        
+        active_downloads[download_id].update({
+            'total_videos': None,
+            'expected_videos': info.get('video_count'),
+            'discovered_videos': 0,
+            'completed_videos': 0,
+            'failed_videos': 0,
+            'playlist_title': info.get('title') or 'Untitled Playlist',
+            'downloaded_files': []
+        })
+        
+        playlist_runs[download_id] = run = PlaylistRun(download_id, iter_playlist_videos(url), quality, download_type,
+                                                          on_finished, expected_count=info.get('video_count'))
+        active_downloads[download_id]['status'] = 'downloading'
+        run.start()
+        return run
+        
+    except Exception as e:
+        print(f"Playlist download error: {str(e)}")
+        active_downloads[download_id]['status'] = 'error'
+        active_downloads[download_id]['error'] = str(e)
+        if on_finished:
+            on_finished(False)
+        return False
+
+def batch_video_links(urls):
+    """Number of single-video links in a batch; its playlists are counted as they are listed"""
+    return sum(1 for url in urls if extract_youtube_id(url)[0] != 'playlist')
+
+def iter_batch_videos(urls, on_playlist=None, on_duplicate=None):
+    """Video URLs of a batch in order, playlists expanded, each video once;
+    on_playlist(video_count) is called before a playlist is listed and
+    on_duplicate() for every video skipped because it came up before"""
+    seen = set()
+    for url in urls:
+        if extract_youtube_id(url)[0] == 'playlist':
+            if on_playlist:
+                on_playlist(get_video_info_safe(url).get('video_count') or 0)
+            videos = iter_playlist_videos(url)
+        else:
+            videos = [url]
+        for video_url in videos:
+            video_id = extract_youtube_id(video_url)
+            if video_id in seen:
+                if on_duplicate:
+                    on_duplicate()
+                continue
+            seen.add(video_id)
+            yield video_url
+
+def download_batch(urls, quality, download_type, download_id, on_finished=None):
+    """Download a list of links as one job, item by item on the worker pool like a playlist"""
+    # Links and playlist lengths are all counted up front; duplicates come off as they are skipped
+    videos = iter_batch_videos(urls, on_playlist=lambda count: run.expect(count), on_duplicate=lambda: run.expect(-1))
+    playlist_runs[download_id] = run = PlaylistRun(download_id, videos, quality, download_type,
+                                                      on_finished, expected_count=batch_video_links(urls))
+    active_downloads[download_id]['status'] = 'downloading'
+    run.start()
+    return run
+
+def enqueue_download(download_id, job):
+    """Hand a job to the local worker pool, or to the downloader daemon's queue; returns its queue position"""
+    if job_queue is not None:
+        return job_queue.put(download_id, job)
+    return download_scheduler.submit(download_id, run_download_job, download_id, **job)
+
+def job_filename(title, url, quality, download_type):
+    """Name shown for a job before its file exists; replaced by the real one when it completes"""
+    if download_type == 'audio':
+        # Without ffmpeg the audio stream is kept as downloaded, usually M4A
+        extension = AUDIO_FORMAT if media.FFMPEG else 'm4a'
+    else:
+        extension = 'mp4'
+    return f"{output_name(title, url, quality, download_type)}.{extension}"
+
+def analyze_download(download_id, url, quality, download_type):
+    """First stage of a /download job: look the video or playlist up and name the job; returns the info"""
+    active_downloads[download_id]['status'] = 'analyzing'
+    info = get_video_info_safe(url)
+    if not info.get('success'):
+        raise Exception(info.get('error') or 'Failed to analyze video/playlist')
+    active_downloads[download_id].update({
+        'title': info['title'],
+        'filename': job_filename(info['title'], url, quality, download_type),
+        'is_playlist': info.get('type') == 'playlist'
+    })
+    return info
+
+def run_download_job(download_id, url, quality, download_type, is_playlist, title, key, urls=None, on_done=None):
+    """Download a queued job (a video, a whole playlist or a batch of urls); on_done() runs
+    once it has finished, which for playlists and converted audio is after this returns"""
+    def finish_download(result):
+        try:
+            if result:
+                # Add to history
+                history_item = {
+                    'id': download_id,
+                    'url': url,
+                    'filename': result if not is_playlist else f"{'Batch' if urls else 'Playlist'}: {title}",
+                    'quality': quality,
+                    'type': download_type,
+                    'downloaded_at': datetime.now().isoformat(),
+                    'status': 'completed',
+                    'is_playlist': is_playlist
+                }
+                record_history(history_item)
+                print(f"Download completed: {result}")
+            else:
+                if download_id in active_downloads:
+                    active_downloads[download_id]['status'] = 'error'
+                    if not active_downloads[download_id].get('error'):
+                        active_downloads[download_id]['error'] = 'Download failed'
+                print(f"Download failed for: {url}")
+        finally:
+            if on_done:
+                on_done()
+    
+    try:
+        if not urls:
+            info = analyze_download(download_id, url, quality, download_type)
+            title = info['title']
+            is_playlist = info.get('type') == 'playlist'
+            if is_playlist and key:
+                result_cache.release(key, download_id)
+                key = None
+        active_downloads[download_id]['status'] = 'downloading'
+        
+        # Playlists fan their videos out over the worker pool and
+        # report back when the last one finishes; their own run takes no
+        # time and would skew queue estimates
+        if urls or is_playlist:
+            download_scheduler.skip_timing(download_id)
+        if urls:
+            download_batch(urls, quality, download_type, download_id, on_finished=finish_download)
+        elif is_playlist:
+            download_playlist(url, quality, download_type, download_id, on_finished=finish_download)
+        else:
+            result = download_video_safe(url, quality, download_type, download_id, on_complete=finish_download)
+            if result is not DEFERRED:
+                finish_download(result)
+            
+    except Exception as e:
+        print(f"Download error: {str(e)}")
+        if download_id in active_downloads:
+            active_downloads[download_id]['status'] = 'error'
+            active_downloads[download_id]['error'] = str(e)
+        if key:
+            result_cache.release(key, download_id)
+        if on_done:
+            on_done()
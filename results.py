@@ -0,0 +1,128 @@
+# results.py
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class ResultCache:
+    """Finished downloads keyed by (video ID, quality, type), plus the jobs producing them.
+
+    Completed outputs are recorded in SQLite so a repeat request is served
+    from the file already on disk. While a key is being downloaded its owner
+    job is tracked in memory; other requests for the same key attach to that
+    job or wait for it instead of downloading the video again.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    filepath TEXT NOT NULL,
+                    created_at TEXT
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_results_filepath ON results (filepath)')
+        self._owners = {}            # key -> download_id producing it
+        self._cond = threading.Condition()
+        self._expiry = None
+
+    def lookup(self, key):
+        """Path of the stored result for key, or None (forgetting results whose file is gone)"""
+        with self._lock:
+            row = self._conn.execute('SELECT filepath FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.isfile(row[0]):
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            return None
+        return row[0]
+
+    def store(self, key, filepath):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (key, filepath, created_at) VALUES (?, ?, ?)',
+                (key, filepath, datetime.now().isoformat())
+            )
+
+    def forget_path(self, filepath):
+        """Drop every result stored at filepath (the file was deleted)"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM results WHERE filepath = ?', (filepath,))
+
+    def claim(self, key, download_id, takeover=None):
+        """Make download_id the producer of key unless another job already is; returns the owner.
+
+        takeover(owner) may return True to hand the key over from an owner
+        that has not started yet.
+        """
+        with self._cond:
+            owner = self._owners.get(key)
+            if owner is None or (owner != download_id and takeover and takeover(owner)):
+                self._owners[key] = owner = download_id
+                self._cond.notify_all()
+            return owner
+
+    def owner(self, key):
+        with self._cond:
+            return self._owners.get(key)
+
+    def release(self, key, download_id):
+        """download_id is no longer producing key; wakes jobs waiting for it"""
+        with self._cond:
+            if self._owners.get(key) == download_id:
+                del self._owners[key]
+                self._cond.notify_all()
+
+    def release_finished(self, finished):
+        """Release every key whose owner is among finished(owner IDs); returns how many.
+
+        For owners that run in another process (the downloader daemon),
+        which releases its keys there and never here.
+        """
+        with self._cond:
+            owners = dict(self._owners)
+        if not owners:
+            return 0
+        done = finished(list(set(owners.values())))
+        with self._cond:
+            released = [key for key, owner in owners.items() if owner in done and self._owners.get(key) == owner]
+            for key in released:
+                del self._owners[key]
+            if released:
+                self._cond.notify_all()
+        return len(released)
+
+    def start_expiry(self, finished, interval=30):
+        """Run release_finished every interval seconds in the background (idempotent)"""
+        if self._expiry is not None:
+            return
+
+        def expiry_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.release_finished(finished)
+                except Exception as e:
+                    print(f"Result claim expiry error: {str(e)}")
+
+        self._expiry = threading.Thread(target=expiry_loop, name='result-claim-expiry')
+        self._expiry.daemon = True
+        self._expiry.start()
+
+    def wait(self, key, owner, timeout=None):
+        """Block until owner releases key; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._owners.get(key) != owner, timeout)
+
+    def stats(self):
+        with self._lock:
+            stored = self._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        with self._cond:
+            return {'stored': stored, 'in_flight': len(self._owners)}
@@ -0,0 +1,127 @@
+# scheduler.py
+import heapq
+import threading
+import time
+from collections import deque
+
+
+class DownloadScheduler:
+    """Fixed-size pool of worker threads fed from a FIFO job queue"""
+
+    def __init__(self, max_workers=3, default_duration=60.0, history_size=20):
+        self.max_workers = max(1, int(max_workers))
+        self.default_duration = default_duration
+        self._pending = deque()          # (job_id, func, args, kwargs) in start order
+        self._running = {}               # job_id -> monotonic start time
+        self._untimed = set()            # running jobs left out of average_duration
+        self._durations = deque(maxlen=history_size)
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._cond:
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"download-worker-{i}")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, job_id, func, *args, **kwargs):
+        """Queue a job; returns its 1-based queue position"""
+        self.start()
+        with self._cond:
+            self._pending.append((job_id, func, args, kwargs))
+            self._cond.notify()
+            return len(self._pending)
+
+    def cancel(self, job_id):
+        """Drop a job that has not started yet"""
+        with self._cond:
+            for entry in self._pending:
+                if entry[0] == job_id:
+                    self._pending.remove(entry)
+                    return True
+        return False
+
+    def queue_position(self, job_id):
+        """1-based position among waiting jobs, or None if not waiting"""
+        with self._cond:
+            for index, entry in enumerate(self._pending):
+                if entry[0] == job_id:
+                    return index + 1
+        return None
+
+    def is_running(self, job_id):
+        with self._cond:
+            return job_id in self._running
+
+    def skip_timing(self, job_id):
+        """Leave a running job out of the average duration, e.g. one that only
+        hands its work on to other jobs and returns straight away"""
+        with self._cond:
+            if job_id in self._running:
+                self._untimed.add(job_id)
+
+    def average_duration(self):
+        """Mean wall time of recently finished jobs"""
+        with self._cond:
+            if not self._durations:
+                return self.default_duration
+            return sum(self._durations) / len(self._durations)
+
+    def estimated_wait(self, job_id):
+        """Seconds until a waiting job is expected to start, or None"""
+        avg = self.average_duration()
+        now = time.monotonic()
+        with self._cond:
+            position = None
+            for index, entry in enumerate(self._pending):
+                if entry[0] == job_id:
+                    position = index + 1
+                    break
+            if position is None:
+                return None
+
+            # Simulate the pool: each worker frees up when its current job
+            # is expected to finish, then takes the next job in line.
+            free_at = [max(started + avg - now, 0.0) for started in self._running.values()]
+            free_at += [0.0] * (self.max_workers - len(free_at))
+            heapq.heapify(free_at)
+            start = 0.0
+            for _ in range(position):
+                start = heapq.heappop(free_at)
+                heapq.heappush(free_at, start + avg)
+            return start
+
+    def stats(self):
+        """Snapshot of pool utilisation"""
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._pending),
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id, func, args, kwargs = self._pending.popleft()
+                started = time.monotonic()
+                self._running[job_id] = started
+
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"Worker error in job {job_id}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._running.pop(job_id, None)
+                    if job_id in self._untimed:
+                        self._untimed.discard(job_id)
+                    else:
+                        self._durations.append(time.monotonic() - started)
@@ -5,6 +5,7 @@ class YouTubeDownloader {
         this.bindEvents();
         this.currentDownloadId = null;
         this.progressCheckInterval = null;
+        this.progressEvents = null;
         this.loadHistory();
         this.loadQueue();
     }
@@ -210,12 +211,46 @@ class YouTubeDownloader {
 
     closeProgressModal() {
         this.elements.progressModal.classList.remove('active');
+        this.stopProgressTracking();
+    }
+
+    stopProgressTracking() {
+        if (this.progressEvents) {
+            this.progressEvents.close();
+            this.progressEvents = null;
+        }
         if (this.progressCheckInterval) {
             clearInterval(this.progressCheckInterval);
+            this.progressCheckInterval = null;
         }
     }
 
     startProgressTracking() {
+        this.stopProgressTracking();
+        if (!this.currentDownloadId) return;
+
+        // Prefer server-pushed updates; fall back to polling if the stream fails
+        if (window.EventSource) {
+            const events = new EventSource(`/download_events/${this.currentDownloadId}`);
+            this.progressEvents = events;
+
+            events.onmessage = (event) => {
+                this.handleProgressUpdate(JSON.parse(event.data));
+            };
+            events.addEventListener('gone', () => this.stopProgressTracking());
+            events.onerror = () => {
+                if (this.progressEvents === events) {
+                    events.close();
+                    this.progressEvents = null;
+                    this.startProgressPolling();
+                }
+            };
+        } else {
+            this.startProgressPolling();
+        }
+    }
+
+    startProgressPolling() {
         if (this.progressCheckInterval) {
             clearInterval(this.progressCheckInterval);
         }
@@ -228,21 +263,7 @@ class YouTubeDownloader {
                 const data = await response.json();
 
                 if (response.ok) {
-                    this.updateProgressDisplay(data);
-
-                    if (data.status === 'completed' || data.status === 'error') {
-                        clearInterval(this.progressCheckInterval);
-                        
-                        if (data.status === 'completed') {
-                            this.showToast('Download completed successfully!', 'success');
-                            setTimeout(() => this.closeProgressModal(), 2000);
-                        } else {
-                            this.showToast(data.error || 'Download failed', 'error');
-                        }
-                        
-                        this.loadHistory();
-                        this.loadQueue();
-                    }
+                    this.handleProgressUpdate(data);
                 }
             } catch (error) {
                 console.error('Error checking download status:', error);
@@ -250,6 +271,24 @@ class YouTubeDownloader {
         }, 1000);
     }
 
+    handleProgressUpdate(data) {
+        this.updateProgressDisplay(data);
+
+        if (data.status === 'completed' || data.status === 'error') {
+            this.stopProgressTracking();
+            
+            if (data.status === 'completed') {
+                this.showToast('Download completed successfully!', 'success');
+                setTimeout(() => this.closeProgressModal(), 2000);
+            } else {
+                this.showToast(data.error || 'Download failed', 'error');
+            }
+            
+            this.loadHistory();
+            this.loadQueue();
+        }
+    }
+
     updateProgressDisplay(data) {
         const container = this.elements.currentDownload;
         
@@ -290,11 +329,11 @@ class YouTubeDownloader {
 
     async loadHistory() {
         try {
-            const response = await fetch('/history');
+            const response = await fetch('/history?per_page=50');
             const data = await response.json();
 
             if (response.ok) {
-                this.displayHistory(data);
+                this.displayHistory(data.items);
             }
         } catch (error) {
             console.error('Error loading history:', error);
@@ -309,7 +348,8 @@ class YouTubeDownloader {
             return;
         }
 
-        const html = history.reverse().map(item => `
+        // The server returns newest first
+        const html = history.map(item => `
             <div class="download-item">
                 <h4>${item.title}</h4>
                 <div class="download-meta">
@@ -0,0 +1,82 @@
+# streaming.py
+import os
+import subprocess
+import threading
+from collections import deque
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamError(Exception):
+    """The media source stopped before delivering the whole file"""
+    pass
+
+
+def process_chunks(cmd, chunk_size=CHUNK_SIZE):
+    """Run cmd and yield its stdout in chunks as it is produced.
+
+    stderr is drained on a separate thread so a chatty process cannot block;
+    a non-zero exit raises StreamError with its last lines. Closing the
+    generator (e.g. the client went away) kills the process.
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = deque(maxlen=20)
+
+    def drain_stderr():
+        for line in process.stderr:
+            errors.append(line.decode('utf-8', 'replace').strip())
+
+    reader = threading.Thread(target=drain_stderr)
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            chunk = process.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        process.wait()
+        reader.join(timeout=5)
+        if process.returncode != 0:
+            raise StreamError("\n".join(line for line in errors if line) or f"exit status {process.returncode}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def tee_to_file(chunks, final_path, on_complete=None):
+    """Yield chunks unchanged while writing them to final_path.
+
+    Bytes go to final_path + '.part', which is renamed into place only when
+    the source ends cleanly and deleted if it fails or the client
+    disconnects. If another stream is already writing the same file, the
+    chunks are passed through without saving.
+    """
+    part_path = final_path + '.part'
+    try:
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        yield from chunks
+        return
+
+    complete = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            os.replace(part_path, final_path)
+            if on_complete:
+                on_complete(final_path)
+        else:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
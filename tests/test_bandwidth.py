@@ -0,0 +1,89 @@
+# tests/test_bandwidth.py
+import os
+import sys
+import unittest
+from contextlib import ExitStack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandwidth import BandwidthShaper  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class BandwidthShaperTest(unittest.TestCase):
+    """Flows opened moments ago have no throughput history, so demand never
+    lowers a share and the division depends only on the caps and weights"""
+
+    def open_flows(self, shaper, *jobs):
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        return {job_id: stack.enter_context(shaper.flow(job_id, client)) for job_id, client in jobs}
+
+    def test_total_divided_evenly(self):
+        shaper = BandwidthShaper(total=1_000_000)
+        flows = self.open_flows(shaper, ('a', None), ('b', None))
+        self.assertEqual([flows['a'].rate, flows['b'].rate], [500_000, 500_000])
+
+    def test_per_job_cap(self):
+        shaper = BandwidthShaper(total=1_000_000, per_job=100_000)
+        flows = self.open_flows(shaper, ('a', None), ('b', None))
+        self.assertEqual([flows['a'].rate, flows['b'].rate], [100_000, 100_000])
+
+    def test_per_job_cap_without_total(self):
+        shaper = BandwidthShaper(per_job=100_000)
+        flows = self.open_flows(shaper, ('a', None))
+        self.assertEqual(flows['a'].rate, 100_000)
+
+    def test_per_client_cap_leaves_rest_to_others(self):
+        shaper = BandwidthShaper(total=1_000_000, per_client=300_000)
+        flows = self.open_flows(shaper, ('a1', 'alice'), ('a2', 'alice'), ('b1', 'bob'))
+        self.assertEqual([flows['a1'].rate, flows['a2'].rate], [150_000, 150_000])
+        self.assertEqual(flows['b1'].rate, 300_000)
+
+    def test_small_job_gets_larger_share(self):
+        shaper = BandwidthShaper(total=1_000_000, small_job_bytes=64 * MB)
+        flows = self.open_flows(shaper, ('small', None), ('large', None))
+        shaper.expect('small', 10 * MB)
+        shaper.expect('large', 1024 * MB)
+        self.assertEqual(flows['small'].rate, 800_000)
+        self.assertEqual(flows['large'].rate, 200_000)
+
+    def test_unlimited_when_disabled(self):
+        shaper = BandwidthShaper()
+        flows = self.open_flows(shaper, ('a', None))
+        self.assertIsNone(flows['a'])
+        self.assertIsNone(shaper.pin('a'))
+
+    def test_pin_takes_fair_share_of_total(self):
+        shaper = BandwidthShaper(total=1_000_000, slots=4)
+        flows = self.open_flows(shaper, ('pinned', None), ('other', None))
+        self.assertEqual(shaper.pin('pinned'), 250_000)
+        self.assertEqual(flows['other'].rate, 750_000)
+        # A pinned rate holds while others come and go
+        self.open_flows(shaper, ('third', None))
+        self.assertEqual(flows['pinned'].rate, 250_000)
+        self.assertEqual(flows['other'].rate, 375_000)
+
+    def test_pin_within_client_and_job_caps(self):
+        shaper = BandwidthShaper(total=1_000_000, per_client=400_000, slots=4)
+        self.open_flows(shaper, ('first', 'alice'), ('second', 'alice'))
+        self.assertEqual(shaper.pin('first'), 100_000)
+        self.assertEqual(shaper.pin('second'), 100_000)
+
+        shaper = BandwidthShaper(total=1_000_000, per_job=50_000, slots=4)
+        self.open_flows(shaper, ('capped', None))
+        self.assertEqual(shaper.pin('capped'), 50_000)
+
+    def test_rates_reported_and_cleared(self):
+        reported = []
+        shaper = BandwidthShaper(total=1_000_000, on_rate=lambda job_id, rate: reported.append((job_id, rate)))
+        with shaper.flow('a'):
+            with shaper.flow('b'):
+                pass
+        self.assertEqual(reported, [('a', 1_000_000), ('a', 500_000), ('b', 500_000),
+                                    ('a', 1_000_000), ('b', None), ('a', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
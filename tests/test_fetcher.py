@@ -0,0 +1,130 @@
+# tests/test_fetcher.py
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetcher  # noqa: E402
+
+BODY = os.urandom(3 * 1024 * 1024)
+DROP_AFTER = 700 * 1024   # bytes sent before each connection is cut
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves BODY with Range support, cutting every response off after DROP_AFTER bytes;
+    /noranges ignores Range headers and sends the whole body"""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/noranges':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+            return
+        start, end = 0, len(BODY)
+        range_header = self.headers.get('Range')
+        if range_header:
+            first, last = range_header.split('=')[1].split('-')
+            start, end = int(first), int(last) + 1 if last else len(BODY)
+            self.server.ranges.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{len(BODY)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        self.wfile.write(BODY[start:min(end, start + DROP_AFTER)])
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a FlakyHandler server and a scratch folder for each test"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.requests = 0
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.folder = tempfile.mkdtemp()
+        # Retry immediately; patching _backoff leaves time.sleep alone for everything else
+        backoff = mock.patch.object(fetcher, '_backoff', lambda failures, cancel: fetcher._check_cancel(cancel))
+        backoff.start()
+        self.addCleanup(backoff.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+
+class FetchResumableTest(ServerTestCase):
+
+    def test_resumes_dropped_connections(self):
+        filepath = os.path.join(self.folder, 'video.mp4')
+        size = fetcher.fetch_resumable(f"{self.base}/video", filepath, stall_timeout=5)
+        self.assertEqual(size, len(BODY))
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertFalse(os.path.exists(filepath + '.part'))
+        self.assertFalse(os.path.exists(fetcher.sidecar_path(filepath)))
+        self.assertGreater(self.server.requests, 1)
+
+    def test_permanent_error_fails_fast(self):
+        filepath = os.path.join(self.folder, 'missing.mp4')
+        started = time.monotonic()
+        with self.assertRaises(fetcher.FetchError):
+            fetcher.fetch_resumable(f"{self.base}/missing", filepath, retries=5, stall_timeout=5)
+        self.assertEqual(self.server.requests, 1)
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class SegmentedFetchTest(ServerTestCase):
+
+    def test_segments_reassemble_file(self):
+        filepath = os.path.join(self.folder, 'video.mp4')
+        size = fetcher.fetch_segmented(f"{self.base}/video", filepath, len(BODY), connections=4, stall_timeout=5)
+        self.assertEqual(size, len(BODY))
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertFalse(os.path.exists(filepath + '.part'))
+        self.assertFalse(os.path.exists(fetcher.sidecar_path(filepath)))
+        self.assertGreater(len({end for _, end in self.server.ranges}), 1)
+
+    def test_dropped_segment_resumes(self):
+        filepath = os.path.join(self.folder, 'video.mp4')
+        fetcher.fetch_segmented(f"{self.base}/video", filepath, len(BODY), connections=2, stall_timeout=5)
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        # Both halves are longer than DROP_AFTER, so each was cut at least once and
+        # picked up from where it stopped: no byte offset was requested twice
+        starts = [start for start, _ in self.server.ranges]
+        self.assertGreater(len(starts), 2)
+        self.assertEqual(len(starts), len(set(starts)))
+
+    def test_falls_back_without_range_support(self):
+        filepath = os.path.join(self.folder, 'video.mp4')
+        size = fetcher.fetch_segmented(f"{self.base}/noranges", filepath, len(BODY), connections=4, stall_timeout=5)
+        self.assertEqual(size, len(BODY))
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertFalse(os.path.exists(fetcher.sidecar_path(filepath)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# tests/test_file_index.py
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_index import FolderIndex  # noqa: E402
+
+
+class FolderIndexRescanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.write('done.mp4', b'x' * 100)
+        self.index = FolderIndex(self.folder)
+        self.index.rescan()
+
+    def write(self, name, data=b'x'):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            f.write(data)
+
+    def changed(self):
+        """Rescan after making sure the folder's mtime moved on"""
+        stat = os.stat(self.folder)
+        os.utime(self.folder, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        generation = self.index.generation
+        self.index.rescan()
+        return self.index.generation != generation
+
+    def test_checkpoints_do_not_change_the_index(self):
+        # What a resumable fetch does at each checkpoint
+        self.write('video.mp4.part')
+        self.assertFalse(self.changed())
+        self.write('video.mp4.part.json.tmp')
+        os.replace(os.path.join(self.folder, 'video.mp4.part.json.tmp'), os.path.join(self.folder, 'video.mp4.part.json'))
+        self.assertFalse(self.changed())
+        self.assertEqual([name for name, _ in self.index.page()[0]], ['done.mp4'])
+
+    def test_new_and_removed_files(self):
+        self.write('new.mp4', b'x' * 50)
+        self.assertTrue(self.changed())
+        self.assertEqual(self.index.get('new.mp4')[0], 50)
+        os.remove(os.path.join(self.folder, 'done.mp4'))
+        self.assertTrue(self.changed())
+        self.assertIsNone(self.index.get('done.mp4'))
+        self.assertEqual(len(self.index), 1)
+
+    def test_unchanged_folder_is_not_listed(self):
+        self.index.rescan()
+        os.remove(os.path.join(self.folder, 'done.mp4'))
+        stat = os.stat(self.folder)
+        # Same mtime as the last scan: nothing is read, the stale entry stays
+        self.index._folder_mtime = stat.st_mtime_ns
+        self.index.rescan()
+        self.assertIsNotNone(self.index.get('done.mp4'))
+
+
+if __name__ == '__main__':
+    unittest.main()
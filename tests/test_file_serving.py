@@ -0,0 +1,103 @@
+# tests/test_file_serving.py
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_serving import send_download  # noqa: E402
+
+BODY = os.urandom(10000)
+
+
+class SendDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.filepath = os.path.join(self.folder, 'video.mp4')
+        with open(self.filepath, 'wb') as f:
+            f.write(BODY)
+        self.closed = 0
+
+        app = Flask(__name__)
+
+        @app.route('/file')
+        def serve():
+            return send_download(self.filepath, 'Clip.mp4', on_close=self.on_close)
+
+        self.client = app.test_client()
+
+    def on_close(self):
+        self.closed += 1
+
+    def get(self, **headers):
+        response = self.client.get('/file', headers=headers)
+        response.close()
+        return response
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, BODY)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn("filename*=UTF-8''Clip.mp4", response.headers['Content-Disposition'])
+        self.assertEqual(self.closed, 1)
+
+    def test_byte_range(self):
+        response = self.get(Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, BODY[100:200])
+        self.assertEqual(response.headers['Content-Range'], f"bytes 100-199/{len(BODY)}")
+        self.assertEqual(response.headers['Content-Length'], '100')
+
+    def test_suffix_range(self):
+        response = self.get(Range='bytes=-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, BODY[-500:])
+        self.assertEqual(response.headers['Content-Range'], f"bytes {len(BODY) - 500}-{len(BODY) - 1}/{len(BODY)}")
+
+    def test_open_ended_range(self):
+        response = self.get(Range='bytes=9000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, BODY[9000:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f'bytes={len(BODY)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f"bytes */{len(BODY)}")
+        self.assertEqual(response.data, b'')
+        self.assertEqual(self.closed, 1)
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.get(Range='bytes=0-99', **{'If-Range': '"stale-etag"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, BODY)
+
+    def test_if_range_match_sends_range(self):
+        etag = self.get().headers['ETag']
+        response = self.get(Range='bytes=0-99', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, BODY[:100])
+
+    def test_if_none_match(self):
+        etag = self.get().headers['ETag']
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.get(**{'If-None-Match': '"other"'}).status_code, 200)
+        self.assertEqual(self.closed, 3)
+
+    def test_if_modified_since(self):
+        last_modified = self.get().headers['Last-Modified']
+        self.assertEqual(self.get(**{'If-Modified-Since': last_modified}).status_code, 304)
+        self.assertEqual(self.get(**{'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
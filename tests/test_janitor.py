@@ -0,0 +1,90 @@
+# tests/test_janitor.py
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_index import FolderIndex, is_temporary  # noqa: E402
+from janitor import DiskJanitor  # noqa: E402
+
+
+class DiskJanitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.now = time.time()
+
+    def write(self, name, size=1000, age=0):
+        """A file last used and modified `age` seconds ago"""
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (self.now - age, self.now - age))
+        return path
+
+    def janitor(self, **limits):
+        index = FolderIndex(self.folder)
+        index.rescan()
+        return DiskJanitor(index, grace=0, **limits)
+
+    def remaining(self):
+        return sorted(os.listdir(self.folder))
+
+    def test_expires_unused_files(self):
+        self.write('old.mp4', age=3 * 3600)
+        self.write('new.mp4', age=60)
+        janitor = self.janitor(max_age=3600)
+        self.assertEqual(janitor.sweep(), 1000)
+        self.assertEqual(self.remaining(), ['new.mp4'])
+        self.assertEqual(janitor.evicted_files, 1)
+
+    def test_quota_removes_least_recently_used_first(self):
+        self.write('a.mp4', age=300)
+        self.write('b.mp4', age=100)
+        self.write('c.mp4', age=200)
+        self.write('d.mp4', age=400)
+        janitor = self.janitor(quota_bytes=2500)
+        self.assertEqual(janitor.sweep(), 2000)
+        self.assertEqual(self.remaining(), ['b.mp4', 'c.mp4'])
+
+    def test_served_file_counts_as_recent(self):
+        self.write('a.mp4', age=300)
+        served = self.write('b.mp4', age=400)
+        janitor = self.janitor(quota_bytes=1500)
+        janitor.touch(served)
+        janitor.sweep()
+        self.assertEqual(self.remaining(), ['b.mp4'])
+
+    def test_held_file_is_kept(self):
+        held = self.write('a.mp4', age=3 * 3600)
+        janitor = self.janitor(max_age=3600)
+        janitor.hold(held)
+        self.assertEqual(janitor.sweep(), 0)
+        janitor.release(held)
+        self.assertEqual(janitor.sweep(), 1000)
+
+    def test_skips_temporary_files(self):
+        temporaries = ['a.mp4.part', 'a.mp4.part.json', 'b [id].f137.mp4', 'b [id].f251.webm',
+                       'b [id].temp.mp4', 'b [id].webp', 'b [id].jpg', 'c.m4a.tmp']
+        for name in temporaries:
+            self.write(name, age=3 * 3600)
+        self.write('done.mp4', age=3 * 3600)
+        janitor = self.janitor(max_age=3600, quota_bytes=1)
+        self.assertEqual(len(janitor.index), 1)
+        self.assertEqual(janitor.sweep(), 1000)
+        self.assertEqual(self.remaining(), sorted(temporaries))
+
+    def test_is_temporary(self):
+        for name in ('a.mp4.part', 'a.ytdl', 'a.f137.mp4', 'a.f251-drc.webm', 'a.temp.mkv', 'a.webp', 'a.PNG'):
+            self.assertTrue(is_temporary(name), name)
+        for name in ('a.mp4', 'a.mkv', 'a.m4a', 'Vol. 2.mp3', 'a.final.mp4'):
+            self.assertFalse(is_temporary(name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
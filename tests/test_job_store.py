@@ -0,0 +1,130 @@
+# tests/test_job_store.py
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_store import RedisJobStore, SQLiteJobStore  # noqa: E402
+from jobs import SharedJobRegistry  # noqa: E402
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL') or 'redis://localhost:6379/15'
+
+
+class JobStoreCases:
+    """Runs against whichever store make_store() returns"""
+
+    def setUp(self):
+        self.store = self.make_store()
+        self.registry = SharedJobRegistry(self.store)
+
+    def test_apply_round_trip(self):
+        self.store.replace('job', {'status': 'queued', 'progress': 0, 'title': 'Clip'})
+        self.assertTrue(self.store.update('job', {'status': 'downloading', 'progress': 40}))
+        self.assertTrue(self.store.unset('job', ['title']))
+        self.assertEqual(self.store.load('job'), {'status': 'downloading', 'progress': 40})
+        self.assertEqual(self.store.load_many(['job', 'nope']), {'job': {'status': 'downloading', 'progress': 40}})
+        self.assertTrue(self.store.remove('job'))
+        self.assertIsNone(self.store.load('job'))
+        self.assertFalse(self.store.update('job', {'progress': 50}))
+        self.assertFalse(self.store.remove('job'))
+
+    def test_changed_since(self):
+        self.registry['a'] = {'status': 'queued'}
+        self.registry['b'] = {'status': 'queued'}
+        since = self.registry.version
+        self.assertEqual(self.registry.changed_since(['a', 'b'], since), [])
+        self.registry['a']['progress'] = 10
+        self.assertEqual(self.registry.changed_since(['a', 'b'], since), ['a'])
+        del self.registry['b']
+        self.assertEqual(self.registry.changed_since(['a', 'b'], since), ['a', 'b'])
+
+    def test_wait_for_change(self):
+        self.registry['job'] = {'status': 'downloading'}
+        since = self.registry.job_version('job')
+        self.assertEqual(self.registry.wait_for_change('job', since, timeout=0.1), since)
+
+        threading.Timer(0.2, lambda: self.store.update('job', {'progress': 60})).start()
+        started = time.monotonic()
+        version = self.registry.wait_for_change('job', since, timeout=5)
+        self.assertGreater(version, since)
+        self.assertLess(time.monotonic() - started, 4)
+
+        self.store.remove('job')
+        self.assertEqual(self.registry.wait_for_change('job', version, timeout=5), 0)
+
+    def test_child_changes_roll_up_to_parent(self):
+        self.registry['playlist'] = {'status': 'downloading', 'type': 'playlist'}
+        self.registry['item'] = {'status': 'queued', 'parent_playlist': 'playlist'}
+        since = self.registry.job_version('playlist')
+        self.registry['item']['progress'] = 30
+        self.assertGreater(self.registry.job_version('playlist'), since)
+        since = self.registry.job_version('playlist')
+        self.registry['item'].pop('progress')
+        self.assertGreater(self.registry.job_version('playlist'), since)
+
+    def test_children_evicted_with_parent(self):
+        self.registry['playlist'] = {'status': 'completed', 'type': 'playlist'}
+        self.registry['item'] = {'status': 'completed', 'parent_playlist': 'playlist'}
+        self.registry['running'] = {'status': 'downloading'}
+        archived = []
+        removed = self.registry.evict_finished(0, 100, on_evict=lambda job_id, state: archived.append(job_id))
+        self.assertEqual(removed, 2)
+        self.assertEqual(archived, ['playlist'])
+        self.assertEqual(sorted(self.registry), ['running'])
+
+    def test_eviction_keeps_most_recently_used(self):
+        for job_id in ('old', 'mid', 'new'):
+            self.registry[job_id] = {'status': 'completed'}
+            time.sleep(0.01)
+        self.registry.evict_finished(3600, 1)
+        self.assertEqual(sorted(self.registry), ['new'])
+
+    def test_take_tokens(self):
+        self.assertEqual(self.store.take_tokens('client', 2, 1, 2), (True, 0.0))
+        allowed, retry_after = self.store.take_tokens('client', 2, 1, 1)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+
+
+class SQLiteJobStoreTest(JobStoreCases, unittest.TestCase):
+
+    def make_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        return SQLiteJobStore(os.path.join(directory, 'jobs.db'))
+
+
+class RedisJobStoreTest(JobStoreCases, unittest.TestCase):
+    """Needs a Redis server at TEST_REDIS_URL (default: database 15 on localhost); skipped otherwise"""
+
+    def make_store(self):
+        try:
+            store = RedisJobStore(REDIS_URL, prefix=f'test-{uuid.uuid4().hex}:')
+            store._redis.ping()
+        except Exception as e:
+            self.skipTest(f"no Redis server at {REDIS_URL}: {e}")
+        self.addCleanup(self._drop_keys, store)
+        return store
+
+    @staticmethod
+    def _drop_keys(store):
+        keys = list(store._redis.scan_iter(f'{store.prefix}*'))
+        if keys:
+            store._redis.delete(*keys)
+
+    def test_update_refused_when_parent_differs(self):
+        self.registry['playlist'] = {'status': 'downloading'}
+        self.registry['item'] = {'status': 'queued', 'parent_playlist': 'playlist'}
+        # A caller that declares the wrong parent is refused instead of writing an undeclared key
+        self.assertEqual(self.store._apply('update', 'item', 'other', args=['progress', '1']), -1)
+        self.assertEqual(self.store.load('item'), {'status': 'queued', 'parent_playlist': 'playlist'})
+
+
+if __name__ == '__main__':
+    unittest.main()
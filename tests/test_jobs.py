@@ -0,0 +1,58 @@
+# tests/test_jobs.py
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobRegistry  # noqa: E402
+
+
+class JobRegistryVersionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = JobRegistry()
+
+    def test_pop_and_delete_forget_versions(self):
+        for i in range(1000):
+            self.registry[f'pop-{i}'] = {'status': 'queued', 'progress': 0}
+            self.registry[f'pop-{i}']['progress'] = 50
+            self.registry.pop(f'pop-{i}')
+            self.registry[f'del-{i}'] = {'status': 'queued'}
+            del self.registry[f'del-{i}']
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(len(self.registry._versions), 0)
+
+    def test_detached_record_does_not_resurrect_version(self):
+        self.registry['job'] = {'status': 'downloading'}
+        record = self.registry.pop('job')
+        record['progress'] = 90      # a running download still holds its record
+        self.assertEqual(len(self.registry._versions), 0)
+
+    def test_child_of_removed_parent_does_not_track_parent(self):
+        self.registry['child'] = {'status': 'queued', 'parent_playlist': 'parent'}
+        self.registry['child']['progress'] = 10
+        self.assertEqual(set(self.registry._versions), {'child'})
+
+    def test_delete_wakes_waiter(self):
+        self.registry['job'] = {'status': 'downloading'}
+        since = self.registry.job_version('job')
+        seen = []
+        waiter = threading.Thread(target=lambda: seen.append(self.registry.wait_for_change('job', since, timeout=5)))
+        waiter.start()
+        del self.registry['job']
+        waiter.join(5)
+        self.assertEqual(seen, [0])
+        self.assertEqual(self.registry.wait_for_change('job', since, timeout=5), 0)
+
+    def test_changed_since_reports_removed_jobs(self):
+        self.registry['kept'] = {'status': 'queued'}
+        self.registry['gone'] = {'status': 'queued'}
+        since = self.registry.version
+        self.registry.pop('gone')
+        self.assertEqual(self.registry.changed_since(['kept', 'gone'], since), ['gone'])
+
+
+if __name__ == '__main__':
+    unittest.main()
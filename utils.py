@@ -2,8 +2,10 @@
 import os
 import re
 import json
+import math
+import threading
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from functools import wraps
 from flask import request, jsonify
 
@@ -65,27 +67,48 @@ def is_valid_youtube_url(url):
     
     return any(re.match(pattern, url.strip()) for pattern in patterns)
 
-def cleanup_old_files(download_folder, days=7):
-    """Remove files older than specified days"""
-    try:
-        cutoff_time = time.time() - (days * 24 * 60 * 60)
-        removed_count = 0
-        
-        for filename in os.listdir(download_folder):
-            filepath = os.path.join(download_folder, filename)
-            
-            if os.path.isfile(filepath):
-                file_time = os.path.getmtime(filepath)
-                if file_time < cutoff_time:
-                    try:
-                        os.remove(filepath)
-                        removed_count += 1
-                    except OSError:
-                        pass  # File might be in use or permission denied
-        
-        return removed_count
-    except Exception:
-        return 0
+def extract_youtube_id(url):
+    """Return ('playlist', list_id) or ('video', video_id) for a YouTube URL, or None"""
+    if not url or not isinstance(url, str):
+        return None
+
+    url = url.strip()
+    playlist_match = re.search(r'[?&]list=([\w-]+)', url)
+    if playlist_match:
+        return ('playlist', playlist_match.group(1))
+
+    patterns = [
+        r'youtube\.com/watch\?(?:.*&)?v=([\w-]{11})',
+        r'youtu\.be/([\w-]{11})',
+        r'youtube\.com/embed/([\w-]{11})',
+        r'youtube\.com/v/([\w-]{11})',
+        r'youtube\.com/shorts/([\w-]{11})'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return ('video', match.group(1))
+
+    return None
+
+def canonical_youtube_url(url):
+    """The standard watch or playlist URL for any form of YouTube link (watch,
+    youtu.be, embed, /v/, shorts), or None if url is not one"""
+    if not url or not isinstance(url, str) or not re.search(r'(?:^|[/.])(?:youtube\.com|youtu\.be)/', url.strip()):
+        return None
+    media_id = extract_youtube_id(url)
+    if media_id is None:
+        return None
+    if media_id[0] == 'playlist':
+        return f"https://www.youtube.com/playlist?list={media_id[1]}"
+    return f"https://www.youtube.com/watch?v={media_id[1]}"
+
+def canonical_cache_key(url):
+    """Stable cache key for a URL: its video/playlist ID when known"""
+    media_id = extract_youtube_id(url)
+    if media_id:
+        return f"{media_id[0]}:{media_id[1]}"
+    return f"url:{(url or '').strip()}"
 
 def get_file_size(filepath):
     """Get file size safely"""
@@ -117,34 +140,61 @@ def validate_json_request(required_fields=None):
         return decorated_function
     return decorator
 
-def rate_limit(max_requests=10, window_minutes=1):
-    """Simple rate limiting decorator"""
-    requests = {}
-    
+class RateLimiter:
+    """Token bucket per client: capacity requests at once, refilled at per_minute per minute.
+
+    Each check is O(1). Buckets live in an LRU map capped at max_clients;
+    dropping the least recently seen client only forgets a bucket that has
+    mostly refilled anyway. With a shared store (one providing
+    take_tokens(), see job_store.py) the buckets are kept there instead, so
+    every worker process draws on the same budget.
+    """
+
+    def __init__(self, name, per_minute, capacity=None, max_clients=10000, store=None):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity or per_minute)
+        self.max_clients = max_clients
+        self.store = store
+        self._buckets = OrderedDict()    # client -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, client, cost=1):
+        """Spend cost tokens of client's budget; returns (allowed, seconds until it would be allowed)"""
+        if self.store is not None:
+            return self.store.take_tokens(f"{self.name}:{client}", self.capacity, self.rate, cost)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+def rate_limit(limiter, cost=1):
+    """Decorator answering 429 with Retry-After once the client's budget in limiter is spent.
+
+    cost may be a function of the request; a cost above the budget's
+    capacity is charged as the whole budget, so the request can still pass.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            client_ip = request.remote_addr
-            current_time = datetime.now()
-            
-            # Clean old requests
-            cutoff_time = current_time - timedelta(minutes=window_minutes)
-            if client_ip in requests:
-                requests[client_ip] = [
-                    req_time for req_time in requests[client_ip] 
-                    if req_time > cutoff_time
-                ]
-            
-            # Check rate limit
-            if client_ip not in requests:
-                requests[client_ip] = []
-            
-            if len(requests[client_ip]) >= max_requests:
-                return jsonify({
-                    'error': 'Rate limit exceeded. Please try again later.'
-                }), 429
-            
-            requests[client_ip].append(current_time)
+            charge = min(cost() if callable(cost) else cost, limiter.capacity)
+            allowed, retry_after = limiter.take(request.remote_addr or 'unknown', charge)
+            if not allowed:
+                retry_after = max(1, math.ceil(retry_after))
+                response = jsonify({
+                    'error': 'Rate limit exceeded. Please try again later.',
+                    'retry_after': retry_after
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -187,11 +237,17 @@ def get_video_info_safe(url):
         
         if 'playlist' in url:
             playlist = Playlist(url)
+            # The count shown in the playlist header needs only the first page;
+            # listing every video would fetch them all
+            try:
+                video_count = playlist.length
+            except Exception:
+                video_count = None
             return {
                 'type': 'playlist',
                 'title': playlist.title or 'Unknown Playlist',
-                'video_count': len(list(playlist.video_urls)),
-                'description': f"Playlist with {len(list(playlist.video_urls))} videos"
+                'video_count': video_count,
+                'description': f"Playlist with {video_count} videos" if video_count else "Playlist"
             }
         else:
             yt = YouTube(url)
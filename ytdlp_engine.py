@@ -0,0 +1,266 @@
+# ytdlp_engine.py
+"""Embedded yt-dlp backend.
+
+Drives yt-dlp's Python API from a pool of long-lived worker processes, so
+the interpreter start-up and extractor import cost is paid once per worker
+instead of once per lookup or download. Progress hook events are sent back
+over a queue and delivered to per-job callbacks in the web process.
+"""
+import concurrent.futures
+import importlib.util
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+AVAILABLE = importlib.util.find_spec('yt_dlp') is not None
+
+# Minimum seconds between progress events sent for one job
+PROGRESS_INTERVAL = 0.25
+
+_progress_queue = None
+_alarm_fired = [False]
+
+
+class DownloadStalled(Exception):
+    """A download made no progress for its stall timeout; its worker is free and it can be resumed"""
+    pass
+
+
+def _on_alarm(signum, frame):
+    _alarm_fired[0] = True
+    raise DownloadStalled()
+
+
+def _wait_for_threads(threads, timeout):
+    """Join threads within timeout overall; True if they all ended"""
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    return not any(thread.is_alive() for thread in threads)
+
+
+def _arm_watchdog(seconds):
+    """Interrupt this worker's current job after seconds without being re-armed; 0 disarms.
+    Relies on SIGALRM, so there is no in-worker watchdog on Windows"""
+    if hasattr(signal, 'setitimer'):
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def _init_worker(progress_queue):
+    """Warm up a worker: import yt-dlp and load its extractors once"""
+    global _progress_queue
+    _progress_queue = progress_queue
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _on_alarm)
+    import yt_dlp
+    list(yt_dlp.extractor.gen_extractor_classes())
+
+
+def _summarize_info(info):
+    """Keep only the fields the app uses, so results stay cheap to pickle"""
+    description = info.get('description') or ''
+    heights = {f.get('height') for f in info.get('formats') or [] if f.get('height')}
+    summary = {
+        'type': 'playlist' if info.get('_type') == 'playlist' else 'video',
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'thumbnail': info.get('thumbnail') or '',
+        'duration': info.get('duration') or 0,
+        'description': description,
+        'available_qualities': [f"{h}p" for h in sorted(heights, reverse=True)],
+    }
+    if summary['type'] == 'playlist':
+        summary['video_count'] = info.get('playlist_count')
+    return summary
+
+
+def _extract_in_worker(url, params):
+    import yt_dlp
+    try:
+        params = dict(params, quiet=True, no_warnings=True, extract_flat='in_playlist')
+        with yt_dlp.YoutubeDL(params) as ydl:
+            info = ydl.extract_info(url, download=False)
+        return {'info': _summarize_info(info)}
+    except Exception as e:
+        # yt-dlp exceptions carry tracebacks that do not pickle; send text only
+        return {'error': str(e)}
+
+
+def _download_in_worker(job_id, url, params, stall_timeout=None):
+    import yt_dlp
+    last_sent = [0.0]
+    result = {'filepath': None}
+
+    def progress_hook(d):
+        # SIGALRM only interrupts the main thread; fragment threads
+        # (concurrent_fragment_downloads) give up at their next progress event
+        if _alarm_fired[0]:
+            raise DownloadStalled()
+        if stall_timeout:
+            _arm_watchdog(stall_timeout)
+        now = time.monotonic()
+        finished = d.get('status') == 'finished'
+        if not finished and now - last_sent[0] < PROGRESS_INTERVAL:
+            return
+        last_sent[0] = now
+        _progress_queue.put((job_id, {
+            'status': d.get('status'),
+            'downloaded_bytes': d.get('downloaded_bytes'),
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+            'speed': d.get('speed'),
+            'eta': d.get('eta'),
+            'title': (d.get('info_dict') or {}).get('title'),
+        }))
+
+    def postprocessor_hook(d):
+        if d.get('status') == 'started':
+            _arm_watchdog(0)  # ffmpeg steps report no progress
+        if d.get('status') == 'finished':
+            result['filepath'] = (d.get('info_dict') or {}).get('filepath') or result['filepath']
+
+    _alarm_fired[0] = False
+    threads_before = set(threading.enumerate())
+    try:
+        params = dict(params, quiet=True, no_warnings=True, noprogress=True,
+                      progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook])
+        if stall_timeout:
+            _arm_watchdog(stall_timeout)
+        with yt_dlp.YoutubeDL(params) as ydl:
+            info = ydl.extract_info(url, download=True)
+        downloads = info.get('requested_downloads') or [{}]
+        result['filepath'] = downloads[-1].get('filepath') or result['filepath']
+        result['title'] = info.get('title')
+        return result
+    except Exception as e:
+        # yt-dlp may have wrapped the watchdog's exception in its own
+        if _alarm_fired[0]:
+            _arm_watchdog(0)
+            # The retry must not start while threads of this attempt still write its files
+            leftover = [thread for thread in threading.enumerate() if thread not in threads_before and not thread.daemon]
+            return {'error': f"No progress for {stall_timeout} seconds", 'stalled': True,
+                    'recycle': not _wait_for_threads(leftover, stall_timeout)}
+        return {'error': str(e)}
+    finally:
+        _arm_watchdog(0)
+
+
+class YtdlpEngine:
+    """Pool of warm yt-dlp worker processes"""
+
+    def __init__(self, workers=2):
+        self.workers = max(1, int(workers))
+        self._executor = None
+        self._progress_queue = None
+        self._callbacks = {}
+        self._last_event = {}        # job_id -> monotonic time of its last progress event
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the worker processes on first use"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            # forkserver children are forked from a server process that has
+            # already imported yt-dlp, so new workers start warm
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['yt_dlp'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            # One progress queue for the engine's lifetime, shared with pools started by _recycle
+            if self._progress_queue is None:
+                self._progress_queue = context.Queue()
+                listener = threading.Thread(target=self._dispatch_progress, name='ytdlp-progress')
+                listener.daemon = True
+                listener.start()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue,)
+            )
+            # Warm every worker now rather than on the first real request
+            for _ in range(self.workers):
+                self._executor.submit(time.sleep, 0)
+
+    def extract_info(self, url, params, timeout=45):
+        """Return a summary of the video/playlist metadata; raises on failure"""
+        self.start()
+        outcome = self._executor.submit(_extract_in_worker, url, params).result(timeout=timeout)
+        if 'error' in outcome:
+            raise Exception(outcome['error'])
+        return outcome['info']
+
+    def download(self, job_id, url, params, on_progress=None, stall_timeout=None):
+        """Download url with the given yt-dlp params; returns {'filepath', 'title'}.
+
+        With stall_timeout, a download that reports no progress for that long
+        is interrupted in its worker and DownloadStalled is raised, so the
+        caller can resume it. A worker whose fragment threads do not stop is
+        retired with its pool, so the retry runs in a fresh process. Should
+        the worker not respond at all, the wait is abandoned after three
+        times as long.
+        """
+        self.start()
+        with self._lock:
+            if on_progress:
+                self._callbacks[job_id] = on_progress
+            self._last_event[job_id] = time.monotonic()
+        try:
+            future = self._executor.submit(_download_in_worker, job_id, url, params, stall_timeout)
+            outcome = self._wait(job_id, future, stall_timeout * 3) if stall_timeout else future.result()
+        finally:
+            with self._lock:
+                self._callbacks.pop(job_id, None)
+                self._last_event.pop(job_id, None)
+        if outcome.get('stalled'):
+            if outcome.get('recycle'):
+                self._recycle()
+            raise DownloadStalled(outcome['error'])
+        if 'error' in outcome:
+            raise Exception(outcome['error'])
+        return outcome
+
+    def _wait(self, job_id, future, silence_limit):
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                with self._lock:
+                    silent = time.monotonic() - self._last_event.get(job_id, 0)
+                if silent > silence_limit:
+                    raise Exception(f"yt-dlp worker stopped responding ({int(silent)} seconds without progress)")
+
+    def _recycle(self):
+        """Replace the worker pool: new jobs go to fresh processes while the old
+        ones finish what they are running and exit"""
+        print("yt-dlp worker did not stop its download threads, starting a fresh worker pool")
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.start()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _dispatch_progress(self):
+        while True:
+            try:
+                job_id, event = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                callback = self._callbacks.get(job_id)
+                if job_id in self._last_event:
+                    self._last_event[job_id] = time.monotonic()
+            if callback:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Progress callback error for {job_id}: {str(e)}")